@@ -0,0 +1,183 @@
+# flake8: noqa: E501
+"""Cache for remote assets: TLE sets, the PoP list and the ground station map.
+
+Assets are stored on disk under ASSET_CACHE_DIR, next to a small JSON file
+holding the validators the server sent (ETag, Last-Modified) and when the
+copy was last checked. Within its TTL a cached copy is used as is. After
+that, it is revalidated with a conditional GET, so an unchanged asset costs
+a 304 response instead of a full download. If the server cannot be reached
+or fails, the cached copy is used regardless of its age, so the collector
+and the plots keep working offline.
+
+All downloads share one pooled HTTP client. Hits, revalidations, downloads,
+stale uses and failures are counted per asset in the asset_requests_total
+metric.
+
+    content = fetch(TLE_URL, ttl=TLE_CACHE_TTL, name="starlink.tle")
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+import metrics
+from config import ASSET_CACHE_DIR, ASSET_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class AssetUnavailable(Exception):
+    """Raised when an asset can neither be downloaded nor served from the cache."""
+
+
+def get_client():
+    """Return the shared HTTP client, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            import httpx
+
+            _client = httpx.Client(timeout=ASSET_TIMEOUT, follow_redirects=True)
+        return _client
+
+
+def _write_atomic(path, data):
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+class AssetCache:
+    """On-disk cache of remote assets.
+
+    Args:
+        directory: Where cached copies are stored.
+        client: httpx.Client to download with, by default the shared one.
+    """
+
+    def __init__(self, directory=ASSET_CACHE_DIR, client=None):
+        self.directory = Path(directory)
+        self.client = client
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.duration = metrics.histogram("asset_fetch_seconds", "Time taken to download or revalidate a remote asset")
+
+    def _lock(self, name):
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def paths(self, url, name=None):
+        """Return the (content, metadata) paths for a URL."""
+        name = name or hashlib.sha256(url.encode()).hexdigest()[:16]
+        return self.directory.joinpath(name), self.directory.joinpath(f"{name}.meta.json")
+
+    def _count(self, name, result):
+        metrics.counter("asset_requests_total", "Remote asset requests, by result", {"asset": name, "result": result}).inc()
+
+    def fetch(self, url, ttl, name=None):
+        """Return the content of `url`, from the cache if it is fresh.
+
+        Args:
+            url: Asset URL.
+            ttl: Seconds a cached copy is used without revalidating it.
+            name: File name of the cached copy, and metric label. Defaults to
+                a hash of the URL.
+
+        Raises:
+            AssetUnavailable: The asset could not be downloaded and there is
+                no cached copy.
+        """
+        path, meta_path = self.paths(url, name)
+        name = path.name
+        with self._lock(name):
+            meta = {}
+            if path.exists() and meta_path.exists():
+                try:
+                    meta = json.loads(meta_path.read_text())
+                except ValueError:
+                    meta = {}
+            if meta.get("url") != url:
+                meta = {}
+
+            if meta and time.time() - meta.get("checked", 0) < ttl:
+                self._count(name, "hit")
+                return path.read_bytes()
+
+            headers = {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+            client = self.client or get_client()
+            start = time.monotonic()
+            try:
+                response = client.get(url, headers=headers)
+                if response.status_code != 304:
+                    response.raise_for_status()
+            except Exception as e:
+                if meta:
+                    age = time.time() - meta.get("fetched", 0)
+                    logger.warning(f"Failed to refresh {name}, using cached copy from {age / 3600:.1f} hours ago: {e}")
+                    self._count(name, "stale")
+                    return path.read_bytes()
+                self._count(name, "error")
+                raise AssetUnavailable(f"{url}: {e}") from e
+            finally:
+                self.duration.observe(time.monotonic() - start)
+
+            now = time.time()
+            if response.status_code == 304:
+                content = path.read_bytes()
+                self._count(name, "revalidated")
+            else:
+                content = response.content
+                self.directory.mkdir(parents=True, exist_ok=True)
+                _write_atomic(path, content)
+                meta = {"url": url, "fetched": now}
+                self._count(name, "miss")
+                logger.info(f"Downloaded {name}, {len(content)} bytes")
+            meta["checked"] = now
+            for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+                if response.headers.get(header):
+                    meta[key] = response.headers[header]
+            _write_atomic(meta_path, json.dumps(meta).encode())
+            return content
+
+    def fetch_path(self, url, ttl, name=None):
+        """Like `fetch`, but return the path of the cached copy."""
+        self.fetch(url, ttl, name)
+        return self.paths(url, name)[0]
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AssetCache()
+    return _default_cache
+
+
+def fetch(url, ttl, name=None):
+    """`AssetCache.fetch` on the default cache."""
+    return default_cache().fetch(url, ttl, name)
+
+
+def fetch_path(url, ttl, name=None):
+    """`AssetCache.fetch_path` on the default cache."""
+    return default_cache().fetch_path(url, ttl, name)
@@ -0,0 +1,243 @@
+# flake8: noqa: E501
+"""Recompute serving satellites for archived obstruction map runs.
+
+Runs are discovered from the obstruction_map-<id>.parquet files under
+DATA_DIR/grpc/<date>/ and matched against the TLE snapshot taken closest to,
+but not after, the start of each run. Timeslots are split across a process
+pool. Finished timeslots are appended to a progress file next to the output,
+so an interrupted backfill picks up where it stopped when run again.
+
+Example:
+    python backfill.py --lat 49.2 --lon -123.1 --alt 80 --from 2025-04-12 --to 2025-04-13
+    python backfill.py --lat 49.2 --lon -123.1 --alt 80 --id 2025-04-13-04-00-00
+"""
+
+import os
+import re
+import csv
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import config
+import util  # noqa: F401 configures logging
+from obstruction import process_obstruction_maps, read_obstruction_map_parquet
+from satellites import convert_observed, process
+from slots import group_by_slot, slot_start
+from skyfield.api import load
+
+logger = logging.getLogger(__name__)
+
+RUN_PATTERN = re.compile(r"^obstruction_map-(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})\.parquet$")
+RESULT_COLUMNS = ["Timestamp", "Connected_Satellite", "Distance"]
+
+# Per worker process state, set up once by _init_worker
+_worker = {}
+
+
+def discover_runs(data_dir, run_ids=None, date_from=None, date_to=None):
+    """Return sorted (run_id, parquet path) pairs selected by ID or date range."""
+    runs = []
+    for path in Path(data_dir).joinpath("grpc").glob("*/obstruction_map-*.parquet"):
+        match = RUN_PATTERN.match(path.name)
+        if not match:
+            continue
+        run_id = match.group(1)
+        run_date = run_id[:10]
+        if run_ids and run_id not in run_ids:
+            continue
+        if date_from and run_date < date_from:
+            continue
+        if date_to and run_date > date_to:
+            continue
+        runs.append((run_id, path))
+    return sorted(runs)
+
+
+def find_tle_file(data_dir, run_id):
+    """Return the newest TLE snapshot taken at or before the run, or the oldest one after it."""
+    tle_files = sorted(Path(data_dir).joinpath("TLE", run_id[:10]).glob("starlink-tle-*.txt"))
+    if not tle_files:
+        return None
+    earlier = [f for f in tle_files if f.stem[len("starlink-tle-"):] <= run_id]
+    return earlier[-1] if earlier else tle_files[0]
+
+
+def load_orientation(data_dir, run_id):
+    """Return the median (tilt, azimuth) recorded by the SINR sampler for a run, if any."""
+    status_file = Path(data_dir).joinpath("grpc", run_id[:10], f"GRPC_STATUS-{run_id}.csv")
+    if not status_file.exists():
+        return None
+    df = pd.read_csv(status_file)
+    if df.empty:
+        return None
+    return df["tiltAngleDeg"].median(), df["boresightAzimuthDeg"].median()
+
+
+def slot_starts(df_obstruction_map):
+    """Return the UTC start time of every timeslot that has obstruction map samples."""
+    return [
+        datetime.fromtimestamp(slot_start(slot), tz=timezone.utc)
+        for slot, _ in group_by_slot(df_obstruction_map)
+    ]
+
+
+def _init_worker(tle_file, latitude, longitude, altitude, filename, merged_data_file, frame_type):
+    config.LATITUDE = latitude
+    config.LONGITUDE = longitude
+    config.ALTITUDE = altitude
+    _worker["satellites"] = load.tle_file(str(tle_file))
+    _worker["filename"] = filename
+    _worker["merged_data_file"] = merged_data_file
+    _worker["frame_type"] = frame_type
+
+
+def _process_slot(slot_time):
+    _, matching_satellites, distances = process(
+        _worker["filename"],
+        slot_time.year,
+        slot_time.month,
+        slot_time.day,
+        slot_time.hour,
+        slot_time.minute,
+        slot_time.second,
+        _worker["merged_data_file"],
+        _worker["satellites"],
+        _worker["frame_type"],
+    )
+    rows = []
+    if matching_satellites:
+        for second in range(min(15, len(distances))):
+            rows.append(
+                [
+                    slot_time + timedelta(seconds=second),
+                    matching_satellites[0],
+                    distances[second],
+                ]
+            )
+    return slot_time, rows
+
+
+def backfill_run(run_id, parquet_file, out_dir, workers, tilt=None, azimuth=None):
+    """Recompute serving satellites for one run.
+
+    Returns:
+        A tuple of (slots processed, seconds spent), or None if the run was
+        skipped.
+    """
+    tle_file = find_tle_file(config.DATA_DIR, run_id)
+    if tle_file is None:
+        logger.error(f"[{run_id}] No TLE snapshot found, skipping")
+        return None
+
+    df_obstruction_map = read_obstruction_map_parquet(parquet_file)
+    if df_obstruction_map.empty:
+        logger.warning(f"[{run_id}] Empty obstruction map file, skipping")
+        return None
+    frame_type = int(df_obstruction_map["frame_type"].iloc[0])
+
+    if tilt is None or azimuth is None:
+        orientation = load_orientation(config.DATA_DIR, run_id)
+        if orientation is None:
+            if frame_type == 2:
+                logger.error(f"[{run_id}] FRAME_UT run without recorded orientation, pass --tilt and --azimuth")
+                return None
+            orientation = (0, 0)
+        tilt = orientation[0] if tilt is None else tilt
+        azimuth = orientation[1] if azimuth is None else azimuth
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    filename = out_dir.joinpath(f"obstruction-data-{run_id}.csv")
+    merged_data_file = out_dir.joinpath(f"processed_obstruction-data-{run_id}.csv")
+    progress_file = out_dir.joinpath(f"backfill-progress-{run_id}.csv")
+    serving_data_path = out_dir.joinpath(f"serving_satellite_data-{run_id}.csv")
+
+    slots = slot_starts(df_obstruction_map)
+    done = set()
+    if progress_file.exists():
+        progress_df = pd.read_csv(progress_file, parse_dates=["Slot"])
+        done = set(progress_df["Slot"].dt.to_pydatetime())
+    else:
+        process_obstruction_maps(df_obstruction_map, run_id, directory=out_dir)
+        convert_observed(out_dir, filename.name, frame_type, tilt, azimuth)
+        with open(progress_file, "w", newline="") as f:
+            csv.writer(f).writerow(["Slot"] + RESULT_COLUMNS)
+
+    pending = [slot for slot in slots if slot not in done]
+    logger.info(
+        f"[{run_id}] {len(slots)} slots, {len(done)} already done, TLE {tle_file.name}, frame type {frame_type}"
+    )
+
+    start = time.monotonic()
+    with open(progress_file, "a", newline="") as f, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(tle_file, config.LATITUDE, config.LONGITUDE, config.ALTITUDE, filename, merged_data_file, frame_type),
+    ) as pool:
+        writer = csv.writer(f)
+        futures = [pool.submit(_process_slot, slot) for slot in pending]
+        for count, future in enumerate(as_completed(futures), start=1):
+            slot_time, rows = future.result()
+            # A slot without a match still gets a row, so it is not retried on resume
+            for row in rows or [[None, None, None]]:
+                writer.writerow([slot_time] + row)
+            f.flush()
+            if count % 20 == 0 or count == len(futures):
+                elapsed = time.monotonic() - start
+                logger.info(f"[{run_id}] {count}/{len(pending)} slots, {count / elapsed:.2f} slots/sec")
+    elapsed = time.monotonic() - start
+
+    result_df = pd.read_csv(progress_file, parse_dates=["Timestamp"]).dropna(subset=["Timestamp"])
+    result_df = result_df[RESULT_COLUMNS].sort_values("Timestamp")
+    merged_data_df = pd.read_csv(merged_data_file, parse_dates=["Timestamp"])
+    merged_df = pd.merge(merged_data_df, result_df, on="Timestamp", how="inner")
+    merged_df.drop_duplicates(subset=["Timestamp"], keep="last").to_csv(serving_data_path, index=False)
+    logger.info(f"[{run_id}] Saved serving data to {serving_data_path}")
+
+    return len(pending), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LEOViz | Recompute serving satellites for archived runs")
+
+    parser.add_argument("--lat", type=float, required=True, help="Dish latitude")
+    parser.add_argument("--lon", type=float, required=True, help="Dish longitude")
+    parser.add_argument("--alt", type=float, required=True, help="Dish altitude (in meters)")
+    parser.add_argument("--id", action="append", dest="run_ids", help="Run ID, format: YYYY-MM-DD-HH-mm-ss (repeatable)")
+    parser.add_argument("--from", dest="date_from", help="First run date to include, format: YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="Last run date to include, format: YYYY-MM-DD")
+    parser.add_argument("--out", default=config.DATA_DIR, help="Output directory, defaults to DATA_DIR")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker process count")
+    parser.add_argument("--tilt", type=float, help="Dish tilt, overrides the recorded orientation")
+    parser.add_argument("--azimuth", type=float, help="Dish boresight azimuth, overrides the recorded orientation")
+    args = parser.parse_args()
+
+    if not (args.run_ids or args.date_from or args.date_to):
+        parser.error("one of --id, --from or --to is required")
+
+    config.LATITUDE = args.lat
+    config.LONGITUDE = args.lon
+    config.ALTITUDE = args.alt
+
+    runs = discover_runs(config.DATA_DIR, args.run_ids, args.date_from, args.date_to)
+    if not runs:
+        logger.error(f"No runs found under {config.DATA_DIR}")
+        sys.exit(1)
+
+    total_slots = 0
+    total_seconds = 0.0
+    for run_id, parquet_file in runs:
+        result = backfill_run(run_id, parquet_file, args.out, args.workers, args.tilt, args.azimuth)
+        if result is not None:
+            total_slots += result[0]
+            total_seconds += result[1]
+
+    rate = total_slots / total_seconds if total_seconds > 0 else 0.0
+    logger.info(f"Backfilled {len(runs)} runs, {total_slots} slots in {total_seconds:.1f}s ({rate:.2f} slots/sec)")
@@ -0,0 +1,422 @@
+# flake8: noqa: E501
+"""Microbenchmarks for the data processing hot paths.
+
+Times the history, obstruction map and satellite matching functions on fixed
+fixtures, and reports the best of several runs, throughput and peak Python
+memory of each. Peak memory is as traced by tracemalloc, which includes NumPy
+buffers but not Arrow buffers. Results can be saved as a baseline JSON file,
+and later runs compared against it with --compare: anything slower or larger
+than the baseline by more than the tolerance is reported as a regression and
+the exit status is 1. Baselines are machine specific, so none is committed;
+save one before making the change to be measured. Comparing against a
+missing baseline, or one without a benchmark that was run, is an error.
+
+The fixtures are generated once, deterministically, into the fixtures
+directory: a 12 hour history ring buffer, a day of obstruction map traces in
+FRAME_EARTH for a fixed observer, and a TLE snapshot. By default the TLE
+snapshot is a synthetic shell of 1584 satellites with a fixed epoch, so runs
+on different machines use the same input. Pass --tle to build the fixtures
+from a real snapshot instead; delete the fixtures directory to rebuild them.
+
+Example:
+    python benchmark.py --save-baseline
+    python benchmark.py --compare
+    python benchmark.py --only find_matching_satellites --repeat 5
+"""
+
+import io
+import csv
+import sys
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from skyfield.api import load, wgs84
+
+import util  # noqa: F401 configures logging
+from config import DATA_DIR
+from slots import SLOT_SECONDS, slot_id, slot_start
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.joinpath("starlink-grpc-tools")))
+import starlink_grpc
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_VERSION = 1
+FIXTURE_EPOCH = datetime(2025, 4, 13, tzinfo=timezone.utc)
+OBSERVER = (49.2827, -123.1207, 70.0)
+HISTORY_SAMPLES = 43200
+MAP_SIZE = 123
+# Polls per timeslot in the obstruction fixture, one per second like the
+# default collector settings produce after de-duplication
+FRAMES_PER_SLOT = 14
+
+DEFAULT_FIXTURES_DIR = Path(DATA_DIR).joinpath("benchmark")
+DEFAULT_BASELINE = Path(__file__).resolve().parent.joinpath("benchmark-baseline.json")
+
+BENCHMARKS = {}
+
+
+def benchmark(unit):
+    """Register a benchmark setup function.
+
+    The setup function takes the Fixtures object and returns a tuple of
+    (callable to time, number of items it processes per call). Files it
+    writes go to `fixtures.scratch`, which is removed after the run.
+    """
+    def register(setup):
+        BENCHMARKS[setup.__name__] = (setup, unit)
+        return setup
+
+    return register
+
+
+# --- Fixture generation ---
+
+def synthetic_tle(epoch=FIXTURE_EPOCH):
+    """Return TLE lines for a Walker shell like Starlink's 53 degree shell."""
+    from sgp4 import exporter
+    from sgp4.api import Satrec, WGS72, jday
+
+    jd, fr = jday(epoch.year, epoch.month, epoch.day, epoch.hour, epoch.minute, epoch.second)
+    epoch_days = jd + fr - 2433281.5
+    semi_major_axis = 6378.135 + 550.0
+    mean_motion = math.sqrt(398600.8 / semi_major_axis**3) * 60.0  # rad/min
+    lines = []
+    for plane in range(72):
+        for index in range(22):
+            number = plane * 22 + index + 1
+            satrec = Satrec()
+            satrec.sgp4init(
+                WGS72, "i", number, epoch_days, 0.0, 0.0, 0.0, 0.0001, 0.0,
+                math.radians(53.0),
+                math.radians((index * 360 / 22 + plane * 5) % 360),
+                mean_motion,
+                math.radians(plane * 5.0),
+            )
+            line1, line2 = exporter.export_tle(satrec)
+            lines += [f"STARLINK-{number}", line1, line2]
+    return "\n".join(lines) + "\n"
+
+
+def make_history(rng):
+    """Return a full history ring buffer as arrays, wrapped part way through."""
+    n = HISTORY_SAMPLES
+    latency = 28.0 + 6.0 * rng.standard_normal(n).cumsum() / np.sqrt(np.arange(1, n + 1)) + rng.gamma(2.0, 2.0, n)
+    drop = np.where(rng.random(n) < 0.01, rng.random(n), 0.0)
+    drop[rng.random(n) < 0.002] = 1.0
+    downlink = rng.lognormal(13.0, 1.5, n)
+    uplink = rng.lognormal(11.0, 1.5, n)
+    power = 45.0 + 10.0 * rng.random(n)
+    return {
+        "current": np.int64(3 * n + 12345),
+        "pop_ping_drop_rate": drop.astype(np.float32),
+        "pop_ping_latency_ms": latency.astype(np.float32),
+        "downlink_throughput_bps": downlink.astype(np.float32),
+        "uplink_throughput_bps": uplink.astype(np.float32),
+        "power_in": power.astype(np.float32),
+    }
+
+
+def make_obstruction_traces(satellites, hours):
+    """Return (slot IDs, poll timestamps, pixel per poll) for `hours` of slots.
+
+    The serving satellite of each slot is the highest one that stays above
+    20 degrees, and every poll adds its current position to the map. Pixel
+    is -1 for slots without a serving satellite.
+    """
+    from simulator import SimulatedDish, sky_to_pixel
+
+    dish = SimulatedDish(satellites, *OBSERVER)
+    first = slot_id(FIXTURE_EPOCH.timestamp()) + 1
+    slots = np.arange(first, first + max(1, int(hours * 3600 / SLOT_SECONDS)))
+    offsets = np.linspace(0.5, SLOT_SECONDS - 1.5, FRAMES_PER_SLOT)
+    times = slot_start(slots)[:, None] + offsets[None, :]
+    pixels = np.full(times.shape, -1, dtype=np.int32)
+    for i, slot in enumerate(slots):
+        serving = dish.serving_satellite(int(slot))
+        if serving is None:
+            continue
+        seconds = offsets.astype(int)
+        row, col = sky_to_pixel(serving[1][seconds], serving[2][seconds])
+        pixels[i] = row * MAP_SIZE + col
+        if i % 240 == 0:
+            logger.info(f"Generated {i}/{len(slots)} slots")
+    return slots, times, pixels
+
+
+def build_fixtures(directory, tle=None, hours=24):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Building benchmark fixtures in {directory}")
+
+    tle_file = directory.joinpath("tle.txt")
+    if tle:
+        shutil.copyfile(tle, tle_file)
+    else:
+        tle_file.write_text(synthetic_tle())
+
+    rng = np.random.default_rng(0)
+    np.savez_compressed(directory.joinpath("history.npz"), **make_history(rng))
+
+    satellites = load.tle_file(str(tle_file))
+    slots, times, pixels = make_obstruction_traces(satellites, hours)
+    np.savez_compressed(directory.joinpath("obstruction.npz"), slots=slots, times=times, pixels=pixels)
+
+    directory.joinpath("fixtures.json").write_text(
+        json.dumps({"version": FIXTURE_VERSION, "hours": hours, "tle": str(tle) if tle else "synthetic"})
+    )
+
+
+class Fixtures:
+    def __init__(self, directory, scratch):
+        directory = Path(directory)
+        self.scratch = Path(scratch)
+        history = np.load(directory.joinpath("history.npz"))
+        self.history = SimpleNamespace(
+            current=int(history["current"]),
+            **{field: history[field].tolist() for field in starlink_grpc.HISTORY_FIELDS},
+        )
+        traces = np.load(directory.joinpath("obstruction.npz"))
+        self.slots = traces["slots"]
+        self.times = traces["times"]
+        self.pixels = traces["pixels"]
+        self.satellites = load.tle_file(str(directory.joinpath("tle.txt")))
+        self.observer = wgs84.latlon(*OBSERVER[:2], elevation_m=OBSERVER[2])
+        self._observed = None
+
+    def timeslot_df(self, index):
+        """Return the collector's DataFrame of polled frames for one slot."""
+        frames = []
+        frame = np.zeros(MAP_SIZE * MAP_SIZE, dtype=np.uint8)
+        for pixel in self.pixels[index]:
+            if pixel >= 0:
+                frame = frame.copy()
+                frame[pixel] = 1
+            frames.append(frame)
+        return pd.DataFrame({"timestamp": self.times[index], "frame_type": 1, "obstruction_map": frames})
+
+    def timeslot_dfs(self, count=None):
+        return [self.timeslot_df(i) for i in range(len(self.slots) if count is None else count)]
+
+    def observed_csv(self, directory):
+        """Write the white pixel CSV of the whole day, as the collector would."""
+        path = Path(directory).joinpath("obstruction-data-benchmark.csv")
+        from obstruction import process_obstruction_timeslot
+
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            for i in range(len(self.slots)):
+                process_obstruction_timeslot(self.timeslot_df(i), writer)
+        return path
+
+    def observed_positions(self, count):
+        """Return find_matching_satellites input for the first `count` slots with a trace."""
+        if self._observed is None:
+            from satellites import pre_process_observed_data, sample_points
+
+            with tempfile.TemporaryDirectory() as tmp:
+                positions = pre_process_observed_data(self.observed_csv(tmp), 1, 0, 0)
+            positions["Slot"] = (positions["Timestamp"].astype("int64") // 10**9 - 12) // SLOT_SECONDS
+            self._observed = []
+            for _, group in positions.groupby("Slot"):
+                if len(group) < 3:
+                    continue
+                rows = sample_points(group)
+                self._observed.append(
+                    [(row["Timestamp"].to_pydatetime(), (90 - row["Elevation"], row["Azimuth"])) for row in rows]
+                )
+        return self._observed[:count]
+
+
+# --- Benchmarks ---
+
+@benchmark("samples")
+def history_stats(fx):
+    return lambda: starlink_grpc.history_stats(-1, history=fx.history), HISTORY_SAMPLES
+
+
+@benchmark("samples")
+def history_bulk_data(fx):
+    return lambda: starlink_grpc.history_bulk_data(-1, history=fx.history), HISTORY_SAMPLES
+
+
+@benchmark("samples")
+def concatenate_history(fx):
+    # A poll 10 minutes after the previous one
+    later = SimpleNamespace(**vars(fx.history))
+    later.current = fx.history.current + 600
+    return lambda: starlink_grpc.concatenate_history(fx.history, later), HISTORY_SAMPLES + 600
+
+
+@benchmark("slots")
+def process_obstruction_timeslot(fx):
+    from obstruction import process_obstruction_timeslot
+
+    count = min(len(fx.slots), 960)
+    dfs = fx.timeslot_dfs(count)
+
+    def run():
+        writer = csv.writer(io.StringIO())
+        for df in dfs:
+            process_obstruction_timeslot(df, writer)
+
+    return run, count
+
+
+@benchmark("rows")
+def pre_process_observed_data(fx):
+    from satellites import pre_process_observed_data
+
+    path = fx.observed_csv(fx.scratch)
+    rows = sum(1 for _ in open(path))
+    return lambda: pre_process_observed_data(path, 1, 0, 0), rows
+
+
+@benchmark("slots")
+def find_matching_satellites(fx):
+    from satellites import find_matching_satellites
+
+    observed = fx.observed_positions(20)
+
+    def run():
+        for positions in observed:
+            find_matching_satellites(fx.satellites, fx.observer, positions, 1)
+
+    return run, len(observed)
+
+
+@benchmark("frames")
+def cumulative_obstruction_map(fx):
+    from plot import cumulative_obstruction_map
+
+    # One hour, the longest run plot.py is normally used for, or all slots of shorter fixtures
+    df = pd.concat(fx.timeslot_dfs(min(len(fx.slots), 240)), ignore_index=True)
+    return lambda: cumulative_obstruction_map(df), len(df)
+
+
+@benchmark("slots")
+def write_obstruction_map_parquet(fx):
+    from dish import write_obstruction_map_parquet
+
+    # Ten minutes of slots, appended one at a time like the collector does
+    dfs = fx.timeslot_dfs(min(len(fx.slots), 40))
+
+    def run():
+        path = fx.scratch.joinpath("obstruction_map-benchmark.parquet")
+        path.unlink(missing_ok=True)
+        for df in dfs:
+            write_obstruction_map_parquet(str(path), df)
+
+    return run, len(dfs)
+
+
+# --- Runner ---
+
+def measure(run, repeat):
+    """Return (best time in seconds, peak traced memory in bytes)."""
+    run()  # warm up caches, JIT and imports
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def compare(name, result, baseline, tolerance):
+    """Return a list of regression descriptions for one benchmark."""
+    base = baseline.get(name)
+    if not base:
+        return []
+    regressions = []
+    if result["seconds"] > base["seconds"] * (1 + tolerance):
+        regressions.append(f"time {result['seconds'] / base['seconds']:.2f}x baseline")
+    if result["peak_bytes"] > base["peak_bytes"] * (1 + tolerance):
+        regressions.append(f"peak memory {result['peak_bytes'] / base['peak_bytes']:.2f}x baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LEOViz | Processing microbenchmarks")
+
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="Fixtures directory, built on first use")
+    parser.add_argument("--tle", help="Build the fixtures from this TLE snapshot instead of a synthetic one")
+    parser.add_argument("--hours", type=float, default=24, help="Hours of obstruction traces in new fixtures")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file to compare against or save to")
+    parser.add_argument("--compare", action="store_true", help="Compare the results against the baseline, exit status 1 on regressions")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or growth over the baseline, as a fraction")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark, the best one is reported")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run")
+    args = parser.parse_args()
+
+    baseline_path = Path(args.baseline)
+    if args.compare and args.save_baseline:
+        parser.error("--compare and --save-baseline are mutually exclusive")
+    if args.compare and not baseline_path.exists():
+        parser.error(f"Baseline {baseline_path} not found, save one with --save-baseline first")
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+
+    if not Path(args.fixtures).joinpath("fixtures.json").exists():
+        build_fixtures(args.fixtures, args.tle, args.hours)
+    # The functions under test log every call
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="leoviz-benchmark-") as scratch:
+        fixtures = Fixtures(args.fixtures, scratch)
+        results = {}
+        regressed = False
+        print(f"{'benchmark':<32} {'best':>10} {'throughput':>20} {'peak':>10}  vs baseline")
+        for name in args.only or BENCHMARKS:
+            setup, unit = BENCHMARKS[name]
+            try:
+                run, items = setup(fixtures)
+            except ImportError as e:
+                print(f"{name:<32} skipped: {e}")
+                continue
+            seconds, peak = measure(run, args.repeat)
+            result = {"seconds": seconds, "items": items, "unit": unit, "throughput": items / seconds, "peak_bytes": peak}
+            results[name] = result
+
+            regressions = compare(name, result, baseline, args.tolerance) if args.compare else []
+            missing = args.compare and name not in baseline
+            regressed = regressed or bool(regressions) or missing
+            if missing:
+                status = "MISSING from baseline"
+            elif regressions:
+                status = "REGRESSION: " + ", ".join(regressions)
+            elif name in baseline:
+                status = f"{seconds / baseline[name]['seconds']:.2f}x"
+            else:
+                status = "-"
+            print(
+                f"{name:<32} {seconds * 1000:>8.1f}ms {result['throughput']:>12.1f} {unit + '/s':<7} {peak / 2**20:>7.1f}MiB  {status}"
+            )
+
+    if args.save_baseline:
+        baseline.update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Saved baseline to {baseline_path}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,12 +14,90 @@ IFCE = os.getenv("IFCE", "")
 STARLINK_GRPC_ADDR_PORT = os.getenv("STARLINK_GRPC_ADDR_PORT", "192.168.100.1:9200")
 STARLINK_DEFAULT_GW = os.getenv("STARLINK_DEFAULT_GW", "100.64.0.1")
 
+# Append every dish gRPC response to this file, or replay responses from it
+# instead of talking to the dish, at GRPC_REPLAY_SPEED times real time (0 for
+# as fast as possible). A replay runs on the recorded clock, and the
+# obstruction map job stops at the end of the log.
+GRPC_RECORD_FILE = os.getenv("GRPC_RECORD_FILE", "")
+GRPC_REPLAY_FILE = os.getenv("GRPC_REPLAY_FILE", "")
+GRPC_REPLAY_SPEED = float(os.getenv("GRPC_REPLAY_SPEED", "1.0"))
+
 DATA_DIR = os.getenv("DATA_DIR", "data")
 TLE_DATA_DIR = Path(DATA_DIR).joinpath("TLE")
 LATENCY_DATA_DIR = Path(DATA_DIR).joinpath("latency")
 
+# Per-timeslot trace records, one JSON line each, rotated at TRACE_MAX_BYTES
+TRACE_FILE = os.getenv("TRACE_FILE", str(Path(DATA_DIR).joinpath("trace", "slot-trace.jsonl")))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+
+# Prometheus metrics endpoint of the collector, disabled with port 0
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9817"))
+METRICS_ADDRESS = os.getenv("METRICS_ADDRESS", "")
+
+# Threads processing polled timeslots, and processes estimating their serving
+# satellites
+ESTIMATION_WORKERS = int(os.getenv("ESTIMATION_WORKERS", "2"))
+
+# Scheduled job intervals, in seconds. Hourly jobs run on the hour, delayed by
+# up to JOB_JITTER seconds.
+LATENCY_JOB_INTERVAL = float(os.getenv("LATENCY_JOB_INTERVAL", "3600"))
+STATUS_JOB_INTERVAL = float(os.getenv("STATUS_JOB_INTERVAL", "3600"))
+TLE_JOB_INTERVAL = float(os.getenv("TLE_JOB_INTERVAL", "3600"))
+POP_JOB_INTERVAL = float(os.getenv("POP_JOB_INTERVAL", "10"))
+JOB_JITTER = float(os.getenv("JOB_JITTER", "0"))
+
+# Home PoP detection. Every POP_JOB_INTERVAL the local addresses and default
+# routes are checked, and the public addresses and their PTR records are only
+# looked up again when those changed, or after POP_REFRESH_INTERVAL seconds.
+# A lookup that found no PoP is retried after POP_RETRY_INTERVAL seconds,
+# doubling with each failure up to POP_REFRESH_INTERVAL.
+POP_REFRESH_INTERVAL = float(os.getenv("POP_REFRESH_INTERVAL", "1800"))
+POP_RETRY_INTERVAL = float(os.getenv("POP_RETRY_INTERVAL", "30"))
+POP_LOOKUP_TIMEOUT = float(os.getenv("POP_LOOKUP_TIMEOUT", "5"))
+PUBLIC_IP_URL = os.getenv("PUBLIC_IP_URL", "https://ipconfig.io/ip")
+
+# On-demand profiling of the collector, see profiler.py
+PROFILING = os.getenv("PROFILING", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(Path(DATA_DIR).joinpath("profiles")))
+PROFILE_SOCKET = os.getenv("PROFILE_SOCKET", str(Path(DATA_DIR).joinpath("profiler.sock")))
+PROFILE_DURATION = float(os.getenv("PROFILE_DURATION", "30"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+
+# Downloaded TLE sets, PoP list and ground station map, reused for up to
+# their TTL in seconds and revalidated with conditional requests after that
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", str(Path(DATA_DIR).joinpath("cache")))
+ASSET_TIMEOUT = float(os.getenv("ASSET_TIMEOUT", "30"))
+TLE_CACHE_TTL = float(os.getenv("TLE_CACHE_TTL", "7200"))
+POP_CACHE_TTL = float(os.getenv("POP_CACHE_TTL", "86400"))
+GS_CACHE_TTL = float(os.getenv("GS_CACHE_TTL", "86400"))
+
 TLE_URL = "https://celestrak.org/NORAD/elements/gp.php?GROUP=starlink&FORMAT=tle"
 
+USE_JIT = os.getenv("USE_JIT", "auto")
+
+OBSTRUCTION_POLL_INTERVAL = float(os.getenv("OBSTRUCTION_POLL_INTERVAL", "0.5"))
+OBSTRUCTION_BURST_INTERVAL = float(os.getenv("OBSTRUCTION_BURST_INTERVAL", "0.1"))
+OBSTRUCTION_IDLE_INTERVAL = float(os.getenv("OBSTRUCTION_IDLE_INTERVAL", "1.0"))
+
+# Latency probes: "icmp" uses unprivileged ICMP datagram sockets, which need
+# the group of the process in net.ipv4.ping_group_range, and "udp" sends to a
+# UDP echo service on LATENCY_UDP_PORT, which every target must run. Probes
+# without a reply within LATENCY_TIMEOUT seconds are recorded as lost.
+LATENCY_PROBE = os.getenv("LATENCY_PROBE", "icmp")
+LATENCY_UDP_PORT = int(os.getenv("LATENCY_UDP_PORT", "7"))
+LATENCY_TIMEOUT = float(os.getenv("LATENCY_TIMEOUT", "2"))
+LATENCY_PAYLOAD_BYTES = int(os.getenv("LATENCY_PAYLOAD_BYTES", "56"))
+# Targets probed at the same time as STARLINK_DEFAULT_GW, at their own
+# intervals: an address at the PoP (disabled when empty), an anycast DNS
+# service, and extra targets as "name=host@interval" items separated by
+# commas, e.g. "google=8.8.8.8@100ms,home=203.0.113.1@1s".
+LATENCY_POP_TARGET = os.getenv("LATENCY_POP_TARGET", "")
+LATENCY_POP_INTERVAL = os.getenv("LATENCY_POP_INTERVAL", "20ms")
+LATENCY_DNS_TARGET = os.getenv("LATENCY_DNS_TARGET", "1.1.1.1")
+LATENCY_DNS_INTERVAL = os.getenv("LATENCY_DNS_INTERVAL", "100ms")
+LATENCY_TARGETS = os.getenv("LATENCY_TARGETS", "")
+
 INTERVAL_MS = os.getenv("INTERVAL", "10ms")
 DURATION = os.getenv("DURATION", "2m")
 
@@ -53,3 +131,4 @@ def print_config():
     print("Starlink gateway: {}".format(STARLINK_DEFAULT_GW))
     print("Measurement interval: {}".format(INTERVAL_MS))
     print("Measurement duration: {}".format(DURATION))
+    print("Metrics port: {}".format(METRICS_PORT or "disabled"))
@@ -6,22 +6,37 @@ import sys
 import json
 import time
 import logging
-import subprocess
 import threading
 import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 import config
 
 from satellites import convert_observed, process_intervals
 
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from pathlib import Path
-from config import DATA_DIR, STARLINK_GRPC_ADDR_PORT, DURATION_SECONDS, TLE_DATA_DIR
+import metrics
+from config import (
+    DATA_DIR,
+    STARLINK_GRPC_ADDR_PORT,
+    DURATION_SECONDS,
+    TLE_DATA_DIR,
+    GRPC_RECORD_FILE,
+    GRPC_REPLAY_FILE,
+    GRPC_REPLAY_SPEED,
+    ESTIMATION_WORKERS,
+)
 from util import date_time_string, ensure_data_directory
-from obstruction import process_obstruction_timeslot
+from obstruction import process_obstruction_timeslot, drop_held_frames
+from slots import SlotClock, slot_start_second
+from poller import ObstructionPoller
+from tracing import SlotTrace, TraceLog, span
+from profiler import profiled
 
-import numpy as np
 import pandas as pd
+from google.protobuf import json_format
 from skyfield.api import load
 
 logger = logging.getLogger(__name__)
@@ -34,19 +49,102 @@ sys.path.insert(0, str(Path("./starlink-grpc-tools").resolve()))
 import starlink_grpc
 
 GRPC_DATA_DIR = "{}/grpc".format(DATA_DIR)
-GRPC_TIMEOUT = 10
+
+# Shared by every dish context, so RPC metrics carry over from one collection cycle to the next
+RPC_STATS = starlink_grpc.RpcStats()
+
+# Persistent across collection cycles, so slots are processed in threads that already exist
+PROCESSING_POOL = ThreadPoolExecutor(max_workers=ESTIMATION_WORKERS, thread_name_prefix="slot-worker")
+# Estimation is CPU bound Python code, mostly skyfield and scoring, which
+# threads would run one at a time under the GIL. It runs in worker processes
+# instead, started on first use by estimation_pool() and kept across cycles.
+_estimation_pool = None
+_estimation_pool_lock = threading.Lock()
+# Per worker process state, set up once by _init_estimation_worker
+_worker = {}
+
+queue_depth = metrics.gauge("processing_queue_depth", "Polled slots waiting for or in processing")
+queue_depth.set(0)
+tle_file_time = metrics.gauge("tle_file_timestamp_seconds", "Creation time of the TLE file used for the last estimate")
+metrics.gauge("tle_age_seconds", "Age of the TLE file used for the last estimate").set_function(
+    lambda: time.time() - tle_file_time.value
+)
+
+
+def rpc_metrics():
+    """Metrics collector for the dish RPC stats."""
+    snapshot = RPC_STATS.snapshot()
+    latency, errors = [], []
+    for name, stats in sorted(snapshot.items()):
+        for bound, count in stats["buckets"]:
+            latency.append(("dish_rpc_duration_seconds_bucket", {"rpc": name, "le": metrics.format_value(bound)}, count))
+        latency.append(("dish_rpc_duration_seconds_sum", {"rpc": name}, stats["sum"]))
+        latency.append(("dish_rpc_duration_seconds_count", {"rpc": name}, stats["count"]))
+        for code, count in sorted(stats["errors"].items()):
+            errors.append(("dish_rpc_errors_total", {"rpc": name, "code": code}, count))
+    return [
+        ("dish_rpc_duration_seconds", "histogram", "Dish gRPC call latency", latency),
+        ("dish_rpc_errors_total", "counter", "Failed dish gRPC calls, by status code", errors),
+    ]
+
+
+metrics.register_collector(rpc_metrics)
+
+
+# The replay of GRPC_REPLAY_FILE, shared by every caller of dish_context
+_replay = None
+_replay_lock = threading.Lock()
+
+
+def dish_context():
+    """Return a gRPC context for the dish, recording or replaying responses if configured.
+
+    A replay has a single context, so all the collectors take their
+    responses from the same position in the log, as they were recorded.
+    """
+    global _replay
+    if GRPC_REPLAY_FILE:
+        with _replay_lock:
+            if _replay is None:
+                _replay = starlink_grpc.ReplayContext(GRPC_REPLAY_FILE, GRPC_REPLAY_SPEED)
+                _replay.stats = RPC_STATS
+            return _replay
+    if GRPC_RECORD_FILE:
+        context = starlink_grpc.RecordingContext(GRPC_RECORD_FILE, target=STARLINK_GRPC_ADDR_PORT)
+    else:
+        context = starlink_grpc.ChannelContext(target=STARLINK_GRPC_ADDR_PORT)
+    context.stats = RPC_STATS
+    return context
+
+
+def dish_clock():
+    """Return the clock collection is paced by: the replay clock when replaying, otherwise the time module."""
+    if GRPC_REPLAY_FILE:
+        return dish_context().clock
+    return time
+
+
+def replay_finished():
+    """Return whether a replay ran out of recorded responses."""
+    return _replay is not None and _replay.finished
+
+
+def is_replay_finished_error(e):
+    return isinstance(e, starlink_grpc.GrpcError) and isinstance(e.__cause__, starlink_grpc.ReplayFinished)
+
+
+def get_status_dict(context):
+    """Return the dish status as a dict, with the same field names as grpcurl JSON output."""
+    return json_format.MessageToDict(starlink_grpc.get_status(context))
+
 
 # --- New function to get orientation ---
 def get_current_dish_orientation():
-    cmd = [
-        "grpcurl", "-plaintext", "-d", '{"get_status":{}}',
-        STARLINK_GRPC_ADDR_PORT, "SpaceX.API.Device.Device/Handle"
-    ]
+    context = dish_context()
     try:
-        output = subprocess.check_output(cmd, timeout=GRPC_TIMEOUT)
-        data = json.loads(output.decode('utf-8'))
-        if data.get("dishGetStatus") and data["dishGetStatus"].get("alignmentStats"):
-            alignment = data["dishGetStatus"]["alignmentStats"]
+        status = get_status_dict(context)
+        if status.get("alignmentStats"):
+            alignment = status["alignmentStats"]
             tilt = alignment.get("tiltAngleDeg", 0)
             azimuth = alignment.get("boresightAzimuthDeg", 0)
             logger.info(f"Fetched dish orientation: Tilt={tilt}, Azimuth={azimuth}")
@@ -54,12 +152,11 @@ def get_current_dish_orientation():
         else:
             logger.warning("Could not extract alignmentStats from GetStatus response.")
             return None
-    except subprocess.TimeoutExpired:
-        logger.error("Timeout getting dish orientation.")
-        return None
     except Exception as e:
         logger.error(f"Error getting dish orientation: {e}")
         return None
+    finally:
+        context.close()
 # --- End new function ---
 
 def grpc_get_status() -> None:
@@ -70,20 +167,16 @@ def grpc_get_status() -> None:
         GRPC_DATA_DIR, ensure_data_directory(GRPC_DATA_DIR), date_time_string()
     )
 
-    # grpcurl -plaintext -d {\"get_status\":{}} 192.168.100.1:9200 SpaceX.API.Device.Device/Handle
-    cmd = [
-        "grpcurl",
-        "-plaintext",
-        "-d",
-        '{"get_status":{}}',
-        STARLINK_GRPC_ADDR_PORT,
-        "SpaceX.API.Device.Device/Handle",
-    ]
+    context = dish_context()
     try:
+        status = get_status_dict(context)
         with open(FILENAME, "w") as outfile:
-            subprocess.run(cmd, stdout=outfile, timeout=GRPC_TIMEOUT)
-    except subprocess.TimeoutExpired:
-        pass
+            json.dump({"dishGetStatus": status}, outfile, indent=2)
+    except Exception as e:
+        logger.error(f"Error getting dish status: {e}")
+        return
+    finally:
+        context.close()
 
     logger.info("Saved gRPC dish status to {}".format(FILENAME))
 
@@ -96,16 +189,10 @@ def get_sinr(dt_string):
         GRPC_DATA_DIR, ensure_data_directory(GRPC_DATA_DIR), dt_string
     )
 
-    cmd = [
-        "grpcurl",
-        "-plaintext",
-        "-d",
-        '{"get_status":{}}',
-        STARLINK_GRPC_ADDR_PORT,
-        "SpaceX.API.Device.Device/Handle",
-    ]
+    context = dish_context()
+    clock = dish_clock()
     with open(FILENAME, "w") as outfile:
-        start = time.time()
+        start = clock.time()
         csv_writer = csv.writer(outfile)
         csv_writer.writerow(
             [
@@ -123,19 +210,14 @@ def get_sinr(dt_string):
                 "desiredBoresightElevationDeg",
             ]
         )
-        while time.time() < start + DURATION_SECONDS:
+        while clock.time() < start + DURATION_SECONDS:
             try:
-                output = subprocess.check_output(cmd, timeout=GRPC_TIMEOUT)
-                data = json.loads(output.decode("utf-8"))
-                if (
-                    data["dishGetStatus"] is not None
-                    # Starlink may have just rollbacked the firmware
-                    # from 2025.04.08.cr53207 to 2025.03.28.mr52463.2
-                    # thus removing phyRxBeamSnrAvg again
-                    # and "phyRxBeamSnrAvg" in data["dishGetStatus"]
-                    and "alignmentStats" in data["dishGetStatus"]
-                ):
-                    status = data["dishGetStatus"]
+                status = get_status_dict(context)
+                # Starlink may have just rollbacked the firmware
+                # from 2025.04.08.cr53207 to 2025.03.28.mr52463.2
+                # thus removing phyRxBeamSnrAvg again
+                # and "phyRxBeamSnrAvg" in status
+                if "alignmentStats" in status:
                     sinr = status.get("phyRxBeamSnrAvg", 0)
                     alignment = status["alignmentStats"]
                     popPingLatencyMs = status.get("popPingLatencyMs", 0)
@@ -143,7 +225,7 @@ def get_sinr(dt_string):
                     upThroughputBps = status.get("uplinkThroughputBps", 0)
                     csv_writer.writerow(
                         [
-                            time.time(),
+                            clock.time(),
                             sinr,
                             popPingLatencyMs,
                             dlThroughputBps,
@@ -158,45 +240,19 @@ def get_sinr(dt_string):
                         ]
                     )
                     outfile.flush()
-                    time.sleep(0.5)
-            except Exception:
-                pass
+                    clock.sleep(0.5)
+            except Exception as e:
+                if is_replay_finished_error(e):
+                    break
+    context.close()
 
     logger.info("SNR measurement saved to {}".format(FILENAME))
 
 
-def wait_until_target_time(last_timeslot_second):
-    while True:
-        current_second = datetime.now(timezone.utc).second
-        if current_second >= 12 and current_second < 27 and last_timeslot_second != 12:
-            last_timeslot_second = 12
-            break
-        elif (
-            current_second >= 27 and current_second < 42 and last_timeslot_second != 27
-        ):
-            last_timeslot_second = 27
-            break
-        elif (
-            current_second >= 42 and current_second < 57 and last_timeslot_second != 42
-        ):
-            last_timeslot_second = 42
-            break
-        elif (
-            current_second >= 57 and current_second < 60 and last_timeslot_second != 57
-        ):
-            last_timeslot_second = 57
-            break
-        elif current_second >= 0 and current_second < 12 and last_timeslot_second != 57:
-            last_timeslot_second = 57
-            break
-        time.sleep(0.1)
-    logger.info("Current timeslot starts at second: {}".format(last_timeslot_second))
-    return last_timeslot_second
-
-
 def get_obstruction_map_frame_type():
-    context = starlink_grpc.ChannelContext(target=STARLINK_GRPC_ADDR_PORT)
+    context = dish_context()
     map = starlink_grpc.get_obstruction_map(context)
+    context.close()
     if map.map_reference_frame == 0:
         frame_type = "UNKNOWN"
     elif map.map_reference_frame == 1:
@@ -206,31 +262,67 @@ def get_obstruction_map_frame_type():
     return map.map_reference_frame, frame_type
 
 
+def fetch_obstruction_frame(context):
+    snr = starlink_grpc.obstruction_map_array(context)
+    return starlink_grpc.obstruction_map_mask(snr).ravel()
+
+
+def is_dish_connected(context):
+    try:
+        return not starlink_grpc.get_status(context).HasField("outage")
+    except Exception as e:
+        logger.warning(f"Could not get dish state, assuming CONNECTED: {e}")
+        return True
+
+
 def process_obstruction_estimate_satellites_per_timeslot(
-    timeslot_df, writer, csvfile, filename, dt_string, date, frame_type_int, orientation
+    timeslot_df, changed, writer, csvfile, filename, dt_string, date, frame_type_int, orientation, trace, trace_log,
+    previous_written, written,
 ):
+    """Write out a polled timeslot and estimate its serving satellite.
+
+    The obstruction data and map files are written once `previous_written`
+    is set, i.e. after the previous timeslot, since slots can be processed
+    concurrently, e.g. in a fast replay. `written` is set when done.
+    """
+    trace.dequeue()
     logger.info("Processing obstruction map for the past timeslot")
     try:
-        process_obstruction_timeslot(timeslot_df, writer)
-        csvfile.flush()
-        write_obstruction_map_parquet(filename, timeslot_df)
-
-        if config.LATITUDE and config.LONGITUDE and config.ALTITUDE:
-            if orientation:
-                estimate_connected_satellites(
-                    dt_string,
-                    date,
-                    frame_type_int,
-                    orientation['tilt'],
-                    orientation['azimuth'],
-                    timeslot_df.iloc[0]["timestamp"],
-                    timeslot_df.iloc[-1]["timestamp"],
-                )
+        with profiled():
+            try:
+                previous_written.wait()
+                with trace.span("diff"):
+                    process_obstruction_timeslot(timeslot_df, writer)
+                    csvfile.flush()
+                with trace.span("persistence"):
+                    write_obstruction_map_parquet(filename, drop_held_frames(timeslot_df, changed))
+            finally:
+                written.set()
+
+            if config.LATITUDE and config.LONGITUDE and config.ALTITUDE:
+                if orientation:
+                    estimate_connected_satellites(
+                        dt_string,
+                        date,
+                        frame_type_int,
+                        orientation['tilt'],
+                        orientation['azimuth'],
+                        timeslot_df.iloc[0]["timestamp"],
+                        timeslot_df.iloc[-1]["timestamp"],
+                        trace=trace,
+                    )
+                else:
+                    logger.warning("No orientation data available, skipping satellite estimation.")
+                    trace.set(outcome="no_orientation")
             else:
-                logger.warning("No orientation data available, skipping satellite estimation.")
+                trace.set(outcome="no_location")
 
     except Exception as e:
         logger.error(f"Error in processing thread: {str(e)}")
+        trace.set(outcome="error", error=str(e))
+    finally:
+        queue_depth.dec()
+        trace_log.write(trace)
 
 
 def get_obstruction_map():
@@ -250,58 +342,40 @@ def get_obstruction_map():
     frame_type_int, frame_type_str = get_obstruction_map_frame_type()
     logger.info(f"Obstruction map frame type: {frame_type_str} ({frame_type_int})")
 
-    start_time_measurement = time.time()
-    thread_pool = []
+    time_source = dish_clock()
+    start_time_measurement = time_source.time()
+    pending = []
 
     with open(OBSTRUCTION_DATA_FILENAME, "w", newline="") as csvfile:
         writer = csv.writer(csvfile)
-        context = starlink_grpc.ChannelContext(target=STARLINK_GRPC_ADDR_PORT)
-        last_timeslot_second = None
+        context = dish_context()
+        clock = SlotClock(time_source)
+        poller = ObstructionPoller(
+            lambda: fetch_obstruction_frame(context),
+            lambda: is_dish_connected(context),
+            clock=time_source,
+        )
+        trace_log = TraceLog()
+        last_slot = None
+        written = threading.Event()
+        written.set()
 
-        while time.time() < start_time_measurement + DURATION_SECONDS:
+        while time_source.time() < start_time_measurement + DURATION_SECONDS:
+            trace = None
             try:
-                if last_timeslot_second is None:
-                    now = datetime.now(timezone.utc)
-                    if now.second >= 12 and now.second < 27:
-                        start_time_slot = now.replace(microsecond=0).replace(second=27)
-                        last_timeslot_second = 27
-                    elif now.second >= 27 and now.second < 42:
-                        start_time_slot = now.replace(microsecond=0).replace(second=42)
-                        last_timeslot_second = 42
-                    elif now.second >= 42 and now.second < 57:
-                        start_time_slot = now.replace(microsecond=0).replace(second=57)
-                        last_timeslot_second = 57
-                    elif now.second >= 57 and now.second < 60:
-                        start_time_slot = now.replace(microsecond=0).replace(
-                            second=12
-                        ) + timedelta(minutes=1)
-                        last_timeslot_second = 12
-                    elif now.second >= 0 and now.second < 12:
-                        start_time_slot = now.replace(microsecond=0).replace(second=12)
-                        last_timeslot_second = 12
-
-                    while datetime.now(timezone.utc) < start_time_slot:
-                        time.sleep(0.1)
-                else:
-                    last_timeslot_second = wait_until_target_time(last_timeslot_second)
-
-                starlink_grpc.reset_obstruction_map(context)
-                logger.info("Resetting dish obstruction map")
-                timeslot_start = time.time()
-
-                obstruction_data_array = []
-                timestamp_array = []
-
-                while time.time() < timeslot_start + TIMESLOT_DURATION:
-                    obstruction_data = np.array(
-                        starlink_grpc.obstruction_map(context), dtype=int
+                last_slot = clock.wait_for_next_slot(last_slot)
+                skew = clock.record_start(last_slot)
+                trace = SlotTrace(last_slot, dt_string, clock=time_source)
+                trace.set(skew=round(skew, 6))
+                with trace.span("reset"):
+                    starlink_grpc.reset_obstruction_map(context)
+                logger.info(
+                    "Resetting dish obstruction map, timeslot starts at second {}, {:.1f} ms after boundary".format(
+                        slot_start_second(last_slot), skew * 1000
                     )
-                    obstruction_data[obstruction_data == -1] = 0
-                    obstruction_data = obstruction_data.flatten()
-
-                    timestamp_array.append(time.time())
-                    obstruction_data_array.append(obstruction_data)
-                    time.sleep(0.5)
+                )
+                with trace.span("poll"), profiled():
+                    timestamp_array, obstruction_data_array, changed = poller.poll_timeslot(TIMESLOT_DURATION)
 
                 timeslot_df = pd.DataFrame(
                     {
@@ -311,10 +385,14 @@ def get_obstruction_map():
                     }
                 )
 
-                processing_thread = threading.Thread(
-                    target=process_obstruction_estimate_satellites_per_timeslot,
-                    args=(
+                trace.enqueue()
+                queue_depth.inc()
+                previous_written, written = written, threading.Event()
+                pending.append(
+                    PROCESSING_POOL.submit(
+                        process_obstruction_estimate_satellites_per_timeslot,
                         timeslot_df,
+                        changed,
                         writer,
                         csvfile,
                         FILENAME,
@@ -322,20 +400,32 @@ def get_obstruction_map():
                         date,
                         frame_type_int,
                         current_orientation,
-                    ),
+                        trace,
+                        trace_log,
+                        previous_written,
+                        written,
+                    )
                 )
-                processing_thread.start()
-                thread_pool.append(processing_thread)
 
             except starlink_grpc.GrpcError as e:
-                logger.error("Failed getting obstruction map data:", str(e))
+                if is_replay_finished_error(e):
+                    logger.info("Replay finished")
+                    break
+                logger.error(f"Failed getting obstruction map data: {e}")
+                if trace is not None:
+                    trace.set(outcome="grpc_error", error=str(e))
+                    trace_log.write(trace)
             except Exception as e:
-                 logger.error(f"Unexpected error in get_obstruction_map loop: {e}")
+                logger.error(f"Unexpected error in get_obstruction_map loop: {e}")
+                if trace is not None:
+                    trace.set(outcome="error", error=str(e))
+                    trace_log.write(trace)
 
         logger.info("Measurement duration finished. Waiting for processing threads...")
-        for thread in thread_pool:
-            thread.join()
+        wait(pending)
         logger.info("All processing threads finished.")
+        trace_log.log_summary()
+        trace_log.close()
 
 
 def write_obstruction_map_parquet(FILENAME, timeslot_df):
@@ -356,113 +446,163 @@ def write_obstruction_map_parquet(FILENAME, timeslot_df):
     logger.info("Saved dish obstruction map to {}".format(FILENAME))
 
 
-def estimate_connected_satellites(uuid, date, frame_type, tilt, azimuth, start, end):
-    print(f"---> [{uuid}] ENTER estimate_connected_satellites") # DEBUG
+def _set_outcome(trace, outcome, **attributes):
+    if trace is not None:
+        trace.set(outcome=outcome, **attributes)
+
+
+def estimation_pool():
+    """Return the process pool satellites are estimated in, starting it if needed.
+
+    Workers are spawned rather than forked, since forking a process that has
+    gRPC threads running is unsafe. They take the observer location set at
+    the time the pool is started.
+    """
+    global _estimation_pool
+    with _estimation_pool_lock:
+        if _estimation_pool is None:
+            _estimation_pool = ProcessPoolExecutor(
+                max_workers=ESTIMATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_estimation_worker,
+                initargs=(config.LATITUDE, config.LONGITUDE, config.ALTITUDE),
+            )
+        return _estimation_pool
+
+
+def _init_estimation_worker(latitude, longitude, altitude):
+    config.LATITUDE = latitude
+    config.LONGITUDE = longitude
+    config.ALTITUDE = altitude
+
+
+def _load_satellites(tle_file):
+    # A worker loads each TLE file once, rather than once per slot
+    key = (tle_file, os.path.getmtime(tle_file))
+    if _worker.get("tle_key") != key:
+        _worker["satellites"] = load.tle_file(tle_file)
+        _worker["tle_key"] = key
+    return _worker["satellites"]
+
+
+def _estimate_slot(uuid, frame_type, tilt, azimuth, start, end, tle_file):
+    """Run the CPU bound part of estimate_connected_satellites in a worker process.
+
+    Returns (result DataFrame or None, span timings, trace attributes). The
+    reason for a None result is in the trace attributes.
+    """
+    trace = SlotTrace(None, uuid)
     start_ts = datetime.fromtimestamp(start, tz=timezone.utc)
     end_ts = datetime.fromtimestamp(end, tz=timezone.utc)
 
     try:
-        convert_observed(DATA_DIR, f"obstruction-data-{uuid}.csv", frame_type, tilt, azimuth)
-        print(f"---> [{uuid}] convert_observed OK") # DEBUG
+        with span(trace, "sky_transform"):
+            convert_observed(DATA_DIR, f"obstruction-data-{uuid}.csv", frame_type, tilt, azimuth)
     except Exception as e:
-        print(f"---> [{uuid}] ERROR in convert_observed: {e}") # DEBUG
-        return
+        logger.error(f"[{uuid}] Failed converting observed positions: {e}")
+        _set_outcome(trace, "error", error=f"sky_transform: {e}")
+        return None, trace.spans, trace.attributes
 
     filename = f"{DATA_DIR}/obstruction-data-{uuid}.csv"
     merged_data_file = f"{DATA_DIR}/processed_obstruction-data-{uuid}.csv"
 
-    print(f"---> [{uuid}] Checking files: {filename}, {merged_data_file}") # DEBUG
-    if not os.path.exists(filename): print(f"---> [{uuid}] MISSING: {filename}"); return # DEBUG
-    if not os.path.exists(merged_data_file): print(f"---> [{uuid}] MISSING: {merged_data_file}"); return # DEBUG
-    print(f"---> [{uuid}] All input files exist.") # DEBUG
-
-    # --- Modified TLE file finding logic ---
-    tle_dir_path = "{}/{}".format(TLE_DATA_DIR, date)
-    if not os.path.exists(tle_dir_path):
-        logger.error(f"[{uuid}] TLE directory not found: {tle_dir_path}")
-        return
-
-    # Find the latest TLE file in the directory for the given date
-    list_of_files = glob.glob(os.path.join(tle_dir_path, 'starlink-tle-*.txt'))
-    if not list_of_files:
-        logger.error(f"[{uuid}] No TLE files found in: {tle_dir_path}")
-        return
-    latest_tle_file = max(list_of_files, key=os.path.getctime)
-    print(f"---> [{uuid}] Using latest TLE file: {latest_tle_file}") # DEBUG
-    # --- End Modified TLE file finding logic ---
-
-    try:
-        satellites = load.tle_file(latest_tle_file)
-        print(f"---> [{uuid}] Loaded {len(satellites)} satellites.") # DEBUG
-    except Exception as e:
-        print(f"---> [{uuid}] ERROR loading TLE: {e}") # DEBUG
-        return
+    for path in (filename, merged_data_file):
+        if not os.path.exists(path):
+            logger.error(f"[{uuid}] Missing input file: {path}")
+            _set_outcome(trace, "missing_input", error=path)
+            return None, trace.spans, trace.attributes
+
+    with span(trace, "tle_load"):
+        try:
+            satellites = _load_satellites(tle_file)
+        except Exception as e:
+            logger.error(f"[{uuid}] Failed loading TLE file {tle_file}: {e}")
+            _set_outcome(trace, "no_tle", error=str(e))
+            return None, trace.spans, trace.attributes
+    logger.debug(f"[{uuid}] Loaded {len(satellites)} satellites from {tle_file}")
 
     try:
         result_df = process_intervals(
             filename,
             start_ts.year, start_ts.month, start_ts.day, start_ts.hour, start_ts.minute, start_ts.second,
             end_ts.year, end_ts.month, end_ts.day, end_ts.hour, end_ts.minute, end_ts.second,
-            merged_data_file, satellites, frame_type
+            merged_data_file, satellites, frame_type, trace=trace,
         )
-        print(f"---> [{uuid}] process_intervals shape: {result_df.shape}") # DEBUG
     except Exception as e:
-        print(f"---> [{uuid}] ERROR in process_intervals: {e}") # DEBUG
-        return
+        logger.error(f"[{uuid}] Failed estimating connected satellites: {e}")
+        _set_outcome(trace, "error", error=f"estimation: {e}")
+        return None, trace.spans, trace.attributes
 
     if result_df.empty:
-        print(f"---> [{uuid}] result_df is empty. Skipping.") # DEBUG
-        return
+        logger.info(f"[{uuid}] No matching satellite for timeslot starting {start_ts}")
+        _set_outcome(trace, "no_match")
+        return None, trace.spans, trace.attributes
+    return result_df, trace.spans, trace.attributes
 
-    try:
-        merged_data_df = pd.read_csv(merged_data_file, parse_dates=["Timestamp"])
-        print(f"---> [{uuid}] merged_data_df shape: {merged_data_df.shape}") # DEBUG
 
-        serving_data_path = f"{DATA_DIR}/serving_satellite_data-{uuid}.csv"
+def estimate_connected_satellites(uuid, date, frame_type, tilt, azimuth, start, end, trace=None):
+    """Estimate the serving satellite for a timeslot and append it to the serving satellite data.
 
-        print(f"---> [{uuid}] serving_data_path: {serving_data_path}") # DEBUG
+    The estimate is made in the estimation process pool, and saved by the
+    calling thread.
 
-        if os.path.exists(serving_data_path):
-            existing_df = pd.read_csv(serving_data_path, parse_dates=["Timestamp"])
-            print(f"---> [{uuid}] existing_df shape: {existing_df.shape}") # DEBUG
-        else:
-            existing_df = pd.DataFrame()
-            print(f"---> [{uuid}] No existing serving data found.") # DEBUG
-
-        merged_df = pd.merge(merged_data_df, result_df, on="Timestamp", how="inner")
-        print(f"---> [{uuid}] Inner merge shape: {merged_df.shape}") # DEBUG
-
-        if merged_df.empty:
-             print(f"---> [{uuid}] merged_df is empty after inner merge. Skipping write.") # DEBUG
-             return
-
-        updated_df = pd.concat([existing_df, merged_df]).drop_duplicates(
-            subset=["Timestamp"], keep="last"
-        )
-        print(f"---> [{uuid}] updated_df shape: {updated_df.shape}") # DEBUG
-
-        updated_df.to_csv(serving_data_path, index=False)
-        print(f"---> [{uuid}] Saved serving data to {serving_data_path}") # DEBUG
-
-    except Exception as e:
-        print(f"---> [{uuid}] ERROR in DataFrame processing/saving: {e}") # DEBUG
-        return
+    Returns the name of the serving satellite, or None if it could not be estimated. The reason is
+    logged, and recorded as the outcome of `trace`.
+    """
+    tle_dir_path = "{}/{}".format(TLE_DATA_DIR, date)
+    # Latest TLE file in the directory for the given date
+    list_of_files = glob.glob(os.path.join(tle_dir_path, 'starlink-tle-*.txt'))
+    if not list_of_files:
+        logger.error(f"[{uuid}] No TLE files found in: {tle_dir_path}")
+        _set_outcome(trace, "no_tle", error=tle_dir_path)
+        return None
+    latest_tle_file = max(list_of_files, key=os.path.getctime)
+    tle_file_time.set(os.path.getctime(latest_tle_file))
+
+    result_df, spans, attributes = estimation_pool().submit(
+        _estimate_slot, uuid, frame_type, tilt, azimuth, start, end, latest_tle_file
+    ).result()
+    if trace is not None:
+        trace.add_spans(spans)
+        trace.set(**attributes)
+    if result_df is None:
+        return None
 
-    # --- Added: Write latest satellite name to file ---
-    if not updated_df.empty:
-        latest_satellite_name = updated_df.iloc[-1]["Connected_Satellite"]
-        print(f"---> [{uuid}] Latest satellite name found: {latest_satellite_name}") # DEBUG
-        if latest_satellite_name and isinstance(latest_satellite_name, str):
-            try:
+    merged_data_file = f"{DATA_DIR}/processed_obstruction-data-{uuid}.csv"
+    serving_data_path = f"{DATA_DIR}/serving_satellite_data-{uuid}.csv"
+    try:
+        with span(trace, "persistence"):
+            merged_data_df = pd.read_csv(merged_data_file, parse_dates=["Timestamp"])
+            if os.path.exists(serving_data_path):
+                existing_df = pd.read_csv(serving_data_path, parse_dates=["Timestamp"])
+            else:
+                existing_df = pd.DataFrame()
+
+            merged_df = pd.merge(merged_data_df, result_df, on="Timestamp", how="inner")
+            if merged_df.empty:
+                logger.info(f"[{uuid}] No observed positions at the estimated timestamps, nothing to save")
+                _set_outcome(trace, "no_overlap")
+                return None
+
+            updated_df = pd.concat([existing_df, merged_df]).drop_duplicates(
+                subset=["Timestamp"], keep="last"
+            )
+            updated_df.to_csv(serving_data_path, index=False)
+            logger.debug(f"[{uuid}] Saved {len(updated_df)} rows of serving data to {serving_data_path}")
+
+            latest_satellite_name = updated_df.iloc[-1]["Connected_Satellite"]
+            if latest_satellite_name and isinstance(latest_satellite_name, str):
                 os.makedirs(os.path.dirname(LATEST_SATELLITE_FILE), exist_ok=True)
                 with open(LATEST_SATELLITE_FILE, 'w') as f:
                     f.write(latest_satellite_name)
-                print(f"---> [{uuid}] Wrote {latest_satellite_name} to {LATEST_SATELLITE_FILE}") # DEBUG
-            except Exception as e:
-                print(f"---> [{uuid}] ERROR writing latest satellite file: {e}") # DEBUG
-        else:
-            print(f"---> [{uuid}] Could not determine latest satellite name from data (is None or not string).") # DEBUG
-    else:
-        print(f"---> [{uuid}] Cannot write latest satellite name, updated_df is empty.") # DEBUG
-    # --- End Added ---
-    print(f"---> [{uuid}] EXIT estimate_connected_satellites") # DEBUG
+            else:
+                logger.warning(f"[{uuid}] Could not determine the latest satellite name from the serving data")
+                latest_satellite_name = None
+    except Exception as e:
+        logger.error(f"[{uuid}] Failed saving serving satellite data: {e}")
+        _set_outcome(trace, "error", error=f"persistence: {e}")
+        return None
+
+    logger.info(f"[{uuid}] Serving satellite: {latest_satellite_name}")
+    _set_outcome(trace, "matched", satellite=latest_satellite_name, slant_range_km=float(updated_df.iloc[-1]["Distance"]))
+    return latest_satellite_name
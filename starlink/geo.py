@@ -0,0 +1,211 @@
+# flake8: noqa: E501
+"""Spatial index and cached catalogs of fixed ground locations.
+
+`GeoIndex` buckets points into a lat/lon grid for bounding box, radius and
+k-nearest queries. Points are sorted by grid cell, so the points of a cell
+are the slice `starts[cell]:starts[cell + 1]` of `order`, and a query only
+computes haversine distances to the points of the cells it covers.
+
+`CachedCatalog` keeps an index built from a remote file in the asset cache,
+e.g. the PoP list or the ground station map, and rebuilds it only when the
+file changed.
+
+NumPy is imported when an index is built, not with this module, as the
+collector imports the catalogs at startup.
+"""
+
+import math
+import time
+import hashlib
+import logging
+import threading
+
+import assets
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+# Grid cell size, in degrees
+CELL_DEGREES = 5.0
+_LAT_CELLS = int(180 / CELL_DEGREES)
+_LON_CELLS = int(360 / CELL_DEGREES)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great circle distance in km, element-wise."""
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _lat_cell(lat):
+    import numpy as np
+
+    return np.clip(((np.asarray(lat) + 90) // CELL_DEGREES).astype(np.int64), 0, _LAT_CELLS - 1)
+
+
+def _lon_cell(lon):
+    import numpy as np
+
+    return ((np.asarray(lon) + 180) // CELL_DEGREES).astype(np.int64) % _LON_CELLS
+
+
+class GeoIndex:
+    """Points as lat/lon arrays, bucketed into a grid.
+
+    Query results are arrays of indices into `lats` and `lons`, and the
+    per-point arrays of subclasses.
+    """
+
+    def __init__(self, lats, lons):
+        import numpy as np
+
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        cells = _lat_cell(self.lats) * _LON_CELLS + _lon_cell(self.lons)
+        self.order = np.argsort(cells, kind="stable")
+        self.starts = np.searchsorted(cells[self.order], np.arange(_LAT_CELLS * _LON_CELLS + 1))
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _candidates(self, min_lat, max_lat, lon_ranges):
+        """Indices of the points in the grid cells covering the ranges."""
+        import numpy as np
+
+        lat_cells = np.arange(_lat_cell(max(min_lat, -90.0)), _lat_cell(min(max_lat, 90.0)) + 1)
+        lon_cells = np.unique(np.concatenate([
+            np.arange(int((lon_min + 180) // CELL_DEGREES), int((lon_max + 180) // CELL_DEGREES) + 1) % _LON_CELLS
+            for lon_min, lon_max in lon_ranges
+        ]))
+        cells = (lat_cells[:, None] * _LON_CELLS + lon_cells[None, :]).ravel()
+        slices = [self.order[self.starts[cell]:self.starts[cell + 1]] for cell in cells if self.starts[cell] != self.starts[cell + 1]]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def within_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        """Points inside a bounding box, in index order.
+
+        min_lon may be larger than max_lon for boxes crossing the antimeridian.
+        """
+        import numpy as np
+
+        wraps = min_lon > max_lon
+        lon_ranges = [(min_lon, 180.0), (-180.0, max_lon)] if wraps else [(min_lon, max_lon)]
+        candidates = self._candidates(min_lat, max_lat, lon_ranges)
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = (lats >= min_lat) & (lats <= max_lat)
+        if wraps:
+            inside &= (lons >= min_lon) | (lons <= max_lon)
+        else:
+            inside &= (lons >= min_lon) & (lons <= max_lon)
+        return np.sort(candidates[inside])
+
+    def within_radius(self, lat, lon, radius_km):
+        """Points within `radius_km` of a point, nearest first.
+
+        Returns (indices, distances in km).
+        """
+        import numpy as np
+
+        angle = radius_km / EARTH_RADIUS_KM
+        min_lat, max_lat = lat - math.degrees(angle), lat + math.degrees(angle)
+        if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2:
+            lon_ranges = [(-180.0, 180.0)]
+        else:
+            # Largest longitude difference of a point within the radius
+            half_width = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+            lon_ranges = [(lon - half_width, lon + half_width)]
+            if lon - half_width < -180:
+                lon_ranges = [(lon - half_width + 360, 180.0), (-180.0, lon + half_width)]
+            elif lon + half_width > 180:
+                lon_ranges = [(lon - half_width, 180.0), (-180.0, lon + half_width - 360)]
+        candidates = self._candidates(min_lat, max_lat, lon_ranges)
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, k=1):
+        """The `k` points nearest to a point, nearest first.
+
+        Returns (indices, distances in km).
+        """
+        k = min(k, len(self))
+        radius_km = 500.0
+        while True:
+            indices, distances = self.within_radius(lat, lon, radius_km)
+            if len(indices) >= k or radius_km >= math.pi * EARTH_RADIUS_KM:
+                return indices[:k], distances[:k]
+            radius_km *= 4
+
+
+class CachedCatalog:
+    """A GeoIndex built from a remote file kept in the asset cache.
+
+    `refresh` reloads the file through the asset cache, and only rebuilds
+    the index if the file changed; `start_refresh` does that periodically in
+    a background thread. The index is replaced, never modified, so to run
+    several queries against the same version of the catalog, take it with
+    `snapshot` and query it directly.
+
+    Subclasses implement `build(content, digest)`, returning the index.
+    """
+
+    name = "catalog"
+
+    def __init__(self, url, ttl):
+        self.url = url
+        self.ttl = ttl
+        self._index = None
+        self._lock = threading.Lock()
+
+    def build(self, content, digest):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Reload the file through the asset cache. Returns whether it changed."""
+        content = assets.fetch(self.url, self.ttl, self.name)
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if self._index is not None and self._index.digest == digest:
+                return False
+            self._index = self.build(content, digest)
+        logger.info(f"Loaded {len(self._index)} entries from {self.name}")
+        return True
+
+    def start_refresh(self, interval=None):
+        """Refresh the catalog every `interval` seconds, by default the cache TTL, in a daemon thread."""
+        interval = interval or self.ttl
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning(f"Failed to refresh {self.name}: {e}")
+
+        thread = threading.Thread(target=run, name=f"{self.name}-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self):
+        """Current index, loaded on first use."""
+        if self._index is None:
+            self.refresh()
+        return self._index
+
+    def __len__(self):
+        return len(self.snapshot())
+
+    def within_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        return self.snapshot().within_bbox(min_lat, max_lat, min_lon, max_lon)
+
+    def within_radius(self, lat, lon, radius_km):
+        return self.snapshot().within_radius(lat, lon, radius_km)
+
+    def nearest(self, lat, lon, k=1):
+        return self.snapshot().nearest(lat, lon, k)
@@ -1,31 +1,264 @@
 # flake8: noqa: E501
+"""Starlink ground stations and the bent-pipe path geometry through them.
 
-from pprint import pprint
+The ground station map is a KML file of placemarks. It is parsed once into
+a `GroundStationIndex` of names, folders and coordinates, indexed by
+location like the PoP catalog.
 
-import httpx
+`bent_pipe_geometry` computes, for every timestamp at once, the path from
+the dish up to the serving satellite and down to a gateway: the slant range
+to the satellite, the ranges and elevations of the gateways it sees, and
+the shortest dish -> satellite -> gateway (-> PoP, over fibre) delay among
+the visible ones. Twice that delay is a floor for the RTT to the Starlink
+gateway address, which `compare_rtt` puts next to measured pings.
+
+Example:
+    python gs.py data/serving_satellite_data-2024-01-01-00-00-00.csv \\
+        --tle data/TLE/2024-01-01/starlink-tle-2024-01-01-00-00-00.txt \\
+        --ping data/latency/2024-01-01/ping-10ms-2024-01-01-00-00-00.txt \\
+        --lat 47.6 --lon -122.3 --pop sttlwax1
+"""
+
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
 from fastkml import kml
+from skyfield.api import load, wgs84
+from skyfield.framelib import itrs
+
+import assets
+from config import GS_CACHE_TTL
+from geo import GeoIndex, CachedCatalog, haversine_km
+
+logger = logging.getLogger(__name__)
 
 GS_KML = "https://www.google.com/maps/d/kml?mid=1805q6rlePY4WZd8QMOaNe2BqAgFkYBY&resourcekey&forcekml=1"
 
+SPEED_OF_LIGHT_KM_S = 299792.458
+# Light in optical fibre travels at about c / 1.47
+FIBER_SPEED_KM_S = SPEED_OF_LIGHT_KM_S / 1.47
+# Lowest elevation at which a gateway links to a satellite
+GATEWAY_MIN_ELEVATION = 25.0
+# Ground distance beyond which a gateway cannot see the satellites the dish sees
+GATEWAY_MAX_DISTANCE_KM = 2500.0
+
+
+def parse_kml(content):
+    """Return (name, folder, lat, lon, altitude) of every point placemark in a KML document."""
+    placemarks = []
+
+    def walk(feature, folder):
+        for child in getattr(feature, "features", None) or []:
+            geometry = getattr(child, "geometry", None)
+            if geometry is not None:
+                if geometry.geom_type == "Point":
+                    lon, lat, *altitude = geometry.coords[0]
+                    placemarks.append(((child.name or "").strip(), folder, lat, lon, altitude[0] if altitude else 0.0))
+            else:
+                walk(child, (child.name or folder).strip())
+
+    walk(kml.KML.from_string(content), "")
+    return placemarks
+
+
+class GroundStationIndex(GeoIndex):
+    """Ground stations of one version of the map, as arrays indexed by location.
+
+    Query results are arrays of indices into `names`, `folders`, `lats`,
+    `lons` and `altitudes` (m).
+    """
+
+    def __init__(self, placemarks, digest=None):
+        super().__init__([p[2] for p in placemarks], [p[3] for p in placemarks])
+        self.digest = digest
+        self.names = np.array([p[0] for p in placemarks], dtype=str)
+        self.folders = np.array([p[1] for p in placemarks], dtype=str)
+        self.altitudes = np.array([p[4] for p in placemarks], dtype=np.float64)
+
+
+class GroundStationCatalog(CachedCatalog):
+    """Starlink ground stations from the KML map."""
+
+    name = "gs.kml"
+
+    def __init__(self, url=GS_KML, ttl=GS_CACHE_TTL):
+        super().__init__(url, ttl)
+
+    def build(self, content, digest):
+        return GroundStationIndex(parse_kml(content), digest)
+
+
+_catalog = None
+
+
+def gs_catalog():
+    """The shared GroundStationCatalog."""
+    global _catalog
+    if _catalog is None:
+        _catalog = GroundStationCatalog()
+    return _catalog
+
 
 def get_gs_data(centralLat, centralLon, offsetLat, offsetLon):
     try:
-        response = httpx.get(GS_KML)
-        response.raise_for_status()
-        k = kml.KML()
-
-        doc = k.from_string(response.content)
-    except httpx.RequestError as e:
-        print(f"An error occurred while fetching POP data: {e}")
+        index = gs_catalog().snapshot()
+        indices = index.within_bbox(centralLat - offsetLat, centralLat + offsetLat, centralLon - offsetLon, centralLon + offsetLon)
+        return {
+            "lats": index.lats[indices].tolist(),
+            "lons": index.lons[indices].tolist(),
+            "names": index.names[indices].tolist(),
+        }
+    except assets.AssetUnavailable as e:
+        print(f"An error occurred while fetching ground station data: {e}")
         return None
     except ValueError as e:
-        print(f"An error occurred while parsing POP data: {e}")
+        print(f"An error occurred while parsing ground station data: {e}")
         return None
 
 
+def bent_pipe_geometry(satellite, timestamps, latitude, longitude, altitude, index, pop_location=None, min_elevation=GATEWAY_MIN_ELEVATION):
+    """Dish -> satellite -> gateway geometry at each timestamp.
+
+    Args:
+        satellite: skyfield EarthSatellite serving the dish.
+        timestamps: Unix timestamps, in seconds.
+        latitude, longitude, altitude: Dish location, altitude in m.
+        index: GroundStationIndex of the candidate gateways.
+        pop_location: Optional (lat, lon) of the PoP, to add the great
+            circle gateway -> PoP distance over fibre to the delay.
+        min_elevation: Lowest satellite elevation seen from a usable gateway.
+
+    Returns a DataFrame with one row per timestamp. Gateway columns are
+    empty, and rtt_floor_ms NaN, when no gateway sees the satellite.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    # Whole days and seconds of the day, so skyfield applies the leap seconds of each date
+    days = np.floor(timestamps / 86400)
+    t = load.timescale().utc(1970, 1, 1 + days, 0, 0, timestamps - days * 86400)
+    satellite_xyz = satellite.at(t).frame_xyz(itrs).km.reshape(3, -1)  # (3, T)
+    dish_xyz = wgs84.latlon(latitude, longitude, elevation_m=altitude).itrs_xyz.km
+    dish_range = np.linalg.norm(satellite_xyz - dish_xyz[:, None], axis=0)
+
+    candidates, _ = index.within_radius(latitude, longitude, GATEWAY_MAX_DISTANCE_KM)
+    lats, lons = index.lats[candidates], index.lons[candidates]
+    gateway_xyz = wgs84.latlon(lats, lons, elevation_m=index.altitudes[candidates]).itrs_xyz.km.reshape(3, -1)  # (3, G)
+    lat_rad, lon_rad = np.radians(lats), np.radians(lons)
+    up = np.stack([np.cos(lat_rad) * np.cos(lon_rad), np.cos(lat_rad) * np.sin(lon_rad), np.sin(lat_rad)])
+
+    offset = satellite_xyz[:, :, None] - gateway_xyz[:, None, :]  # (3, T, G)
+    gateway_range = np.linalg.norm(offset, axis=0)
+    elevation = np.degrees(np.arcsin(np.einsum("itg,ig->tg", offset, up) / gateway_range))
+    visible = elevation >= min_elevation
+
+    fiber_km = haversine_km(lats, lons, *pop_location) if pop_location is not None else np.zeros(len(candidates))
+    delay = (dish_range[:, None] + gateway_range) / SPEED_OF_LIGHT_KM_S + fiber_km[None, :] / FIBER_SPEED_KM_S
+    delay = np.where(visible, delay, np.inf)
+    best = np.argmin(delay, axis=1) if len(candidates) else np.zeros(len(timestamps), dtype=np.int64)
+    rows = np.arange(len(timestamps))
+    has_gateway = visible.any(axis=1)
+
+    def pick(values, empty):
+        if not len(candidates):
+            return np.full(len(timestamps), empty)
+        return np.where(has_gateway, values[rows, best] if values.ndim == 2 else values[best], empty)
+
+    return pd.DataFrame(
+        {
+            "timestamp": timestamps,
+            "satellite": satellite.name,
+            "dish_range_km": dish_range,
+            "visible_gateways": visible.sum(axis=1),
+            "gateway": pick(index.names[candidates], ""),
+            "gateway_range_km": pick(gateway_range, np.nan),
+            "gateway_elevation": pick(elevation, np.nan),
+            "fiber_km": pick(fiber_km, np.nan),
+            "rtt_floor_ms": pick(2000 * delay, np.nan),
+        }
+    )
+
+
+def serving_geometry(serving, satellites, latitude, longitude, altitude, index, pop_location=None):
+    """`bent_pipe_geometry` for every row of a serving satellite file.
+
+    Args:
+        serving: DataFrame with Timestamp and Connected_Satellite columns, as
+            written by the collector.
+        satellites: EarthSatellites of the TLE set the run was matched with.
+    """
+    by_name = {satellite.name: satellite for satellite in satellites}
+    timestamps = (pd.to_datetime(serving["Timestamp"], utc=True) - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+    frames = []
+    for name, rows in serving.groupby("Connected_Satellite", sort=False).groups.items():
+        if name not in by_name:
+            logger.warning(f"Satellite {name} is not in the TLE set, skipping {len(rows)} rows")
+            continue
+        frames.append(bent_pipe_geometry(by_name[name], timestamps[rows].to_numpy(), latitude, longitude, altitude, index, pop_location))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames).sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+def compare_rtt(geometry, rtt):
+    """Join measured RTTs to the geometric floor, per second.
+
+    Args:
+        geometry: Output of `bent_pipe_geometry` or `serving_geometry`.
+        rtt: DataFrame with timestamp (s) and rtt (ms) columns, as returned
+            by util.load_ping.
+
+    Adds the lowest and median measured RTT and the number of replies in
+    each second, and excess_ms, the lowest measured RTT above the floor.
+    """
+    measured = rtt.groupby(np.floor(rtt["timestamp"]).astype(np.int64))["rtt"].agg(
+        measured_rtt_min_ms="min", measured_rtt_median_ms="median", replies="count"
+    )
+    result = geometry.assign(second=np.floor(geometry["timestamp"]).astype(np.int64))
+    result = result.join(measured, on="second").drop(columns="second")
+    result["replies"] = result["replies"].fillna(0).astype(np.int64)
+    result["excess_ms"] = result["measured_rtt_min_ms"] - result["rtt_floor_ms"]
+    return result
+
+
 if __name__ == "__main__":
-    centralLat = 37.7749
-    centralLon = -122.4194
-    offsetLat = 0.1
-    offsetLon = 0.1
-    get_gs_data(centralLat, centralLon, offsetLat, offsetLon)
+    from util import load_ping, load_tle_from_file
+    from pop import pop_catalog
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="LEOViz | Compare measured RTT with the bent-pipe geometric floor")
+
+    parser.add_argument("serving", help="Serving satellite CSV of a run")
+    parser.add_argument("--tle", required=True, help="TLE file the run was matched with")
+    parser.add_argument("--ping", help="Ping output of the same run")
+    parser.add_argument("--lat", type=float, required=True, help="Dish latitude")
+    parser.add_argument("--lon", type=float, required=True, help="Dish longitude")
+    parser.add_argument("--alt", type=float, default=0.0, help="Dish altitude in m")
+    parser.add_argument("--pop", help="Home PoP code, to include the gateway to PoP fibre distance")
+    parser.add_argument("--output", help="Write the per-second results to this CSV file")
+    args = parser.parse_args()
+
+    pop_location = None
+    if args.pop:
+        pop_location = pop_catalog().location(args.pop)
+        if pop_location is None:
+            logger.warning(f"PoP {args.pop} is not in the PoP catalog, ignoring it")
+
+    geometry = serving_geometry(
+        pd.read_csv(args.serving), load_tle_from_file(args.tle), args.lat, args.lon, args.alt, gs_catalog().snapshot(), pop_location
+    )
+    if geometry.empty:
+        print("No serving satellite in the TLE set")
+        raise SystemExit(1)
+    if args.ping:
+        geometry = compare_rtt(geometry, load_ping(args.ping))
+    if args.output:
+        geometry.to_csv(args.output, index=False)
+
+    print(f"Seconds: {len(geometry)}, without a visible gateway: {int((geometry['visible_gateways'] == 0).sum())}")
+    print(f"Visible gateways, median: {geometry['visible_gateways'].median():.0f}")
+    print(f"RTT floor ms, median: {geometry['rtt_floor_ms'].median():.2f}, min: {geometry['rtt_floor_ms'].min():.2f}")
+    if args.ping:
+        print(f"Measured min RTT ms, median: {geometry['measured_rtt_min_ms'].median():.2f}")
+        print(f"Excess over floor ms, p10/p50/p90: {' / '.join(f'{v:.2f}' for v in geometry['excess_ms'].quantile([0.1, 0.5, 0.9]))}")
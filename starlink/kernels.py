@@ -0,0 +1,251 @@
+# flake8: noqa: E501
+"""Batch kernels for satellite matching and obstruction map scans.
+
+The functions in this module score many candidate satellites against the
+observed trajectory points at once, and find the newest pixel of every
+obstruction map frame, without going through per-value Python calls.
+
+Every kernel has a pure NumPy implementation, which is always available.
+FRAME_UT scoring and the pixel scan also have numba compiled loops, used when
+numba is installed. The choice is made once, on the first kernel call, so
+importing this module does not import numba, and can be forced with the
+USE_JIT environment variable ("auto", "1" or "0"). All of them follow
+the floating point operation order of the scalar helpers in satellites.py and
+return bit-for-bit the same values, which tests/test_kernels.py checks for
+both backends.
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+from config import USE_JIT
+
+logger = logging.getLogger(__name__)
+
+
+def _angular_separation(alt1, az1, alt2, az2):
+    alt1, alt2 = np.radians(alt1), np.radians(alt2)
+    az1 = (az1 + 360) % 360
+    az2 = (az2 + 360) % 360
+    az_diff = np.abs(az1 - az2)
+    az_diff = np.where(az_diff > 180, 360 - az_diff, az_diff)
+    az_diff = np.radians(az_diff)
+    separation = np.arccos(
+        np.sin(alt1) * np.sin(alt2) + np.cos(alt1) * np.cos(alt2) * np.cos(az_diff)
+    )
+    return np.degrees(separation)
+
+
+def _bearing(alt1, az1, alt2, az2):
+    alt1, alt2 = np.radians(alt1), np.radians(alt2)
+    az1, az2 = np.radians(az1), np.radians(az2)
+    x = np.sin(az2 - az1) * np.cos(alt2)
+    y = np.cos(alt1) * np.sin(alt2) - np.sin(alt1) * np.cos(alt2) * np.cos(az2 - az1)
+    bearing = np.degrees(np.arctan2(x, y))
+    return (bearing + 360) % 360
+
+
+def _azimuth_difference(az1, az2):
+    diff = np.abs(az1 - az2) % 360
+    return np.where(diff > 180, 360 - diff, diff)
+
+
+def _direction_vector(alt1, az1, alt2, az2):
+    alt_diff = alt2 - alt1
+    az_diff = _azimuth_difference(az2, az1)
+    magnitude = np.sqrt(alt_diff**2 + az_diff**2)
+    nonzero = magnitude != 0
+    safe = np.where(nonzero, magnitude, 1.0)
+    return (
+        np.where(nonzero, alt_diff / safe, 0.0),
+        np.where(nonzero, az_diff / safe, 0.0),
+    )
+
+
+def _frame_earth_scores_numpy(obs_alt, obs_az, sat_alt, sat_az):
+    obs_alt = np.asarray(obs_alt, dtype=np.float64)
+    obs_az = np.asarray(obs_az, dtype=np.float64)
+    sat_alt = np.asarray(sat_alt, dtype=np.float64)
+    sat_az = np.asarray(sat_az, dtype=np.float64)
+    points = obs_alt.shape[0]
+
+    total = np.zeros(sat_alt.shape[0], dtype=np.float64)
+    for i in range(points):
+        total += _angular_separation(obs_alt[i], obs_az[i], sat_alt[:, i], sat_az[:, i])
+
+    observed_bearing = _bearing(obs_alt[0], obs_az[0], obs_alt[-1], obs_az[-1])
+    satellite_bearing = _bearing(sat_alt[:, 0], sat_az[:, 0], sat_alt[:, -1], sat_az[:, -1])
+    bearing_diff = np.abs(observed_bearing - satellite_bearing)
+    bearing_diff = np.where(bearing_diff > 180, 360 - bearing_diff, bearing_diff)
+    return total + bearing_diff
+
+
+def _frame_ut_scores_numpy(obs_alt, obs_az, sat_alt, sat_az):
+    obs_alt = np.asarray(obs_alt, dtype=np.float64)
+    obs_az = np.asarray(obs_az, dtype=np.float64)
+    sat_alt = np.asarray(sat_alt, dtype=np.float64)
+    sat_az = np.asarray(sat_az, dtype=np.float64)
+    points = obs_alt.shape[0]
+
+    distance = np.zeros(sat_alt.shape[0], dtype=np.float64)
+    for i in range(points):
+        alt_deviation = np.abs(obs_alt[i] - sat_alt[:, i]) / 90.0
+        az_deviation = _azimuth_difference(obs_az[i], sat_az[:, i]) / 180.0
+        distance += alt_deviation + az_deviation
+
+    obs_dir_alt, obs_dir_az = _direction_vector(obs_alt[0], obs_az[0], obs_alt[-1], obs_az[-1])
+    sat_dir_alt, sat_dir_az = _direction_vector(
+        sat_alt[:, 0], sat_az[:, 0], sat_alt[:, points - 1], sat_az[:, points - 1]
+    )
+    direction_diff = (
+        np.sqrt((obs_dir_alt - sat_dir_alt) ** 2 + (obs_dir_az - sat_dir_az) ** 2) / 2.0
+    )
+    return distance + direction_diff
+
+
+def _last_changed_pixels_numpy(frames):
+    frames = np.asarray(frames)
+    result = np.full(frames.shape[0], -1, dtype=np.int64)
+    if frames.shape[0] < 2:
+        return result
+    changed = np.bitwise_xor(frames[1:], frames[:-1]) == 1
+    has_change = changed.any(axis=1)
+    last = changed.shape[1] - 1 - np.argmax(changed[:, ::-1], axis=1)
+    result[1:] = np.where(has_change, last, -1)
+    return result
+
+
+def _compile_kernels():
+    # Only kernels built from IEEE exact operations (+, -, *, /, sqrt, abs,
+    # %) are compiled. numba's sin/cos/acos come from a different libm than
+    # NumPy's ufunc loops and can differ in the last bit, so FRAME_EARTH
+    # scoring always runs on the NumPy implementation.
+    import math
+
+    import numba
+
+    @numba.njit(cache=True)
+    def azimuth_difference(az1, az2):
+        diff = abs(az1 - az2) % 360
+        if diff > 180:
+            diff = 360 - diff
+        return diff
+
+    @numba.njit(cache=True)
+    def frame_ut_scores(obs_alt, obs_az, sat_alt, sat_az):
+        candidates, points = sat_alt.shape
+        scores = np.empty(candidates, dtype=np.float64)
+
+        obs_alt_diff = obs_alt[points - 1] - obs_alt[0]
+        obs_az_diff = azimuth_difference(obs_az[points - 1], obs_az[0])
+        magnitude = math.sqrt(obs_alt_diff**2 + obs_az_diff**2)
+        obs_dir_alt, obs_dir_az = 0.0, 0.0
+        if magnitude != 0:
+            obs_dir_alt, obs_dir_az = obs_alt_diff / magnitude, obs_az_diff / magnitude
+
+        for c in range(candidates):
+            distance = 0.0
+            for i in range(points):
+                distance += abs(obs_alt[i] - sat_alt[c, i]) / 90.0 + azimuth_difference(obs_az[i], sat_az[c, i]) / 180.0
+
+            sat_alt_diff = sat_alt[c, points - 1] - sat_alt[c, 0]
+            sat_az_diff = azimuth_difference(sat_az[c, points - 1], sat_az[c, 0])
+            magnitude = math.sqrt(sat_alt_diff**2 + sat_az_diff**2)
+            sat_dir_alt, sat_dir_az = 0.0, 0.0
+            if magnitude != 0:
+                sat_dir_alt, sat_dir_az = sat_alt_diff / magnitude, sat_az_diff / magnitude
+
+            scores[c] = distance + math.sqrt(
+                (obs_dir_alt - sat_dir_alt) ** 2 + (obs_dir_az - sat_dir_az) ** 2
+            ) / 2.0
+        return scores
+
+    @numba.njit(cache=True)
+    def last_changed_pixels(frames):
+        count, pixels = frames.shape
+        result = np.full(count, -1, dtype=np.int64)
+        for n in range(1, count):
+            for p in range(pixels - 1, -1, -1):
+                if (frames[n, p] ^ frames[n - 1, p]) == 1:
+                    result[n] = p
+                    break
+        return result
+
+    return frame_ut_scores, last_changed_pixels
+
+
+def _select_backend():
+    if USE_JIT == "0":
+        return None
+    try:
+        return _compile_kernels()
+    except ImportError:
+        if USE_JIT == "1":
+            logger.warning("USE_JIT=1 but numba is not installed, using NumPy kernels")
+        return None
+
+
+_backend_lock = threading.Lock()
+_backend = None
+
+
+def _kernels():
+    """Return (frame_ut_scores, last_changed_pixels), selecting the backend on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                jit_kernels = _select_backend()
+                if jit_kernels is None:
+                    jit_kernels = (_frame_ut_scores_numpy, _last_changed_pixels_numpy)
+                    logger.debug("Using NumPy kernels")
+                _backend = jit_kernels
+    return _backend
+
+
+def jit_enabled():
+    """Whether the numba compiled kernels are in use."""
+    return _kernels()[0] is not _frame_ut_scores_numpy
+
+
+def frame_earth_scores(obs_alt, obs_az, sat_alt, sat_az):
+    """Score candidates against a FRAME_EARTH trajectory.
+
+    Args:
+        obs_alt, obs_az: Observed altitude and azimuth, shape (points,).
+        sat_alt, sat_az: Candidate altitude and azimuth, shape (candidates, points).
+
+    Returns:
+        Array of shape (candidates,) holding, for each candidate, the value
+        of satellites.calculate_total_difference.
+    """
+    return _frame_earth_scores_numpy(*_as_float64(obs_alt, obs_az, sat_alt, sat_az))
+
+
+def frame_ut_scores(obs_alt, obs_az, sat_alt, sat_az):
+    """Score candidates against a FRAME_UT trajectory.
+
+    Same arguments as `frame_earth_scores`. Returns, for each candidate, the
+    value of satellites.calculate_trajectory_distance_frame_ut.
+    """
+    return _kernels()[0](*_as_float64(obs_alt, obs_az, sat_alt, sat_az))
+
+
+def last_changed_pixels(frames):
+    """Find the newest pixel of every obstruction map frame.
+
+    Args:
+        frames: Integer array of shape (frames, pixels) holding flattened
+            binary obstruction maps in time order.
+
+    Returns:
+        Array of shape (frames,) with the flat index of the last pixel that
+        differs from the previous frame, or -1 where nothing changed.
+    """
+    return _kernels()[1](np.ascontiguousarray(frames))
+
+
+def _as_float64(*arrays):
+    return tuple(np.ascontiguousarray(a, dtype=np.float64) for a in arrays)
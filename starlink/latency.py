@@ -1,50 +1,331 @@
 # flake8: noqa: E501
+"""Latency probing without the ping binary.
 
+Several targets are probed at the same time from one asyncio event loop:
+the Starlink gateway, an address at the PoP, an anycast DNS service and any
+extra targets, each at its own interval, so latency can be split between
+the space segment and terrestrial backhaul. Every target sends echo requests
+on a fixed schedule of the monotonic clock, matches replies by sequence
+number, and writes one fixed-width binary record per probe, in send order:
+
+    send_ts         float64  wall clock send time, s
+    rtt             float32  round trip time, ms, NaN if lost
+    lost            uint8    1 if no reply arrived within the timeout
+    slot            int64    timeslot ID at send time, see slots.py
+    satellite_slot  int64    slot of the satellite estimate below, -1 if none
+    satellite       16 bytes last estimated serving satellite at send time
+
+Serving satellites are estimated from the obstruction map after their slot
+has ended, so `satellite` is the latest estimate, usually of an earlier slot
+than `slot`. It is exact where satellite_slot equals slot; otherwise join the
+records to the serving satellite file of the run by slot.
+
+The records load with `np.fromfile(path, dtype=RECORD_FIELDS)`.
+
+Probes use unprivileged ICMP datagram sockets, which need the group of the
+process in net.ipv4.ping_group_range (`sysctl net.ipv4.ping_group_range="0
+2147483647"`). Targets that cannot be probed that way are skipped. With
+LATENCY_PROBE=udp, probes are UDP datagrams to an echo service instead, e.g.
+a local stand-in for testing. That is never chosen automatically, since a
+host without an echo service would show up as 100% loss.
+"""
+
+import time
+import errno
+import socket
+import struct
+import asyncio
 import logging
-import subprocess
 import threading
 
+import metrics
 from config import (
     INTERVAL_MS,
-    INTERVAL_SEC,
-    DURATION,
     DURATION_SECONDS,
     IFCE,
-    COUNT,
     STARLINK_DEFAULT_GW,
     LATENCY_DATA_DIR,
+    LATENCY_PROBE,
+    LATENCY_UDP_PORT,
+    LATENCY_TIMEOUT,
+    LATENCY_PAYLOAD_BYTES,
+    LATENCY_POP_TARGET,
+    LATENCY_POP_INTERVAL,
+    LATENCY_DNS_TARGET,
+    LATENCY_DNS_INTERVAL,
+    LATENCY_TARGETS,
 )
 from util import date_time_string, ensure_data_directory
 
 logger = logging.getLogger(__name__)
 
+RECORD_FIELDS = [
+    ("send_ts", "<f8"),
+    ("rtt", "<f4"),
+    ("lost", "u1"),
+    ("slot", "<i8"),
+    ("satellite_slot", "<i8"),
+    ("satellite", "S16"),
+]
+RECORD = struct.Struct("<dfBqq16s")
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+# type, code, checksum, identifier, sequence. The kernel sets the
+# identifier and checksum of ICMP datagram sockets.
+ICMP_HEADER = struct.Struct("!BBHHH")
+# Probe index at the start of the payload of UDP probes
+UDP_HEADER = struct.Struct("!Q")
+
+RTT_BUCKETS = (0.005, 0.01, 0.015, 0.02, 0.025, 0.03, 0.04, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1, 2)
+
+
+def parse_interval(interval):
+    """Seconds in an interval like "10ms" or "1s"."""
+    if interval.endswith("ms"):
+        return float(interval[:-2]) / 1000
+    if interval.endswith("s"):
+        return float(interval[:-1])
+    return float(interval)
+
+
+def open_socket(host, mode=LATENCY_PROBE, port=LATENCY_UDP_PORT, interface=IFCE):
+    """Open a connected, non-blocking probe socket to `host`.
+
+    Args:
+        mode: "icmp" or "udp", see config.LATENCY_PROBE.
+
+    Raises:
+        PermissionError: ICMP datagram sockets are not permitted.
+        ValueError: Unknown mode.
+    """
+    if mode not in ("icmp", "udp"):
+        raise ValueError(f"Unknown latency probe mode {mode!r}, expected \"icmp\" or \"udp\"")
+    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    if mode == "icmp":
+        protocol = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM, protocol)
+        except PermissionError as e:
+            raise PermissionError(
+                e.errno,
+                "ICMP datagram sockets are not permitted, add the group of the process to net.ipv4.ping_group_range, "
+                f"or set LATENCY_PROBE=udp if {host} runs a UDP echo service on port {port}",
+            ) from e
+        address = address[:1] + (0,) + address[2:]
+    else:
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+    if interface:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
+    sock.connect(address)
+    sock.setblocking(False)
+    return sock
+
+
+def _no_satellite():
+    return None
+
+
+class ProbeTarget:
+    """One probed host, with its own socket and interval.
+
+    Args:
+        name: Target name, used in file names and metric labels.
+        host: Target name or address.
+        interval: Seconds between probes.
+        mode: "icmp" or "udp", see config.LATENCY_PROBE.
+        timeout: Seconds after which a probe without a reply counts as lost.
+    """
+
+    def __init__(self, name, host, interval, mode=LATENCY_PROBE, port=LATENCY_UDP_PORT, timeout=LATENCY_TIMEOUT, payload_bytes=LATENCY_PAYLOAD_BYTES, interface=IFCE):
+        self.sock = open_socket(host, mode, port, interface)
+        self.mode = mode
+        self.family = self.sock.family
+        self.name = name
+        self.host = host
+        self.interval = interval
+        self.timeout = timeout
+        # ICMP payloads are all padding, like ping's, UDP ones start with the probe index
+        self.padding = bytes(payload_bytes if self.mode == "icmp" else max(0, payload_bytes - UDP_HEADER.size))
+        labels = {"target": name}
+        self.sent = metrics.counter("latency_probes_total", "Latency probes, by target and result", {**labels, "result": "sent"})
+        self.lost = metrics.counter("latency_probes_total", "Latency probes, by target and result", {**labels, "result": "lost"})
+        self.rtt = metrics.histogram("latency_rtt_seconds", "Round trip time of latency probes", labels, buckets=RTT_BUCKETS)
+
+    def _key(self, index):
+        """What the reply to probe `index` carries: its 16 bit ICMP sequence number, or the index itself."""
+        return index & 0xFFFF if self.mode == "icmp" else index
+
+    def _send(self, index):
+        if self.mode == "icmp":
+            packet = ICMP_HEADER.pack(ICMP_ECHO_REQUEST[self.family], 0, 0, 0, index & 0xFFFF) + self.padding
+        else:
+            packet = UDP_HEADER.pack(index) + self.padding
+        try:
+            self.sock.send(packet)
+        except OSError as e:
+            # The probe is recorded as lost
+            if e.errno not in (errno.ENETUNREACH, errno.EHOSTUNREACH, errno.ENOBUFS, errno.EAGAIN):
+                raise
+
+    def _receive(self):
+        """Yield the sequence number, or UDP probe index, of the replies waiting on the socket."""
+        while True:
+            try:
+                packet = self.sock.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionRefusedError:
+                continue  # ICMP port unreachable for an earlier UDP probe
+            if self.mode == "icmp":
+                if len(packet) >= ICMP_HEADER.size:
+                    kind, _, _, _, sequence = ICMP_HEADER.unpack_from(packet)
+                    if kind == ICMP_ECHO_REPLY[self.family]:
+                        yield sequence
+            elif len(packet) >= UDP_HEADER.size:
+                yield UDP_HEADER.unpack_from(packet)[0]
+
+    async def run(self, duration, output, epoch, serving_satellite=_no_satellite, stop=None):
+        """Probe for `duration` seconds, writing records to the open binary file `output` as probes complete.
+
+        Args:
+            epoch: (monotonic, wall clock) time pair, shared by all targets
+                of a run, to convert send times to wall clock time.
+            serving_satellite: Returns (slot, satellite) of the latest serving
+                satellite estimate, or None.
+            stop: Optional asyncio.Event ending the run early.
+
+        Returns (sent, lost).
+        """
+        from slots import slot_id
+
+        loop = asyncio.get_running_loop()
+        count = int(duration / self.interval)
+        send_times = []
+        tags = []
+        rtts = {}
+        # Keys of the probes waiting for a reply. ICMP sequence numbers wrap at
+        # 65536, far more probes than are ever in flight at once.
+        in_flight = {}
+        written = lost = 0
+
+        def complete(final=False):
+            # Write probes in send order: replied, timed out, or still waiting at the end
+            nonlocal written, lost
+            now = time.monotonic()
+            while written < len(send_times) and (written in rtts or final or now - send_times[written] >= self.timeout):
+                rtt = rtts.pop(written, None)
+                if rtt is None:
+                    in_flight.pop(self._key(written), None)
+                    lost += 1
+                else:
+                    self.rtt.observe(rtt / 1000)
+                send_ts = epoch[1] + (send_times[written] - epoch[0])
+                output.write(RECORD.pack(send_ts, float("nan") if rtt is None else rtt, rtt is None, *tags[written]))
+                written += 1
+
+        def on_readable():
+            received = time.monotonic()
+            for key in self._receive():
+                index = in_flight.pop(key, None)
+                if index is not None:
+                    rtts[index] = (received - send_times[index]) * 1000
+            complete()
+
+        loop.add_reader(self.sock, on_readable)
+        try:
+            start = time.monotonic()
+            for index in range(count):
+                delay = start + index * self.interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if stop is not None and stop.is_set():
+                    break
+                satellite_slot, satellite = serving_satellite() or (-1, "")
+                in_flight[self._key(index)] = index
+                send_times.append(time.monotonic())
+                self._send(index)
+                slot = slot_id(epoch[1] + (send_times[-1] - epoch[0]))
+                tags.append((slot, satellite_slot, satellite.encode()[:16]))
+                complete()
+            if send_times:
+                await asyncio.sleep(max(0.0, send_times[-1] + self.timeout - time.monotonic()))
+        finally:
+            loop.remove_reader(self.sock)
+            complete(final=True)
+        self.sent.inc(written)
+        self.lost.inc(lost)
+        return written, lost
+
+    def close(self):
+        self.sock.close()
+
+
+def configured_targets():
+    """(name, host, interval in s) of the configured targets."""
+    targets = [("gateway", STARLINK_DEFAULT_GW, parse_interval(INTERVAL_MS))]
+    if LATENCY_POP_TARGET:
+        targets.append(("pop", LATENCY_POP_TARGET, parse_interval(LATENCY_POP_INTERVAL)))
+    if LATENCY_DNS_TARGET:
+        targets.append(("dns", LATENCY_DNS_TARGET, parse_interval(LATENCY_DNS_INTERVAL)))
+    for item in filter(None, (item.strip() for item in LATENCY_TARGETS.split(","))):
+        name, _, rest = item.partition("=")
+        host, _, interval = rest.rpartition("@")
+        targets.append((name, host, parse_interval(interval)))
+    return targets
+
+
+async def probe(targets, duration, directory, run_id, serving_satellite=_no_satellite, stop=None):
+    """Probe all targets concurrently for `duration` seconds.
+
+    The gateway's records go to ping-<interval>-<run_id>.bin, those of other
+    targets to ping-<name>-<interval>-<run_id>.bin in `directory`.
+
+    Returns {name: (path, sent, lost)}.
+    """
+    epoch = (time.monotonic(), time.time())
+    paths, files = {}, []
+    try:
+        for target in targets:
+            interval = f"{round(target.interval * 1000)}ms"
+            prefix = "ping" if target.name == "gateway" else f"ping-{target.name}"
+            paths[target.name] = f"{directory}/{prefix}-{interval}-{run_id}.bin"
+            files.append(open(paths[target.name], "wb"))
+        results = await asyncio.gather(
+            *(target.run(duration, output, epoch, serving_satellite, stop) for target, output in zip(targets, files)),
+            return_exceptions=True,
+        )
+    finally:
+        for output in files:
+            output.close()
+    summary = {}
+    for target, result in zip(targets, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Probing {target.name} ({target.host}) failed: {result!r}")
+        else:
+            summary[target.name] = (paths[target.name], *result)
+    return summary
+
 
 def icmp_ping() -> None:
     name = "ICMP_PING"
     logger.info("{}, {}".format(name, threading.current_thread()))
 
-    FILENAME = "{}/{}/ping-{}-{}.txt".format(
-        LATENCY_DATA_DIR,
-        ensure_data_directory(LATENCY_DATA_DIR),
-        INTERVAL_MS,
-        date_time_string(),
-    )
-
-    cmd = [
-        "ping",
-        "-D",
-        "-i",
-        INTERVAL_SEC,
-        "-c",
-        str(COUNT),
-        STARLINK_DEFAULT_GW,
-    ]
-    if IFCE != "":
-        cmd += ["-I", IFCE]
+    # Imported here, as it pulls in numpy, which the collector does not need at startup
+    from tracing import serving_satellite
+
+    directory = "{}/{}".format(LATENCY_DATA_DIR, ensure_data_directory(LATENCY_DATA_DIR))
+    targets = []
+    for target, host, interval in configured_targets():
+        try:
+            targets.append(ProbeTarget(target, host, interval))
+        except OSError as e:
+            logger.error(f"Cannot probe {target} ({host}): {e}")
     try:
-        with open(FILENAME, "w") as outfile:
-            subprocess.run(cmd, stdout=outfile, timeout=DURATION_SECONDS)
-    except subprocess.TimeoutExpired:
-        pass
+        results = asyncio.run(probe(targets, DURATION_SECONDS, directory, date_time_string(), serving_satellite))
+    finally:
+        for target in targets:
+            target.close()
 
-    logger.info("Latency measurement saved to {}".format(FILENAME))
+    for target, (path, sent, lost) in results.items():
+        logger.info("Latency measurement of {} saved to {}, {} probes, {} lost".format(target, path, sent, lost))
@@ -1,22 +1,24 @@
 # flake8: noqa: E501
 import time
+import asyncio
 import logging
 import argparse
-import schedule
 import sys
 import os
 from pathlib import Path
 import json
 
 import config
+import metrics
+import profiler
 from latency import icmp_ping
-from dish import (
-    grpc_get_status,
-    get_obstruction_map,
+from pop import HomePopDetector
+from util import load_tle, date_time_string
+from scheduler import Scheduler, JobDone
+from config import (
+    print_config, LATITUDE, LONGITUDE, ALTITUDE, METRICS_PORT, METRICS_ADDRESS, PROFILING,
+    LATENCY_JOB_INTERVAL, STATUS_JOB_INTERVAL, TLE_JOB_INTERVAL, POP_JOB_INTERVAL, JOB_JITTER,
 )
-from pop import get_home_pop
-from util import run, load_tle, date_time_string
-from config import print_config, LATITUDE, LONGITUDE, ALTITUDE
 
 
 logger = logging.getLogger(__name__)
@@ -28,56 +30,87 @@ LATEST_POP_FILE = DATA_DIR_PATH / 'latest_pop.txt'
 OBSERVER_LOCATION_FILE = DATA_DIR_PATH / 'observer_location.json'
 # -------------------------------
 
-schedule.every(1).hours.at(":00").do(run, icmp_ping).tag("Latency")
-schedule.every(1).hours.at(":00").do(run, grpc_get_status).tag("gRPC_Status")
-schedule.every(1).hours.at(":00").do(run, load_tle).tag("TLE")
+METRICS_PREFIX = "leoviz_"
+
+pop_checked = metrics.gauge("home_pop_last_check_timestamp_seconds", "Time of the last home PoP lookup")
+_home_pop_labels = None
+home_pop_detector = HomePopDetector()
+
+# Jobs run by --run-once
+ONCE_JOBS = ("latency", "grpc_status", "tle")
+
+
+def set_home_pop(pop):
+    """Expose the detected home PoP as the home_pop_info metric."""
+    global _home_pop_labels
+    labels = {"pop": pop}
+    if labels != _home_pop_labels:
+        if _home_pop_labels is not None:
+            metrics.remove("home_pop_info", _home_pop_labels)
+        metrics.gauge("home_pop_info", "Starlink PoP serving the dish, from its reverse DNS name", labels).set(1)
+        _home_pop_labels = labels
+
+
+async def check_home_pop():
+    """Detect the current PoP, if the network changed, and write it to LATEST_POP_FILE."""
+    reason = await home_pop_detector.check()
+    if reason is None:
+        return
+    metrics.counter("home_pop_lookups_total", "Home PoP lookups, by what triggered them", {"reason": reason}).inc()
+    pop_checked.set(time.time())
+    current_pop = home_pop_detector.pop
+    if not current_pop:
+        logger.warning("Could not determine current POP.")
+        return
+    logger.info(f"Current POP detected: {current_pop}")
+    set_home_pop(current_pop)
+    try:
+        LATEST_POP_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(LATEST_POP_FILE, 'w') as f:
+            f.write(current_pop)
+        logger.info(f"Updated POP file: {LATEST_POP_FILE}")
+    except Exception as e:
+        logger.error(f"Failed to write POP file {LATEST_POP_FILE}: {e}")
 
 
-def run_continuously():
-    """Runs the obstruction map collection and satellite/POP estimation continuously."""
-    logger.info("Starting continuous collection...")
-    last_pop_check_time = 0
-    pop_check_interval = 60 # Check POP every 60 seconds
+# dish pulls in pandas, skyfield and grpc, so it is imported by the jobs that
+# need it, on a worker thread, rather than before the metrics endpoint is up
 
-    while True:
-        try:
-            current_time = time.time()
-
-            # --- Check and update POP periodically ---
-            if current_time - last_pop_check_time > pop_check_interval:
-                logger.info("Checking current POP...")
-                try:
-                    current_pop = get_home_pop()
-                    if current_pop:
-                        logger.info(f"Current POP detected: {current_pop}")
-                        try:
-                            # Ensure the data directory exists
-                            LATEST_POP_FILE.parent.mkdir(parents=True, exist_ok=True)
-                            with open(LATEST_POP_FILE, 'w') as f:
-                                f.write(current_pop)
-                            logger.info(f"Updated POP file: {LATEST_POP_FILE}")
-                        except Exception as e:
-                            logger.error(f"Failed to write POP file {LATEST_POP_FILE}: {e}")
-                    else:
-                        logger.warning("Could not determine current POP.")
-                    last_pop_check_time = current_time # Update last check time regardless of success
-                except Exception as e:
-                     logger.error(f"Error during get_home_pop: {e}")
-                     last_pop_check_time = current_time # Still update time to avoid spamming errors
-            # --- End POP Check ---
-
-            # --- Run Obstruction Map / Satellite Estimation ---
-            logger.info("Starting Obstruction Map collection cycle...")
-            get_obstruction_map() # This function now handles its own timing/loops internally
-            logger.info("Finished Obstruction Map collection cycle.")
-            # --- End Obstruction Map Cycle ---
 
-        except KeyboardInterrupt:
-            logger.info("KeyboardInterrupt received, stopping continuous run.")
-            sys.exit(0)
-        except Exception as e:
-            logger.error(f"Error in main continuous loop: {e}. Restarting loop after delay...")
-            time.sleep(10) # Wait before retrying after an error
+def grpc_get_status():
+    from dish import grpc_get_status
+
+    grpc_get_status()
+
+
+def get_obstruction_map():
+    from dish import get_obstruction_map, replay_finished
+
+    try:
+        get_obstruction_map()
+    finally:
+        if replay_finished():
+            # Another cycle would only fail on the exhausted log
+            raise JobDone("Replay finished")
+
+
+def create_scheduler(continuous=True):
+    """Create the scheduler with all collection jobs.
+
+    The latency, status and TLE jobs run on the hour. In continuous mode the
+    PoP check and the obstruction map cycles, which need the observer
+    location, are added as well.
+    """
+    scheduler = Scheduler()
+    scheduler.add("latency", icmp_ping, LATENCY_JOB_INTERVAL, jitter=JOB_JITTER, align=True, run_at_start=False)
+    scheduler.add("grpc_status", grpc_get_status, STATUS_JOB_INTERVAL, jitter=JOB_JITTER, align=True, run_at_start=False)
+    # Loaded once before the scheduler starts, since estimation needs it
+    scheduler.add("tle", load_tle, TLE_JOB_INTERVAL, jitter=JOB_JITTER, align=True, run_at_start=False)
+    if continuous:
+        scheduler.add("pop", check_home_pop, POP_JOB_INTERVAL)
+        # Handles its own slot timing, and is restarted as soon as a cycle finishes
+        scheduler.add("obstruction_map", get_obstruction_map, 0)
+    return scheduler
 
 
 def write_observer_location(lat, lon, alt):
@@ -102,6 +135,8 @@ if __name__ == "__main__":
     parser.add_argument("--lat", type=float, required=False, help="Dish latitude")
     parser.add_argument("--lon", type=float, required=False, help="Dish longitude")
     parser.add_argument("--alt", type=float, required=False, help="Dish altitude (in meters)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Port for the Prometheus metrics endpoint, 0 to disable")
+    parser.add_argument("--profiling", action="store_true", default=PROFILING, help="Allow starting profiling sessions with SIGUSR1/SIGUSR2 or the control socket (see profiler.py)")
     args = parser.parse_args()
 
     print_config()
@@ -130,7 +165,16 @@ if __name__ == "__main__":
 
     if args.run_once:
         logger.info("Running scheduled tasks once and exiting.")
-        schedule.run_all()
+        asyncio.run(create_scheduler(continuous=False).run_once(ONCE_JOBS))
     else:
+        if args.metrics_port:
+            metrics.start_http_server(args.metrics_port, METRICS_ADDRESS, prefix=METRICS_PREFIX)
+        if args.profiling:
+            profiler.enable()
         load_tle()
-        run_continuously()
+        logger.info("Starting continuous collection...")
+        try:
+            asyncio.run(create_scheduler().run())
+        except KeyboardInterrupt:
+            logger.info("KeyboardInterrupt received, stopping continuous run.")
+            sys.exit(0)
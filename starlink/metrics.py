@@ -0,0 +1,228 @@
+# flake8: noqa: E501
+"""In-process metrics for the collector.
+
+Metrics are created on first use through `counter`, `gauge` and `histogram`,
+which return the same object for the same name and labels, and are safe to
+update from any thread.
+
+`render` formats all metrics in the Prometheus text exposition format, and
+`start_http_server` serves that on /metrics. Rendering only reads values held
+in memory, so a scrape never waits on the dish or the network.
+"""
+
+import math
+import bisect
+import logging
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+_lock = threading.Lock()
+REGISTRY = {}
+_collectors = []
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.value = float("nan")
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value = (0.0 if math.isnan(self.value) else self.value) + amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Compute the value with `function` when read. It must not block."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Return (cumulative bucket counts, sum, count), consistent with each other."""
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+def _get(cls, name, documentation, labels, **kwargs):
+    key = (name, tuple(sorted((labels or {}).items())))
+    with _lock:
+        metric = REGISTRY.get(key)
+        if metric is None:
+            metric = cls(name, documentation, dict(key[1]), **kwargs)
+            REGISTRY[key] = metric
+    return metric
+
+
+def remove(name, labels=None):
+    """Drop a metric, e.g. an info gauge whose label value changed."""
+    with _lock:
+        REGISTRY.pop((name, tuple(sorted((labels or {}).items()))), None)
+
+
+def register_collector(function):
+    """Add metrics that are only computed when rendered.
+
+    `function` is called on every render and returns an iterable of
+    (name, type, documentation, samples) tuples, where samples are
+    (sample name, labels, value) tuples. It must not block.
+    """
+    with _lock:
+        _collectors.append(function)
+
+
+def counter(name, documentation, labels=None) -> Counter:
+    return _get(Counter, name, documentation, labels)
+
+
+def gauge(name, documentation, labels=None) -> Gauge:
+    return _get(Gauge, name, documentation, labels)
+
+
+def histogram(name, documentation, labels=None, buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _get(Histogram, name, documentation, labels, buckets=buckets)
+
+
+def format_value(value):
+    """Format a sample value, or a histogram bucket bound, for the text format."""
+    if value is None:
+        return "NaN"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _samples(metric):
+    if isinstance(metric, Counter):
+        yield metric.name, metric.labels, metric.value
+    elif isinstance(metric, Gauge):
+        yield metric.name, metric.labels, metric.get()
+    else:
+        cumulative, total, count = metric.snapshot()
+        for bound, value in zip(metric.buckets + (math.inf,), cumulative):
+            yield f"{metric.name}_bucket", {**metric.labels, "le": format_value(bound)}, value
+        yield f"{metric.name}_sum", metric.labels, total
+        yield f"{metric.name}_count", metric.labels, count
+
+
+_TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+
+def render(prefix=""):
+    """Return all metrics in the Prometheus text exposition format."""
+    with _lock:
+        metrics = sorted(REGISTRY.items())
+        collectors = list(_collectors)
+
+    families = {}
+    for (name, _), metric in metrics:
+        family = families.setdefault(name, [_TYPES[type(metric)], metric.documentation, []])
+        family[2].extend(_samples(metric))
+    for collector in collectors:
+        try:
+            for name, kind, documentation, samples in collector():
+                families.setdefault(name, [kind, documentation, []])[2].extend(samples)
+        except Exception as e:
+            logger.error(f"Metrics collector {collector} failed: {e}")
+
+    lines = []
+    for name, (kind, documentation, samples) in families.items():
+        lines.append(f"# HELP {prefix}{name} {_escape(documentation)}")
+        lines.append(f"# TYPE {prefix}{name} {kind}")
+        for sample, labels, value in samples:
+            lines.append(f"{prefix}{sample}{_format_labels(labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    prefix = ""
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        body = render(self.prefix).encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def start_http_server(port, address="", prefix=""):
+    """Serve /metrics from a daemon thread. Returns the server."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"prefix": prefix})
+    server = ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Serving metrics on http://{address or '0.0.0.0'}:{server.server_port}/metrics")
+    return server
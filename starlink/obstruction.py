@@ -3,36 +3,70 @@ import logging
 from datetime import datetime, timezone
 
 from config import DATA_DIR
+from kernels import last_changed_pixels
+from slots import group_by_slot
 
-import pandas as pd
 import numpy as np
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 
 
-def process_obstruction_timeslot(timeslot_df, writer):
-    previous_obstruction_map = timeslot_df.iloc[0]["obstruction_map"]
-    previous_obstruction_map = previous_obstruction_map.reshape(123, 123)
+def white_pixel_coords(timeslot_df):
+    """Return (timestamp, (row, col)) of the newest pixel for each frame.
+
+    Frames where no pixel changed repeat the last known coordinate, and
+    frames before the first change are skipped.
+    """
+    frames = np.stack(timeslot_df["obstruction_map"].to_numpy())
+    last_pixels = last_changed_pixels(frames)
 
     hold_coord = None
-    white_pixel_coords = []
-    for index, row in timeslot_df.iterrows():
-        timestamp_dt = datetime.fromtimestamp(row["timestamp"], tz=timezone.utc)
-        obstruction_map = row["obstruction_map"].reshape(123, 123)
-        xor_map = np.bitwise_xor(previous_obstruction_map, obstruction_map)
-        coords = np.argwhere(xor_map == 1)
-
-        if coords.size > 0:
-            coord = coords[-1]  # Get the last occurrence
-            hold_coord = coord  # Update hold_coord
-        elif hold_coord is not None:
-            coord = hold_coord  # Use the previous hold_coord if coords is empty
-        else:
-            continue  # If both coords is empty and hold_coord is None, skip this iteration
-
-        white_pixel_coords.append((timestamp_dt, tuple(coord)))
-        previous_obstruction_map = obstruction_map
+    coords = []
+    for timestamp, pixel in zip(timeslot_df["timestamp"], last_pixels):
+        if pixel >= 0:
+            hold_coord = divmod(int(pixel), 123)
+        elif hold_coord is None:
+            continue
+        coords.append((datetime.fromtimestamp(timestamp, tz=timezone.utc), hold_coord))
+    return coords
+
+
+def drop_held_frames(timeslot_df, changed):
+    """Prepare a timeslot for storage, without the maps of unchanged frames.
+
+    Frames identical to their predecessor carry no new pixel. They keep
+    their row and timestamp, with changed=False and no map, so that
+    `expand_held_frames` can restore every polled frame.
+    """
+    return timeslot_df.assign(
+        obstruction_map=[frame if new else None for frame, new in zip(timeslot_df["obstruction_map"], changed)],
+        changed=changed,
+    )
+
+
+def expand_held_frames(df_obstruction_map):
+    """Fill in the frames dropped by `drop_held_frames` with their predecessor.
+
+    The pixel scan then sees every polled frame, as it did live, and
+    repeats the held coordinate for the unchanged ones. Files without a
+    changed column are returned as they are.
+    """
+    if "changed" not in df_obstruction_map.columns:
+        return df_obstruction_map
+    frames = df_obstruction_map["obstruction_map"].tolist()
+    for i in range(1, len(frames)):
+        if frames[i] is None:
+            frames[i] = frames[i - 1]
+    return df_obstruction_map.assign(obstruction_map=frames)
+
 
+def read_obstruction_map_parquet(path):
+    """Read an obstruction map file, with the unchanged frames filled in."""
+    return expand_held_frames(pd.read_parquet(path))
+
+
+def write_white_pixel_coords(writer, white_pixel_coords):
     for coord in white_pixel_coords:
         writer.writerow(
             [
@@ -43,85 +77,16 @@ def process_obstruction_timeslot(timeslot_df, writer):
         )
 
 
-def process_obstruction_maps(df_obstruction_map, uuid):
-    start_time_dt = datetime.fromtimestamp(
-        df_obstruction_map.iloc[0]["timestamp"], tz=timezone.utc
-    )
-    end_time_dt = datetime.fromtimestamp(
-        df_obstruction_map.iloc[-1]["timestamp"], tz=timezone.utc
-    )
+def process_obstruction_timeslot(timeslot_df, writer):
+    write_white_pixel_coords(writer, white_pixel_coords(timeslot_df))
+
 
+def process_obstruction_maps(df_obstruction_map, uuid, directory=DATA_DIR):
     with open(
-        f"{DATA_DIR}/obstruction-data-{uuid}.csv",
+        f"{directory}/obstruction-data-{uuid}.csv",
         "w",
         newline="",
     ) as csvfile:
         writer = csv.writer(csvfile)
-        while start_time_dt < end_time_dt:
-            if start_time_dt.second >= 12 and start_time_dt.second < 27:
-                timeslot_endtime_dt = start_time_dt.replace(microsecond=0).replace(
-                    second=27
-                )
-            elif start_time_dt.second >= 27 and start_time_dt.second < 42:
-                timeslot_endtime_dt = start_time_dt.replace(microsecond=0).replace(
-                    second=42
-                )
-            elif start_time_dt.second >= 42 and start_time_dt.second < 57:
-                timeslot_endtime_dt = start_time_dt.replace(microsecond=0).replace(
-                    second=57
-                )
-            elif start_time_dt.second >= 57 and start_time_dt.second < 60:
-                timeslot_endtime_dt = start_time_dt.replace(microsecond=0).replace(
-                    second=12
-                ) + pd.Timedelta(minutes=1)
-            elif start_time_dt.second >= 0 and start_time_dt.second < 12:
-                timeslot_endtime_dt = start_time_dt.replace(microsecond=0).replace(
-                    second=12
-                )
-            else:
-                pass
-
-            print(start_time_dt)
-            print(end_time_dt)
-
-            timeslot_df = df_obstruction_map[
-                (df_obstruction_map["timestamp"] >= start_time_dt.timestamp())
-                & (df_obstruction_map["timestamp"] < timeslot_endtime_dt.timestamp())
-            ]
-
-            if len(timeslot_df) == 0:
-                start_time_dt += pd.Timedelta(seconds=15)
-                continue
-
-            previous_obstruction_map = timeslot_df.iloc[0]["obstruction_map"]
-            previous_obstruction_map = previous_obstruction_map.reshape(123, 123)
-
-            hold_coord = None
-            white_pixel_coords = []
-            for index, row in timeslot_df.iterrows():
-                timestamp_dt = datetime.fromtimestamp(row["timestamp"], tz=timezone.utc)
-                obstruction_map = row["obstruction_map"].reshape(123, 123)
-                xor_map = np.bitwise_xor(previous_obstruction_map, obstruction_map)
-                coords = np.argwhere(xor_map == 1)
-
-                if coords.size > 0:
-                    coord = coords[-1]  # Get the last occurrence
-                    hold_coord = coord  # Update hold_coord
-                elif hold_coord is not None:
-                    coord = hold_coord  # Use the previous hold_coord if coords is empty
-                else:
-                    continue  # If both coords is empty and hold_coord is None, skip this iteration
-
-                white_pixel_coords.append((timestamp_dt, tuple(coord)))
-                previous_obstruction_map = obstruction_map
-
-            for coord in white_pixel_coords:
-                writer.writerow(
-                    [
-                        coord[0].strftime("%Y-%m-%d %H:%M:%S"),
-                        coord[1][0],
-                        coord[1][1],
-                    ]
-                )
-
-            start_time_dt += pd.Timedelta(seconds=15)
+        for _, timeslot_df in group_by_slot(df_obstruction_map):
+            process_obstruction_timeslot(timeslot_df, writer)
@@ -8,19 +8,11 @@ from datetime import datetime
 from multiprocessing import Pool
 
 import pandas as pd
-import cartopy
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-
-from matplotlib import pyplot as plt
-from matplotlib import dates as mdates
-from matplotlib import gridspec
 from skyfield.api import load
 
-cartopy.config["data_dir"] = os.getenv("CARTOPY_DIR", cartopy.config.get("data_dir"))
-
 from util import load_ping, load_tle_from_file, load_connected_satellites
 from pop import get_pop_data, get_home_pop
+from obstruction import read_obstruction_map_parquet
 from pprint import pprint
 
 POP_DATA = None
@@ -34,7 +26,33 @@ resolution = "10m"
 
 ts = load.timescale(builtin=True)
 projStereographic = None
-projPlateCarree = ccrs.PlateCarree()
+projPlateCarree = None
+
+# cartopy and matplotlib, set by init_plotting
+plt = mdates = gridspec = ccrs = cfeature = None
+
+
+def init_plotting():
+    """Import cartopy and matplotlib and set up the map projections.
+
+    Deferred until plotting starts, as they take seconds to import and the
+    data helpers in this module do not need them. Must run before the worker
+    processes are forked.
+    """
+    global plt, mdates, gridspec, ccrs, cfeature, projPlateCarree, projStereographic
+    import cartopy
+    import cartopy.crs
+    import cartopy.feature
+    from matplotlib import pyplot, dates, gridspec as matplotlib_gridspec
+
+    cartopy.config["data_dir"] = os.getenv("CARTOPY_DIR", cartopy.config.get("data_dir"))
+    plt, mdates, gridspec = pyplot, dates, matplotlib_gridspec
+    ccrs, cfeature = cartopy.crs, cartopy.feature
+    projPlateCarree = ccrs.PlateCarree()
+    if centralLat is not None and centralLon is not None:
+        projStereographic = ccrs.Stereographic(
+            central_longitude=centralLon, central_latitude=centralLat
+        )
 
 
 def get_obstruction_map_by_timestamp(df_obstruction_map, timestamp):
@@ -358,7 +376,6 @@ def cumulative_obstruction_map(df_obstruction_map: pd.DataFrame):
 
 
 def plot():
-    global projStereographic
     global centralLat
     global centralLon
     global POP_DATA
@@ -374,7 +391,7 @@ def plot():
             print(f"File {file} does not exist.")
             continue
 
-    df_obstruction_map = pd.read_parquet(OBSTRUCTION_MAP_DATA)
+    df_obstruction_map = read_obstruction_map_parquet(OBSTRUCTION_MAP_DATA)
     df_sinr = pd.read_csv(SINR_DATA)
     df_rtt = load_ping(LATENCY_DATA)
     all_satellites = load_tle_from_file(TLE_DATA)
@@ -393,6 +410,7 @@ def plot():
         df_cumulative_obstruction_map = cumulative_obstruction_map(df_obstruction_map)
 
     HOME_POP = get_home_pop()
+    init_plotting()
 
     CPU_COUNT = os.cpu_count() - 1 if os.cpu_count() > 1 else 1
     print(f"Process count: {CPU_COUNT}")
@@ -497,9 +515,6 @@ if __name__ == "__main__":
     if args.lat and args.lon:
         centralLat = args.lat
         centralLon = args.lon
-        projStereographic = ccrs.Stereographic(
-            central_longitude=centralLon, central_latitude=centralLat
-        )
 
     DATA_DIR = args.dir
     DATE_TIME = args.id
@@ -509,7 +524,9 @@ if __name__ == "__main__":
         f"grpc/{DATE}/obstruction_map-{DATE_TIME}.parquet"
     )
     SINR_DATA = Path(DATA_DIR).joinpath(f"grpc/{DATE}/GRPC_STATUS-{DATE_TIME}.csv")
-    LATENCY_DATA = Path(DATA_DIR).joinpath(f"latency/{DATE}/ping-10ms-{DATE_TIME}.txt")
+    LATENCY_DATA = Path(DATA_DIR).joinpath(f"latency/{DATE}/ping-10ms-{DATE_TIME}.bin")
+    if not LATENCY_DATA.exists():
+        LATENCY_DATA = LATENCY_DATA.with_suffix(".txt")
     TLE_DATA = Path(DATA_DIR).joinpath(f"TLE/{DATE}/starlink-tle-{DATE_TIME}.txt")
 
     FIGURE_DIR = Path(f"{DATA_DIR}/figures-{DATE_TIME}")
@@ -0,0 +1,128 @@
+# flake8: noqa: E501
+"""Adaptive obstruction map polling within a timeslot.
+
+Polls run on a fixed schedule of monotonic deadlines, so the time spent in
+the RPC itself does not stretch the interval. The interval depends on what
+the dish is doing:
+
+* burst: right after the map reset, and for a while after any new pixel
+  appears, when the trajectory is being drawn.
+* base: the regular rate, in between.
+* idle: once several frames in a row did not change, or when the dish is not
+  CONNECTED, since no trajectory is being drawn.
+
+Every frame becomes a row of the obstruction data CSV, so rows are denser
+during bursts. satellites.sample_points picks the matcher's middle point by
+time rather than by position for that reason.
+"""
+
+import time
+import logging
+
+import numpy as np
+
+import metrics
+from config import (
+    OBSTRUCTION_POLL_INTERVAL,
+    OBSTRUCTION_BURST_INTERVAL,
+    OBSTRUCTION_IDLE_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# How long to keep bursting after the reset and after the last new pixel
+BURST_SECONDS = 2.0
+# Unchanged frames in a row before dropping to the idle interval
+IDLE_AFTER_UNCHANGED = 4
+
+
+class ObstructionPoller:
+    """Collects obstruction map frames for one timeslot at a time.
+
+    Args:
+        fetch_frame: Callable returning the current map as a flat int array.
+        is_connected: Callable returning False when the dish is not
+            CONNECTED. Called once per timeslot, after the first poll.
+        clock: Provides time(), monotonic() and sleep(), by default the time
+            module. A replay passes its starlink_grpc.ReplayClock, so frames
+            are stamped with the time they were recorded at.
+    """
+
+    def __init__(self, fetch_frame, is_connected=lambda: True, clock=time):
+        self.fetch_frame = fetch_frame
+        self.is_connected = is_connected
+        self.clock = clock
+        self.polls = metrics.counter("obstruction_polls_total", "Obstruction map polls")
+        self.duplicates = metrics.counter(
+            "obstruction_duplicate_frames_total", "Obstruction map frames identical to the previous one"
+        )
+
+    def _interval(self, connected, now, slot_start, last_change, unchanged):
+        if not connected:
+            return OBSTRUCTION_IDLE_INTERVAL
+        if now - slot_start < BURST_SECONDS or now - last_change < BURST_SECONDS:
+            return OBSTRUCTION_BURST_INTERVAL
+        if unchanged >= IDLE_AFTER_UNCHANGED:
+            return OBSTRUCTION_IDLE_INTERVAL
+        return OBSTRUCTION_POLL_INTERVAL
+
+    def poll_timeslot(self, duration):
+        """Poll for `duration` seconds, starting now.
+
+        Returns:
+            A tuple of (timestamps, frames, changed), where changed[i] is
+            False when frames[i] is identical to frames[i - 1]. The first
+            frame is always marked changed.
+        """
+        connected = None
+        timestamps = []
+        frames = []
+        changed = []
+
+        slot_start = self.clock.monotonic()
+        # Time of the next poll, in seconds from slot_start, so that rounding
+        # does not depend on the magnitude of the clock's readings
+        scheduled = 0.0
+        last_change = slot_start
+        unchanged = 0
+        previous = None
+
+        while True:
+            frame = self.fetch_frame()
+            timestamp = self.clock.time()
+            now = self.clock.monotonic()
+            self.polls.inc()
+
+            if connected is None:
+                # Checked after the first poll so it does not delay it
+                connected = self.is_connected()
+                if not connected:
+                    logger.info("Dish is not CONNECTED, polling at the idle interval")
+
+            is_new = previous is None or not np.array_equal(frame, previous)
+            if is_new:
+                last_change = now
+                unchanged = 0
+            else:
+                unchanged += 1
+                self.duplicates.inc()
+
+            timestamps.append(timestamp)
+            frames.append(frame)
+            changed.append(is_new)
+            previous = frame
+
+            scheduled += self._interval(connected, now, slot_start, last_change, unchanged)
+            if scheduled < now - slot_start:
+                # Fell behind, e.g. a slow RPC. Restart the schedule from now
+                # rather than firing the missed polls back to back.
+                scheduled = now - slot_start
+            # The tolerance keeps rounding of the summed intervals from adding
+            # a poll, so a replay polls as often as the recording did
+            if scheduled >= duration - 1e-6:
+                break
+            remaining = slot_start + scheduled - self.clock.monotonic()
+            if remaining > 0:
+                self.clock.sleep(remaining)
+
+        return timestamps, frames, changed
@@ -1,45 +1,87 @@
 # flake8: noqa: E501
 
 import re
-import httpx
-import subprocess
+import json
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+
+import assets
+from config import POP_CACHE_TTL, POP_REFRESH_INTERVAL, POP_RETRY_INTERVAL, POP_LOOKUP_TIMEOUT, PUBLIC_IP_URL
+from geo import GeoIndex, CachedCatalog
+
+logger = logging.getLogger(__name__)
 
 POP_JSON = "https://raw.githubusercontent.com/clarkzjw/starlink-geoip-data/refs/heads/master/map/pop.json"
 
 
+class PopIndex(GeoIndex):
+    """PoPs of one version of pop.json, as typed arrays indexed by location.
+
+    Query results are arrays of indices into `codes`, `lats`, `lons`,
+    `cities` and `countries`.
+    """
+
+    def __init__(self, data, digest=None):
+        import numpy as np
+
+        pops = [
+            pop for pop in data
+            if pop.get("show") is True and pop.get("code") and pop.get("type") == "netfac" and pop.get("lat") and pop.get("lon")
+        ]
+        super().__init__([pop["lat"] for pop in pops], [pop["lon"] for pop in pops])
+        self.digest = digest
+        self.codes = np.array([pop["code"] for pop in pops], dtype=str)
+        self.cities = np.array([pop.get("city") or "" for pop in pops], dtype=str)
+        self.countries = np.array([pop.get("country") or "" for pop in pops], dtype=str)
+        self.by_code = {code: i for i, code in enumerate(self.codes.tolist())}
+
+    def location(self, code):
+        """(lat, lon) of a PoP, or None if it is not in the catalog."""
+        i = self.by_code.get(code)
+        if i is None:
+            return None
+        return float(self.lats[i]), float(self.lons[i])
+
+
+class PopCatalog(CachedCatalog):
+    """Starlink PoPs from pop.json, with bounding box, radius and nearest queries."""
+
+    name = "pop.json"
+
+    def __init__(self, url=POP_JSON, ttl=POP_CACHE_TTL):
+        super().__init__(url, ttl)
+
+    def build(self, content, digest):
+        return PopIndex(json.loads(content), digest)
+
+    def location(self, code):
+        return self.snapshot().location(code)
+
+
+_catalog = None
+
+
+def pop_catalog():
+    """The shared PopCatalog."""
+    global _catalog
+    if _catalog is None:
+        _catalog = PopCatalog()
+    return _catalog
+
+
 def get_pop_data(centralLat, centralLon, offsetLat, offsetLon):
     try:
-        response = httpx.get(POP_JSON)
-        response.raise_for_status()
-        data = response.json()
-        lats = []
-        lons = []
-        names = []
-        for pop in data:
-            if (
-                pop.get("show") == True
-                and pop.get("code") != ""
-                and pop.get("type") == "netfac"
-            ):
-                if (
-                    float(pop.get("lat")) < centralLat - offsetLat
-                    or float(pop.get("lat")) > centralLat + offsetLat
-                ):
-                    continue
-                if (
-                    float(pop.get("lon")) < centralLon - offsetLon
-                    or float(pop.get("lon")) > centralLon + offsetLon
-                ):
-                    continue
-                lats.append(pop.get("lat"))
-                lons.append(pop.get("lon"))
-                names.append(pop.get("code"))
+        index = pop_catalog().snapshot()
+        indices = index.within_bbox(centralLat - offsetLat, centralLat + offsetLat, centralLon - offsetLon, centralLon + offsetLon)
         return {
-            "lats": lats,
-            "lons": lons,
-            "names": names,
+            "lats": index.lats[indices].tolist(),
+            "lons": index.lons[indices].tolist(),
+            "names": index.codes[indices].tolist(),
         }
-    except httpx.RequestError as e:
+    except assets.AssetUnavailable as e:
         print(f"An error occurred while fetching POP data: {e}")
         return None
     except ValueError as e:
@@ -47,38 +89,157 @@ def get_pop_data(centralLat, centralLon, offsetLat, offsetLon):
         return None
 
 
-def get_home_pop():
-    regex = r"^customer\.(.+)\.pop\.starlinkisp\.net\.$"
+# Reverse DNS name of Starlink customer addresses
+HOME_POP_REGEX = re.compile(r"^customer\.(.+)\.pop\.starlinkisp\.net\.?$")
+# Addresses the local source address of each family is determined against.
+# Only a route lookup happens, nothing is sent.
+_ROUTE_PROBES = {4: (socket.AF_INET, ("8.8.8.8", 53)), 6: (socket.AF_INET6, ("2001:4860:4860::8888", 53))}
+
+
+def _source_address(version):
+    family, address = _ROUTE_PROBES[version]
+    try:
+        with socket.socket(family, socket.SOCK_DGRAM) as s:
+            s.connect(address)
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+
+def _default_routes(path, default, fields):
+    """(interface, next hop, metric) of the default routes in a /proc/net route table."""
+    try:
+        with open(path) as f:
+            rows = [line.split() for line in f]
+    except OSError:
+        return ()
+    return tuple(sorted(tuple(row[i] for i in fields) for row in rows if len(row) > max(fields) and default(row)))
+
+
+def network_state():
+    """Local source addresses and default routes of both address families.
+
+    Cheap to compute, and changes when the dish or router reconnects, which
+    is when the public addresses, and with them the PoP, can change.
+    """
+    return (
+        _source_address(4),
+        _source_address(6),
+        _default_routes("/proc/net/route", lambda row: row[1] == "00000000", (0, 2, 6)),
+        _default_routes("/proc/net/ipv6_route", lambda row: row[0] == "0" * 32 and row[1] == "00", (9, 4, 5)),
+    )
+
+
+class HomePopDetector:
+    """Finds the home PoP from the reverse DNS names of the public addresses.
+
+    The IPv4 and IPv6 public addresses are looked up concurrently, each with
+    a timeout, and their PTR records are resolved in process and cached by
+    address. `check` only does that when `network_state` changed since the
+    last successful lookup, or that lookup is older than `refresh_interval`.
+    Lookups that find no PoP are retried after `retry_interval`, doubling
+    with each consecutive failure up to `refresh_interval`.
+    """
+
+    def __init__(self, timeout=POP_LOOKUP_TIMEOUT, refresh_interval=POP_REFRESH_INTERVAL, url=PUBLIC_IP_URL, retry_interval=POP_RETRY_INTERVAL):
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.url = url
+        self.pop = ""
+        self.addresses = {}
+        self._ptr_cache = {}
+        # Network state and time of the last successful lookup
+        self._state = None
+        self._last_lookup = None
+        # Network state of the last failed lookup, and when to retry it
+        self._failed_state = None
+        self._failures = 0
+        self._retry_at = None
 
-    def _get_home_pop(ipversion: int = 4):
-        cmd = ["curl", "-4" if ipversion == 4 else "-6", "ipconfig.io", "-s"]
+    async def public_address(self, version):
+        import httpx
+
+        transport = httpx.AsyncHTTPTransport(local_address="0.0.0.0" if version == 4 else "::")
+        async with httpx.AsyncClient(transport=transport, timeout=self.timeout) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+            return str(ipaddress.ip_address(response.text.strip()))
+
+    async def resolve_pop(self, address):
+        """PoP code from the PTR record of an address, cached by address."""
+        if address not in self._ptr_cache:
+            loop = asyncio.get_running_loop()
+            hostname, _ = await asyncio.wait_for(loop.getnameinfo((address, 0), socket.NI_NAMEREQD), self.timeout)
+            match = HOME_POP_REGEX.match(hostname)
+            if not match:
+                logger.warning(f"{hostname} does not match customer.<pop>.pop.starlinkisp.net. format")
+            self._ptr_cache[address] = match.group(1) if match else ""
+        return self._ptr_cache[address]
+
+    async def _lookup(self, version):
         try:
-            ip = subprocess.check_output(cmd).decode().strip()
-            cmd = ["dig", "-x", ip, "+short"]
-            try:
-                hostname = subprocess.check_output(cmd).decode().strip()
-
-                match = re.match(regex, hostname)
-                if match:
-                    return match.group(1)
-                else:
-                    print(
-                        f"{hostname} does not match customer.<pop>.pop.starlinkisp.net. format"
-                    )
-                    return ""
-            except subprocess.CalledProcessError as e:
-                print(f"An error occurred while dig DNS PTR record for {ip}: {e}")
-                return ""
-        except subprocess.CalledProcessError as e:
-            print(f"An error occurred while fetching IP address: {e}")
-            return ""
-
-    pop4 = _get_home_pop(4)
-    pop6 = _get_home_pop(6)
-    if pop4 == pop6:
-        return pop4
-    else:
-        print(
-            f"IPv4 and IPv6 PoPs do not match: {pop4} (IPv4) vs {pop6} (IPv6). Likely Starlink DNS configuration error."
-        )
-        return pop4
+            address = await self.public_address(version)
+        except Exception as e:
+            logger.warning(f"Could not get the public IPv{version} address: {e!r}")
+            return None, ""
+        try:
+            return address, await self.resolve_pop(address)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Could not resolve the PTR record of {address}: {e!r}")
+            return address, ""
+
+    async def detect(self):
+        """Look up both public addresses and return the home PoP, or "" if unknown."""
+        (address4, pop4), (address6, pop6) = await asyncio.gather(self._lookup(4), self._lookup(6))
+        self.addresses = {4: address4, 6: address6}
+        if pop4 and pop6 and pop4 != pop6:
+            logger.warning(f"IPv4 and IPv6 PoPs do not match: {pop4} (IPv4) vs {pop6} (IPv6). Likely Starlink DNS configuration error.")
+        self.pop = pop4 or pop6
+        return self.pop
+
+    async def check(self):
+        """Detect the home PoP if the network changed or the last lookup is too old.
+
+        Returns the reason of the lookup, "network_change", "refresh" or
+        "retry" after a failed lookup on an unchanged network, or None if
+        nothing was looked up. When a refresh finds no PoP, the previous one
+        is kept until it succeeds.
+        """
+        state = network_state()
+        now = time.monotonic()
+        if self._retry_at is not None and state == self._failed_state:
+            if now < self._retry_at:
+                return None
+            reason = "retry"
+        elif self._last_lookup is None or state != self._state:
+            reason = "network_change"
+        elif now - self._last_lookup >= self.refresh_interval:
+            reason = "refresh"
+        else:
+            return None
+
+        previous = self.pop
+        if await self.detect():
+            self._state = state
+            self._last_lookup = now
+            self._failed_state = None
+            self._failures = 0
+            self._retry_at = None
+        else:
+            if state == self._state:
+                # Same network as the last successful lookup, its PoP still holds
+                self.pop = previous
+            if state != self._failed_state:
+                self._failed_state = state
+                self._failures = 0
+            self._failures += 1
+            delay = min(self.retry_interval * 2 ** (self._failures - 1), self.refresh_interval)
+            self._retry_at = now + delay
+            logger.info(f"No home PoP found, retrying in {delay:.0f}s")
+        return reason
+
+
+def get_home_pop():
+    """Detect the home PoP once. Must not be called from a running event loop."""
+    return asyncio.run(HomePopDetector().detect())
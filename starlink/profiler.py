@@ -0,0 +1,298 @@
+# flake8: noqa: E501
+"""On-demand profiling of the running collector.
+
+Nothing here runs unless profiling is enabled with `enable`, which installs
+signal handlers and a local control socket. A session then runs for a fixed
+time in the background and writes its result to PROFILE_DIR:
+
+* sample: every thread's stack is sampled at a fixed interval and written as
+  a collapsed-stack file, one line per distinct stack prefixed with the
+  thread name, which flamegraph.pl, speedscope or inferno read directly.
+  Started with SIGUSR1.
+* cprofile: units of work wrapped in `profiled`, i.e. obstruction loop
+  iterations and estimation jobs, run under cProfile, and the combined
+  stats are written as a pstats file. Started with SIGUSR2. Up to Python
+  3.11 each unit gets its own profiler, in its own thread. From 3.12,
+  cProfile is built on sys.monitoring, which allows one active profiler per
+  process, seeing every thread: units running at the same time share one,
+  so work of other threads in that time is included too. If another
+  profiler or debugger is active, units run unprofiled.
+
+The control socket takes one command per connection, e.g.
+`sample 60 0.005` or `cprofile 30`, and replies with the output file name.
+`stop` ends the running session early and writes what it has collected.
+`python profiler.py sample 60` sends a command from the shell.
+
+When no session is running, the only cost is `profiled` checking a global.
+"""
+
+import os
+import sys
+import time
+import pstats
+import signal
+import socket
+import logging
+import argparse
+import cProfile
+import threading
+import contextlib
+from pathlib import Path
+from collections import Counter
+from datetime import datetime, timezone
+
+from config import PROFILE_DIR, PROFILE_SOCKET, PROFILE_DURATION, PROFILE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+MODES = ("sample", "cprofile")
+MAX_DURATION = 600
+
+_lock = threading.Lock()
+_session = None
+
+# From Python 3.12 only one cProfile.Profile can be enabled at a time, and it
+# profiles every thread. It is shared by the units of work running at once.
+SHARED_PROFILER = sys.version_info >= (3, 12)
+_profiler_lock = threading.Lock()
+_shared_profile = None
+_shared_users = 0
+
+
+def _frame_name(code):
+    # co_qualname is new in Python 3.11
+    return f"{Path(code.co_filename).stem}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class Session:
+    """One time-boxed profiling session."""
+
+    def __init__(self, mode, duration, interval, directory):
+        self.mode = mode
+        self.duration = min(duration, MAX_DURATION)
+        self.interval = max(interval, 0.001)
+        stamp = datetime.now(timezone.utc).strftime("%Y-%m-%d-%H-%M-%S")
+        suffix = "collapsed" if mode == "sample" else "pstats"
+        self.path = Path(directory).joinpath(f"profile-{mode}-{stamp}.{suffix}")
+        self.deadline = time.monotonic() + self.duration
+        self.done = False
+        self.stacks = Counter()
+        self.profiles = []
+        self.thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def add(self, profile):
+        with self._lock:
+            if not self.done:
+                self.profiles.append(profile)
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def run(self):
+        if self.mode == "sample":
+            next_sample = time.monotonic()
+            while next_sample < self.deadline and not self._stopped.is_set():
+                self._sample()
+                next_sample += self.interval
+                self._stopped.wait(max(0.0, next_sample - time.monotonic()))
+        else:
+            self._stopped.wait(max(0.0, self.deadline - time.monotonic()))
+        with self._lock:
+            self.done = True
+        self.write()
+
+    def stop(self):
+        """End the session now and wait until its result is written."""
+        self._stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.mode == "sample":
+            with open(self.path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"Profile with {sum(self.stacks.values())} samples written to {self.path}")
+        elif self.profiles:
+            stats = pstats.Stats(*self.profiles)
+            stats.dump_stats(self.path)
+            logger.info(f"Profile of {len(self.profiles)} units of work written to {self.path}")
+        else:
+            logger.warning("No profiled work ran during the cProfile session, nothing written")
+
+
+def start(mode="sample", duration=PROFILE_DURATION, interval=PROFILE_INTERVAL, directory=PROFILE_DIR):
+    """Start a profiling session in the background.
+
+    Returns the Session, or None if one is already running.
+    """
+    global _session
+    if mode not in MODES:
+        raise ValueError(f"unknown profiling mode {mode!r}")
+    with _lock:
+        if _session is not None and not _session.done:
+            return None
+        _session = Session(mode, duration, interval, directory)
+        session = _session
+    logger.info(f"Starting {session.duration:g}s {mode} profiling session")
+    session.thread = threading.Thread(target=session.run, name="profiler", daemon=True)
+    session.thread.start()
+    return session
+
+
+def stop():
+    """Stop the running profiling session early.
+
+    Returns the Session once its result is written, or None if none was running.
+    """
+    with _lock:
+        session = _session
+    if session is None or session.done:
+        return None
+    session.stop()
+    return session
+
+
+def _enable_profile():
+    """Return an enabled cProfile.Profile, or None if another profiler is active."""
+    if sys.getprofile() is not None:
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another profiling tool is using sys.monitoring
+        return None
+    return profile
+
+
+def _acquire_profile():
+    global _shared_profile, _shared_users
+    if not SHARED_PROFILER:
+        return _enable_profile()
+    with _profiler_lock:
+        if _shared_profile is None:
+            _shared_profile = _enable_profile()
+            if _shared_profile is None:
+                return None
+        _shared_users += 1
+        return _shared_profile
+
+
+def _release_profile(session, profile):
+    global _shared_profile, _shared_users
+    if SHARED_PROFILER:
+        with _profiler_lock:
+            _shared_users -= 1
+            if _shared_users:
+                return
+            _shared_profile = None
+            profile.disable()
+    else:
+        profile.disable()
+    session.add(profile)
+
+
+@contextlib.contextmanager
+def profiled():
+    """Run a unit of work under cProfile if a cProfile session is active."""
+    session = _session
+    if session is None or session.done or session.mode != "cprofile":
+        yield
+        return
+    profile = _acquire_profile()
+    if profile is None:
+        yield
+        return
+    try:
+        yield
+    finally:
+        _release_profile(session, profile)
+
+
+def _start_from_signal(mode):
+    def handler(signum, frame):
+        if start(mode) is None:
+            logger.warning("Profiling session already running")
+    return handler
+
+
+def handle_command(line):
+    """Run a control socket command and return the reply."""
+    words = line.split()
+    if words == ["stop"]:
+        session = stop()
+        if session is None:
+            return "error: no profiling session is running"
+        return f"stopped {session.path}"
+    if not words or words[0] not in MODES:
+        return f"error: expected one of {', '.join(MODES)} [seconds] [interval], or stop"
+    try:
+        duration = float(words[1]) if len(words) > 1 else PROFILE_DURATION
+        interval = float(words[2]) if len(words) > 2 else PROFILE_INTERVAL
+        session = start(words[0], duration, interval)
+    except ValueError as e:
+        return f"error: {e}"
+    if session is None:
+        return "error: a profiling session is already running"
+    return f"started {session.path}"
+
+
+def _serve(server):
+    while True:
+        connection, _ = server.accept()
+        with connection:
+            try:
+                connection.settimeout(5)
+                line = connection.makefile().readline()
+                connection.sendall((handle_command(line) + "\n").encode())
+            except OSError as e:
+                logger.warning(f"Profiling control connection failed: {e}")
+
+
+def enable(socket_path=PROFILE_SOCKET):
+    """Start listening for profiling requests on signals and the control socket.
+
+    Must be called from the main thread.
+    """
+    signal.signal(signal.SIGUSR1, _start_from_signal("sample"))
+    signal.signal(signal.SIGUSR2, _start_from_signal("cprofile"))
+    if socket_path:
+        Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(socket_path))
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        threading.Thread(target=_serve, args=(server,), name="profiler-control", daemon=True).start()
+    logger.info(f"Profiling enabled: SIGUSR1 samples, SIGUSR2 runs cProfile, control socket {socket_path or 'disabled'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LEOViz | Profile the running collector")
+
+    parser.add_argument("mode", choices=MODES + ("stop",), help="Sample all thread stacks, run profiled work under cProfile, or stop the running session")
+    parser.add_argument("seconds", type=float, nargs="?", default=PROFILE_DURATION, help="Session length")
+    parser.add_argument("--interval", type=float, default=PROFILE_INTERVAL, help="Sampling interval in seconds")
+    parser.add_argument("--socket", default=PROFILE_SOCKET, help="Control socket of the collector")
+    args = parser.parse_args()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(args.socket))
+        command = args.mode if args.mode == "stop" else f"{args.mode} {args.seconds} {args.interval}"
+        client.sendall(f"{command}\n".encode())
+        print(client.makefile().readline().strip())
@@ -10,6 +10,9 @@ import pandas as pd
 import numpy as np
 from skyfield.api import load, wgs84, utc
 
+from kernels import frame_earth_scores, frame_ut_scores
+from tracing import span
+
 logger = logging.getLogger(__name__)
 
 
@@ -66,9 +69,9 @@ def convert_observed(dir, filename, frame_type, tilt, rotation_az):
         observed_positions.to_csv(
             output_filename, index=False
         )
-        print(f"---> Saved processed obstruction data to {output_filename}")
+        logger.debug(f"Saved processed obstruction data to {output_filename}")
     else:
-        print(f"---> No valid observed data found during pre_process_observed_data for {filename}.")
+        logger.info(f"No valid observed data found in {filename}")
         pd.DataFrame(columns=["Timestamp", "Y", "X", "Elevation", "Azimuth"]).to_csv(output_filename, index=False)
 
     return observed_positions
@@ -79,6 +82,21 @@ def set_observation_time(year, month, day, hour, minute, second):
     return ts.utc(year, month, day, hour, minute, second)
 
 
+def sample_points(observed):
+    """Return the start, middle and end rows of a timeslot's observed trajectory.
+
+    The end is the second-to-last row, and the middle is the row nearest in
+    time to halfway between the start and the end. Rows are not evenly
+    spaced: the poller writes one per frame and polls faster right after
+    the reset and while new pixels appear, so the middle row by position
+    would fall early in the slot.
+    """
+    start, end = observed.iloc[0], observed.iloc[-2]
+    midpoint = start["Timestamp"] + (end["Timestamp"] - start["Timestamp"]) / 2
+    middle = observed.iloc[int((observed["Timestamp"] - midpoint).abs().to_numpy().argmin())]
+    return start, middle, end
+
+
 def process_observed_data(filename, start_time, merged_data_file):
     data = pd.read_csv(filename, sep=",", header=None, names=["Timestamp", "Y", "X"])
     data["Timestamp"] = pd.to_datetime(data["Timestamp"], utc=True)
@@ -107,9 +125,7 @@ def process_observed_data(filename, start_time, merged_data_file):
         print("Not enough data points in merged_filtered_data.")
         return None
 
-    start_data = merged_filtered_data.iloc[0]
-    middle_data = merged_filtered_data.iloc[len(merged_filtered_data) // 2]
-    end_data = merged_filtered_data.iloc[-2]
+    start_data, middle_data, end_data = sample_points(merged_filtered_data)
     rotation = 0
     positions = [
         (
@@ -129,6 +145,11 @@ def process_observed_data(filename, start_time, merged_data_file):
     return positions
 
 
+# Scalar versions of the matching scores. The batch kernels in kernels.py are
+# used for matching, these define the values they must reproduce exactly and
+# are what tests/test_kernels.py compares them against.
+
+
 # Calculate angular separation between two positions
 def angular_separation(alt1, az1, alt2, az2):
     """Calculate the angular separation between two points on a sphere given by altitude and azimuth."""
@@ -247,59 +268,59 @@ def calculate_trajectory_distance_frame_ut(observed_positions, satellite_positio
 
 
 def find_matching_satellites(
-    satellites, observer_location, observed_positions_with_timestamps, frame_type
+    satellites, observer_location, observed_positions_with_timestamps, frame_type, trace=None
 ):
-    best_match = None
-    closest_total_difference = float("inf")
+    if frame_type == 1:  # FRAME_EARTH
+        score = frame_earth_scores
+    elif frame_type == 2:  # FRAME_UT
+        score = frame_ut_scores
+    else:
+        return []
 
     ts = load.timescale()
+    times = ts.utc(
+        [t.year for t, _ in observed_positions_with_timestamps],
+        [t.month for t, _ in observed_positions_with_timestamps],
+        [t.day for t, _ in observed_positions_with_timestamps],
+        [t.hour for t, _ in observed_positions_with_timestamps],
+        [t.minute for t, _ in observed_positions_with_timestamps],
+        [t.second for t, _ in observed_positions_with_timestamps],
+    )
+
+    candidates = []
+    candidate_alt = []
+    candidate_az = []
     for satellite in satellites:
-        satellite_positions = []
-        valid_positions = True
-
-        for observed_time, observed_data in observed_positions_with_timestamps:
-            difference = satellite - observer_location
-            topocentric = difference.at(
-                ts.utc(
-                    observed_time.year,
-                    observed_time.month,
-                    observed_time.day,
-                    observed_time.hour,
-                    observed_time.minute,
-                    observed_time.second,
-                )
-            )
-            alt, az, _ = topocentric.altaz()
-
-            if alt.degrees <= 20:
-                valid_positions = False
-                break
-
-            satellite_positions.append((alt.degrees, az.degrees))
-
-        if valid_positions:
-            if frame_type == 1:  # FRAME_EARTH
-                total_difference = calculate_total_difference(
-                    [
-                        (90 - data[0], data[1])
-                        for _, data in observed_positions_with_timestamps
-                    ],
-                    satellite_positions,
-                )
-            elif frame_type == 2:  # FRAME_UT
-                total_difference = calculate_trajectory_distance_frame_ut(
-                    [
-                        (90 - data[0], data[1])
-                        for _, data in observed_positions_with_timestamps
-                    ],
-                    satellite_positions,
-                )
-            # print(satellite.name, ": ", total_difference)
-            if total_difference < closest_total_difference:
-                closest_total_difference = total_difference
-                best_match = satellite.name
-
-    return [best_match] if best_match else []
+        difference = satellite - observer_location
+        alt, az, _ = difference.at(times).altaz()
+        if np.any(alt.degrees <= 20):
+            continue
+        candidates.append(satellite.name)
+        candidate_alt.append(alt.degrees)
+        candidate_az.append(az.degrees)
+
+    if not candidates:
+        return []
+
+    scores = score(
+        [90 - data[0] for _, data in observed_positions_with_timestamps],
+        [data[1] for _, data in observed_positions_with_timestamps],
+        np.array(candidate_alt),
+        np.array(candidate_az),
+    )
+    # NaN scores never won the comparison in the per-satellite loop
+    scores = np.where(np.isnan(scores), np.inf, scores)
+    best = int(np.argmin(scores))
+    if not np.isfinite(scores[best]):
+        return []
+    if trace is not None:
+        finite = np.sort(scores[np.isfinite(scores)])
+        trace.set(
+            candidates=len(candidates),
+            match_score=float(finite[0]),
+            runner_up_margin=float(finite[1] - finite[0]) if len(finite) > 1 else None,
+        )
+    return [candidates[best]]
 
 
 def calculate_distance_for_best_match(
@@ -326,6 +347,7 @@ def process(
     merged_data_file,
     satellites,
     frame_type,
+    trace=None,
 ):
     initial_time = set_observation_time(year, month, day, hour, minute, second)
     observer_location = wgs84.latlon(
@@ -333,24 +355,27 @@ def process(
         longitude_degrees=config.LONGITUDE,
         elevation_m=config.ALTITUDE,
     )
-    observed_positions_with_timestamps = process_observed_data(
-        filename, initial_time.utc_strftime("%Y-%m-%dT%H:%M:%SZ"), merged_data_file
-    )
+    with span(trace, "read"):
+        observed_positions_with_timestamps = process_observed_data(
+            filename, initial_time.utc_strftime("%Y-%m-%dT%H:%M:%SZ"), merged_data_file
+        )
     if observed_positions_with_timestamps is None:
         return [], [], []
 
-    matching_satellites = find_matching_satellites(
-        satellites, observer_location, observed_positions_with_timestamps, frame_type
-    )
+    with span(trace, "matching"):
+        matching_satellites = find_matching_satellites(
+            satellites, observer_location, observed_positions_with_timestamps, frame_type, trace=trace
+        )
     if not matching_satellites:
         return observed_positions_with_timestamps, [], []
 
     best_match_satellite = next(
         sat for sat in satellites if sat.name == matching_satellites[0]
     )
-    distances = calculate_distance_for_best_match(
-        best_match_satellite, observer_location, initial_time, 14
-    )
+    with span(trace, "distance"):
+        distances = calculate_distance_for_best_match(
+            best_match_satellite, observer_location, initial_time, 14
+        )
 
     return observed_positions_with_timestamps, matching_satellites, distances
 
@@ -372,6 +397,7 @@ def process_intervals(
     merged_data_file,
     satellites,
     frame_type,
+    trace=None,
 ):
     results = []
 
@@ -402,6 +428,7 @@ def process_intervals(
             merged_data_file,
             satellites,
             frame_type,
+            trace=trace,
         )
         if matching_satellites:
             for second in range(15):
@@ -0,0 +1,145 @@
+# flake8: noqa: E501
+"""Periodic job scheduler for the collector.
+
+All jobs are driven from one asyncio event loop. Blocking functions run on a
+persistent thread pool, so they run concurrently without a new process, and
+a fresh import of pandas, skyfield and grpc, per run. Coroutine functions run
+on the event loop itself.
+
+Each job has its own interval. Interval 0 runs the job back to back, like the
+obstruction map cycles. Otherwise runs are either aligned to wall clock
+multiples of the interval, e.g. on the hour, or spaced from the previous
+start, with an optional random delay of up to `jitter` seconds added to
+spread out requests. A job never overlaps itself: a run that is due while
+the previous one is still going is skipped and counted. A job that has
+nothing left to do raises JobDone, and is not run again.
+"""
+
+import time
+import random
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+# Delay before restarting a back to back job that failed
+RETRY_DELAY = 10.0
+
+
+class JobDone(Exception):
+    """Raised by a job that has nothing left to do, so it is not run again."""
+
+
+class Job:
+    def __init__(self, name, function, interval, jitter=0.0, align=False, run_at_start=True):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.jitter = jitter
+        self.align = align
+        self.run_at_start = run_at_start
+        self.task = None
+        self.done = False
+        labels = {"job": name}
+        self.duration = metrics.histogram("job_duration_seconds", "Scheduled job run time", labels, buckets=JOB_BUCKETS)
+        self.succeeded = metrics.counter("job_runs_total", "Scheduled job runs, by result", {**labels, "result": "ok"})
+        self.failed = metrics.counter("job_runs_total", "Scheduled job runs, by result", {**labels, "result": "error"})
+        self.skipped = metrics.counter("job_skipped_total", "Scheduled job runs skipped because the previous run was still going", labels)
+        self.last_success = metrics.gauge("job_last_success_timestamp_seconds", "End of the last successful run of a scheduled job", labels)
+        self.running = metrics.gauge("job_running", "Whether a scheduled job is running", labels)
+        self.running.set(0)
+
+    def next_run(self, now):
+        """Wall clock time of the next run after `now`."""
+        if self.align:
+            base = (now // self.interval + 1) * self.interval
+        else:
+            base = now + self.interval
+        return base + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    """Runs jobs on a shared thread pool from one event loop.
+
+    Args:
+        max_workers: Size of the thread pool. Every job can hold a worker
+            for its whole run, so this should be at least the number of jobs.
+    """
+
+    def __init__(self, max_workers=8):
+        self.jobs = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def add(self, name, function, interval, jitter=0.0, align=False, run_at_start=True):
+        """Add a job. See `Job` and the module docstring for the scheduling options."""
+        self.jobs[name] = Job(name, function, interval, jitter, align, run_at_start)
+        return self.jobs[name]
+
+    async def _execute(self, job):
+        logger.info(f"Running job {job.name}")
+        job.running.set(1)
+        start = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(job.function):
+                await job.function()
+            else:
+                await asyncio.get_running_loop().run_in_executor(self.executor, job.function)
+        except JobDone as e:
+            job.done = True
+            job.succeeded.inc()
+            logger.info(f"Job {job.name} is done, not running it again: {e}")
+            return True
+        except Exception as e:
+            job.failed.inc()
+            logger.error(f"Job {job.name} failed: {e}")
+            return False
+        else:
+            job.succeeded.inc()
+            job.last_success.set(time.time())
+            return True
+        finally:
+            elapsed = time.monotonic() - start
+            job.duration.observe(elapsed)
+            job.running.set(0)
+            logger.info(f"Job {job.name} finished in {elapsed:.1f}s")
+
+    async def _run_back_to_back(self, job):
+        while not job.done:
+            if not await self._execute(job):
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _run_periodic(self, job):
+        due = time.time() if job.run_at_start else job.next_run(time.time())
+        while True:
+            await asyncio.sleep(max(0.0, due - time.time()))
+            if job.done:
+                return
+            if job.task is not None and not job.task.done():
+                job.skipped.inc()
+                logger.warning(f"Job {job.name} is still running, skipping this run")
+            else:
+                job.task = asyncio.create_task(self._execute(job))
+            due = job.next_run(max(due, time.time()))
+
+    async def run(self):
+        """Run all jobs until cancelled."""
+        runners = [
+            self._run_back_to_back(job) if job.interval == 0 else self._run_periodic(job)
+            for job in self.jobs.values()
+        ]
+        try:
+            await asyncio.gather(*runners)
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run_once(self, names=None):
+        """Run the given jobs, or all of them, once and concurrently."""
+        jobs = [job for name, job in self.jobs.items() if names is None or name in names]
+        try:
+            return await asyncio.gather(*(self._execute(job) for job in jobs))
+        finally:
+            self.executor.shutdown(wait=True)
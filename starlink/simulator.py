@@ -0,0 +1,226 @@
+# flake8: noqa: E501
+"""Simulated Starlink dish for running the collector without hardware.
+
+Serves the SpaceX.API.Device.Device gRPC service via the mock dish in
+starlink-grpc-tools, with obstruction maps drawn from real Starlink passes:
+in every timeslot the highest satellite that stays above 20 degrees for the
+whole slot, computed from a TLE file for the given observer, is taken as the
+serving satellite, and its position is added to the FRAME_EARTH map once per
+second. get_status reports the configured orientation, and SINR and latency
+that follow the serving satellite's elevation and slant range.
+
+The protocol definitions come from a protoset recorded from a real dish with
+extract_protoset.py, or without one, from the minimal protocol built into
+the mock dish, which is enough for the collector. Point the collector at the
+simulator with STARLINK_GRPC_ADDR_PORT.
+
+Example:
+    python simulator.py --lat 49.2 --lon -123.1 --alt 80
+    STARLINK_GRPC_ADDR_PORT=127.0.0.1:9200 python main.py --lat 49.2 --lon -123.1 --alt 80
+"""
+
+import sys
+import math
+import logging
+import threading
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+
+import numpy as np
+from sgp4.api import SatrecArray
+from skyfield.api import load, wgs84
+
+import util  # noqa: F401 configures logging
+from config import TLE_DATA_DIR
+from slots import SLOT_SECONDS, slot_id, slot_start
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.joinpath("starlink-grpc-tools")))
+import mock_dish
+
+logger = logging.getLogger(__name__)
+
+MIN_ELEVATION = 20.0
+# Margin for the coarse visibility prefilter, which ignores polar motion and
+# the difference between TEME and true equator of date
+PREFILTER_MARGIN = 5.0
+MAP_CENTER = 62
+PIXELS_PER_DEGREE = 62 / 80
+# Longest stretch of map history drawn at once, e.g. after the map was not
+# polled for a long time
+MAX_DRAW_SECONDS = 3600
+# Timeslots whose serving satellite is kept
+SLOT_CACHE_SIZE = 8
+SPEED_OF_LIGHT_KM_MS = 299.792458
+
+ts = load.timescale()
+
+
+def sky_to_pixel(alt, az):
+    """Return FRAME_EARTH map (row, col) for altitude and azimuth in degrees.
+
+    This is the inverse of the conversion in `satellites.pre_process_observed_data`.
+    """
+    radius = (90.0 - np.asarray(alt)) * PIXELS_PER_DEGREE
+    az = np.radians(az)
+    col = np.rint(MAP_CENTER + radius * np.sin(az)).astype(int)
+    row = np.rint(MAP_CENTER - 1 - radius * np.cos(az)).astype(int)
+    return np.clip(row, 0, mock_dish.MAP_SIZE - 1), np.clip(col, 0, mock_dish.MAP_SIZE - 1)
+
+
+def newest_tle_file(directory=TLE_DATA_DIR):
+    files = sorted(Path(directory).glob("*/starlink-tle-*.txt"), key=lambda f: f.name)
+    return files[-1] if files else None
+
+
+class SimulatedDish(mock_dish.MockDish):
+    """Mock dish whose obstruction map follows real Starlink passes."""
+
+    def __init__(self, satellites, latitude, longitude, altitude, tilt=0.0, azimuth=0.0):
+        super().__init__()
+        self.satellites = satellites
+        self.satrecs = SatrecArray([sat.model for sat in satellites])
+        self.observer = wgs84.latlon(latitude, longitude, elevation_m=altitude)
+        self.observer_xyz = self.observer.itrs_xyz.km
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        self.up = np.array([math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)])
+        self.tilt = tilt
+        self.azimuth = azimuth
+        self.slots = {}
+        self.slots_lock = threading.Lock()
+        self.snr = np.full(mock_dish.MAP_SIZE * mock_dish.MAP_SIZE, -1.0)
+        self.reset_time = None
+        self.drawn_until = None
+
+    def _candidates(self, t):
+        """Indexes of satellites roughly above the elevation mask at time t."""
+        _, r, _ = self.satrecs.sgp4(np.array([t.whole]), np.array([t.ut1_fraction]))
+        r = r[:, 0, :]
+        theta = t.gmst / 24.0 * 2 * math.pi
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        x = cos_t * r[:, 0] + sin_t * r[:, 1]
+        y = -sin_t * r[:, 0] + cos_t * r[:, 1]
+        d = np.stack([x, y, r[:, 2]], axis=1) - self.observer_xyz
+        sin_elevation = d @ self.up / np.linalg.norm(d, axis=1)
+        elevation = np.degrees(np.arcsin(np.clip(sin_elevation, -1, 1)))
+        return np.flatnonzero(elevation > MIN_ELEVATION - PREFILTER_MARGIN)
+
+    def serving_satellite(self, slot):
+        """Return (name, alt, az, distance) per second of a slot, or None.
+
+        May be called from several threads. Slots are computed without
+        holding any lock, so a slot computed by two threads at once is
+        computed twice, with the same result.
+        """
+        with self.slots_lock:
+            if slot in self.slots:
+                return self.slots[slot]
+        start = datetime.fromtimestamp(slot_start(slot), tz=timezone.utc)
+        times = ts.utc(start.year, start.month, start.day, start.hour, start.minute,
+                       start.second + np.arange(SLOT_SECONDS))
+        best = None
+        for index in self._candidates(times[SLOT_SECONDS // 2]):
+            satellite = self.satellites[index]
+            alt, az, distance = (satellite - self.observer).at(times).altaz()
+            if np.any(alt.degrees <= MIN_ELEVATION):
+                continue
+            if best is None or alt.degrees.mean() > best[1].mean():
+                best = (satellite.name, alt.degrees, az.degrees, distance.km)
+        with self.slots_lock:
+            self.slots[slot] = best
+            while len(self.slots) > SLOT_CACHE_SIZE:
+                self.slots.pop(min(self.slots))
+        if best is not None:
+            logger.info(f"Slot {slot}: serving satellite {best[0]}")
+        return best
+
+    def _position(self, second):
+        serving = self.serving_satellite(slot_id(second))
+        if serving is None:
+            return None
+        index = (second - slot_start(slot_id(second))) % SLOT_SECONDS
+        return serving[1][index], serving[2][index], serving[3][index]
+
+    def prepare(self, which):
+        # Propagate the satellites of the slots the request needs before the
+        # dish lock is taken, so requests in other threads are not held up
+        now = int(datetime.now(timezone.utc).timestamp())
+        if which == "get_status":
+            first = now
+        elif which == "dish_get_obstruction_map":
+            first = now if self.drawn_until is None else max(self.drawn_until + 1, now - MAX_DRAW_SECONDS)
+        else:
+            return
+        last_slot = slot_id(now)
+        for slot in range(max(slot_id(first), last_slot - SLOT_CACHE_SIZE + 1), last_slot + 1):
+            self.serving_satellite(slot)
+
+    def obstruction_snr(self, elapsed):
+        now = datetime.now(timezone.utc).timestamp()
+        reset_time = now - elapsed
+        if self.reset_time is None or abs(reset_time - self.reset_time) > 0.5:
+            self.reset_time = reset_time
+            self.snr.fill(-1.0)
+            self.drawn_until = int(reset_time)
+        first = max(self.drawn_until + 1, int(now) - MAX_DRAW_SECONDS)
+        for second in range(first, int(now) + 1):
+            position = self._position(second)
+            if position is not None:
+                row, col = sky_to_pixel(position[0], position[1])
+                self.snr[row * mock_dish.MAP_SIZE + col] = 1.0
+        self.drawn_until = int(now)
+        return self.snr.tolist()
+
+    def status_fields(self):
+        fields = super().status_fields()
+        position = self._position(int(datetime.now(timezone.utc).timestamp()))
+        if position is not None:
+            alt, _, distance = position
+            fields["phy_rx_beam_snr_avg"] = 5.0 + 10.0 * math.sin(math.radians(alt))
+            # Ground station leg approximated as the same length again
+            fields["pop_ping_latency_ms"] = 20.0 + 4 * distance / SPEED_OF_LIGHT_KM_MS
+        else:
+            fields["outage"] = {"duration_ns": 1}
+        boresight_elevation = 90.0 - self.tilt
+        fields["boresight_azimuth_deg"] = self.azimuth
+        fields["boresight_elevation_deg"] = boresight_elevation
+        fields["alignment_stats"] = {
+            "tilt_angle_deg": self.tilt,
+            "boresight_azimuth_deg": self.azimuth,
+            "boresight_elevation_deg": boresight_elevation,
+            "desired_boresight_azimuth_deg": self.azimuth,
+            "desired_boresight_elevation_deg": boresight_elevation,
+            "attitude_uncertainty_deg": 0.5,
+        }
+        return fields
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LEOViz | Simulated Starlink dish")
+
+    parser.add_argument("protoset", nargs="?", help="Protoset file recorded from a dish with extract_protoset.py, defaults to the mock dish's minimal protocol")
+    parser.add_argument("--lat", type=float, required=True, help="Observer latitude")
+    parser.add_argument("--lon", type=float, required=True, help="Observer longitude")
+    parser.add_argument("--alt", type=float, required=True, help="Observer altitude (in meters)")
+    parser.add_argument("--tle", help="TLE file, defaults to the newest one under TLE_DATA_DIR")
+    parser.add_argument("--tilt", type=float, default=0.0, help="Reported dish tilt")
+    parser.add_argument("--azimuth", type=float, default=0.0, help="Reported dish boresight azimuth")
+    parser.add_argument("--bind", default=mock_dish.BIND_DEFAULT, help="host:port to listen on")
+    mock_dish.add_fault_args(parser)
+    args = parser.parse_args()
+
+    tle_file = args.tle or newest_tle_file()
+    if tle_file is None:
+        parser.error(f"no TLE file found under {TLE_DATA_DIR}, pass --tle")
+    satellites = load.tle_file(str(tle_file))
+    logger.info(f"Loaded {len(satellites)} satellites from {tle_file}")
+
+    dish = SimulatedDish(satellites, args.lat, args.lon, args.alt, args.tilt, args.azimuth)
+    server, target, _ = mock_dish.start_server(
+        args.protoset, args.bind, dish=dish, **mock_dish.fault_options(args)
+    )
+    logger.info(f"Simulated dish listening on {target}")
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
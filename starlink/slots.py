@@ -0,0 +1,128 @@
+# flake8: noqa: E501
+"""Starlink timeslot calendar.
+
+Satellite handovers happen every 15 seconds, at seconds 12, 27, 42 and 57 of
+every minute. Since Unix time has whole minutes at multiples of 60, a slot ID
+can be computed with integer arithmetic as floor((t - 12) / 15), and the same
+IDs are used for live collection and bulk processing of recorded data.
+"""
+
+import time
+import logging
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOT_SECONDS = 15
+SLOT_OFFSET_SECONDS = 12
+
+# The final stretch before a deadline is spun instead of slept, since
+# time.sleep may overshoot by up to a scheduler tick.
+SPIN_SECONDS = 0.002
+
+SKEW_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def slot_id(timestamp: float) -> int:
+    """Return the slot ID of a Unix timestamp."""
+    return (int(timestamp // 1) - SLOT_OFFSET_SECONDS) // SLOT_SECONDS
+
+
+def slot_ids(timestamps) -> np.ndarray:
+    """Return the slot IDs of an array of Unix timestamps."""
+    seconds = np.floor(np.asarray(timestamps, dtype=np.float64)).astype(np.int64)
+    return (seconds - SLOT_OFFSET_SECONDS) // SLOT_SECONDS
+
+
+def slot_start(slot: int) -> int:
+    """Return the Unix timestamp at which a slot starts."""
+    return slot * SLOT_SECONDS + SLOT_OFFSET_SECONDS
+
+
+def slot_start_second(slot: int) -> int:
+    """Return the second of the minute (12, 27, 42 or 57) at which a slot starts."""
+    return slot_start(slot) % 60
+
+
+def next_boundary(now: float = None) -> int:
+    """Return the Unix timestamp of the first slot boundary after `now`."""
+    if now is None:
+        now = time.time()
+    return slot_start(slot_id(now) + 1)
+
+
+def group_by_slot(df, column: str = "timestamp"):
+    """Split a DataFrame into per-slot frames.
+
+    Rows are sorted by `column` if they are not already, then cut where the
+    slot ID changes, in a single pass.
+
+    Yields:
+        (slot ID, DataFrame) pairs in time order, skipping empty slots.
+    """
+    if df.empty:
+        return
+    if not df[column].is_monotonic_increasing:
+        df = df.sort_values(column, kind="stable")
+    ids = slot_ids(df[column].to_numpy())
+    bounds = [0] + (np.flatnonzero(np.diff(ids)) + 1).tolist() + [len(ids)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        yield int(ids[start]), df.iloc[start:end]
+
+
+class SlotClock:
+    """Wakes up on slot boundaries.
+
+    Deadlines are converted from wall clock time to `time.monotonic()` once
+    and slept on directly, so a wake-up is not delayed by a polling interval
+    and is not affected by wall clock steps while sleeping. How late each
+    slot actually started is recorded in the slot_boundary_skew_seconds
+    histogram.
+
+    Args:
+        clock: Provides time(), monotonic() and sleep(), by default the time
+            module. A replay passes its starlink_grpc.ReplayClock, which
+            sleeps exactly, so nothing is spun.
+    """
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.spin = SPIN_SECONDS if clock is time else 0.0
+        self.skew = metrics.histogram(
+            "slot_boundary_skew_seconds",
+            "Delay between a slot boundary and the start of its collection",
+            buckets=SKEW_BUCKETS,
+        )
+        self.last_skew = None
+
+    def sleep_until(self, deadline: float) -> None:
+        """Sleep until the wall clock time `deadline`."""
+        monotonic_deadline = self.clock.monotonic() + (deadline - self.clock.time())
+        while True:
+            remaining = monotonic_deadline - self.clock.monotonic()
+            if remaining <= 0:
+                return
+            if remaining > self.spin:
+                self.clock.sleep(remaining - self.spin)
+
+    def wait_for_next_slot(self, last_slot: int = None) -> int:
+        """Return the ID of the next slot to collect, once it has started.
+
+        If the slot after `last_slot` has already started, returns at once
+        without waiting for another boundary.
+        """
+        current = slot_id(self.clock.time())
+        if last_slot is not None and current != last_slot:
+            return current
+        boundary = next_boundary(self.clock.time())
+        self.sleep_until(boundary)
+        return slot_id(boundary)
+
+    def record_start(self, slot: int) -> float:
+        """Record how late collection for `slot` is starting, in seconds."""
+        self.last_skew = self.clock.time() - slot_start(slot)
+        self.skew.observe(self.last_skew)
+        return self.last_skew
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""Run a mock Starlink user terminal gRPC service.
+
+This script serves the SpaceX.API.Device.Device service, with both the unary
+Handle method and the bidirectional Stream method, plus the gRPC reflection
+service, so that the rest of the tools in this project can be run against it
+without a real dish.
+
+The Starlink protocol definitions are not published, so the message types are
+loaded from a protoset file recorded from a real dish with
+extract_protoset.py. Responses only set the fields the recorded protocol
+version knows about. Without a protoset file, a minimal built-in protocol
+is used, see `minimal_protoset`, so the mock and the clients talking to it
+can run without ever having reached a dish, for example in tests.
+
+The following requests are supported: get_status, get_history,
+dish_get_obstruction_map and dish_clear_obstruction_map. Anything else fails
+with UNIMPLEMENTED.
+
+Response latency and random request failures can be injected, to exercise
+client timeout and retry handling.
+"""
+
+import argparse
+from concurrent import futures
+import logging
+import math
+import random
+import threading
+import time
+
+import grpc
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import message_factory
+from grpc_reflection.v1alpha import reflection
+
+SERVICE_NAME = "SpaceX.API.Device.Device"
+BIND_DEFAULT = "127.0.0.1:9200"
+MAP_SIZE = 123
+# Same ring buffer length as the dish: 12 hours of 1 second samples
+HISTORY_SIZE = 43200
+
+
+def _message(file_proto, name, *fields, oneof=None, nested=()):
+    """Add a message type to a FileDescriptorProto.
+
+    Fields are (name, type) or (name, type, type name) tuples, numbered in
+    order, with "[]" appended to the type for repeated fields. If `oneof` is
+    set, every field but the first is part of a oneof of that name.
+    """
+    message = file_proto.message_type.add(name=name)
+    if oneof is not None:
+        message.oneof_decl.add(name=oneof)
+    for number, (field_name, kind, *type_name) in enumerate(fields, start=1):
+        label = descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+        if kind.endswith("[]"):
+            kind = kind[:-2]
+            label = descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED
+        field = message.field.add(name=field_name,
+                                  number=number,
+                                  label=label,
+                                  type=getattr(descriptor_pb2.FieldDescriptorProto,
+                                               "TYPE_" + kind.upper()))
+        if type_name:
+            field.type_name = type_name[0]
+        if oneof is not None and number > 1:
+            field.oneof_index = 0
+    for enum_name, values in nested:
+        enum = message.enum_type.add(name=enum_name)
+        for number, value in enumerate(values):
+            enum.value.add(name=value, number=number)
+    return message
+
+
+def minimal_protoset():
+    """Return a serialized FileDescriptorSet of a minimal Device protocol.
+
+    It has the same message, field and service names as the dish protocol,
+    for the requests this mock supports, but not the same field numbers, so
+    it can only be used to talk to this mock, never to a real dish.
+    """
+    dish = descriptor_pb2.FileDescriptorProto(name="spacex/api/device/dish.proto",
+                                              package="SpaceX.API.Device",
+                                              syntax="proto3")
+    _message(dish, "DeviceInfo", ("id", "string"), ("hardware_version", "string"),
+             ("software_version", "string"))
+    _message(dish, "DeviceState", ("uptime_s", "uint64"))
+    _message(dish, "DishAlerts", ("motors_stuck", "bool"), ("thermal_throttle", "bool"),
+             ("thermal_shutdown", "bool"), ("unexpected_location", "bool"))
+    _message(dish, "DishOutage", ("cause", "enum", ".SpaceX.API.Device.DishOutage.Cause"),
+             ("start_timestamp_ns", "int64"), ("duration_ns", "uint64"),
+             nested=[("Cause", ("UNKNOWN", "BOOTING", "STOWED", "THERMAL_SHUTDOWN",
+                                "NO_SCHEDULE", "NO_SATS", "OBSTRUCTED", "NO_DOWNLINK",
+                                "NO_PINGS"))])
+    _message(dish, "AlignmentStats", ("tilt_angle_deg", "float"),
+             ("boresight_azimuth_deg", "float"), ("boresight_elevation_deg", "float"),
+             ("desired_boresight_azimuth_deg", "float"),
+             ("desired_boresight_elevation_deg", "float"),
+             ("attitude_uncertainty_deg", "float"))
+    _message(dish, "DishGetStatusResponse",
+             ("device_info", "message", ".SpaceX.API.Device.DeviceInfo"),
+             ("device_state", "message", ".SpaceX.API.Device.DeviceState"),
+             ("alerts", "message", ".SpaceX.API.Device.DishAlerts"),
+             ("outage", "message", ".SpaceX.API.Device.DishOutage"),
+             ("alignment_stats", "message", ".SpaceX.API.Device.AlignmentStats"),
+             ("pop_ping_drop_rate", "float"), ("pop_ping_latency_ms", "float"),
+             ("downlink_throughput_bps", "float"), ("uplink_throughput_bps", "float"),
+             ("boresight_azimuth_deg", "float"), ("boresight_elevation_deg", "float"),
+             ("phy_rx_beam_snr_avg", "float"))
+    _message(dish, "DishGetHistoryResponse", ("current", "uint64"),
+             ("pop_ping_drop_rate", "float[]"), ("pop_ping_latency_ms", "float[]"),
+             ("downlink_throughput_bps", "float[]"), ("uplink_throughput_bps", "float[]"),
+             ("power_in", "float[]"))
+    _message(dish, "DishGetObstructionMapRequest")
+    _message(dish, "DishGetObstructionMapResponse", ("num_rows", "uint32"),
+             ("num_cols", "uint32"), ("snr", "float[]"),
+             ("map_reference_frame", "enum",
+              ".SpaceX.API.Device.DishGetObstructionMapResponse.ReferenceFrame"),
+             nested=[("ReferenceFrame", ("UNKNOWN", "FRAME_EARTH", "FRAME_UT"))])
+    _message(dish, "DishClearObstructionMapRequest")
+    _message(dish, "DishClearObstructionMapResponse")
+
+    device = descriptor_pb2.FileDescriptorProto(name="spacex/api/device/device.proto",
+                                                package="SpaceX.API.Device",
+                                                dependency=[dish.name],
+                                                syntax="proto3")
+    _message(device, "GetStatusRequest")
+    _message(device, "GetHistoryRequest")
+    _message(device, "GetLocationRequest")
+    _message(device, "Request", ("id", "uint64"),
+             ("get_status", "message", ".SpaceX.API.Device.GetStatusRequest"),
+             ("get_history", "message", ".SpaceX.API.Device.GetHistoryRequest"),
+             ("get_location", "message", ".SpaceX.API.Device.GetLocationRequest"),
+             ("dish_get_obstruction_map", "message",
+              ".SpaceX.API.Device.DishGetObstructionMapRequest"),
+             ("dish_clear_obstruction_map", "message",
+              ".SpaceX.API.Device.DishClearObstructionMapRequest"),
+             oneof="request")
+    _message(device, "Response", ("id", "uint64"),
+             ("dish_get_status", "message", ".SpaceX.API.Device.DishGetStatusResponse"),
+             ("dish_get_history", "message",
+              ".SpaceX.API.Device.DishGetHistoryResponse"),
+             ("dish_get_obstruction_map", "message",
+              ".SpaceX.API.Device.DishGetObstructionMapResponse"),
+             ("dish_clear_obstruction_map", "message",
+              ".SpaceX.API.Device.DishClearObstructionMapResponse"),
+             oneof="response")
+    _message(device, "ToDevice", ("request", "message", ".SpaceX.API.Device.Request"))
+    _message(device, "FromDevice", ("response", "message", ".SpaceX.API.Device.Response"))
+    service = device.service.add(name="Device")
+    service.method.add(name="Handle",
+                       input_type=".SpaceX.API.Device.Request",
+                       output_type=".SpaceX.API.Device.Response")
+    service.method.add(name="Stream",
+                       input_type=".SpaceX.API.Device.ToDevice",
+                       output_type=".SpaceX.API.Device.FromDevice",
+                       client_streaming=True,
+                       server_streaming=True)
+
+    return descriptor_pb2.FileDescriptorSet(file=[dish, device]).SerializeToString()
+
+
+def load_protoset(filename=None):
+    """Load a protoset file into a new descriptor pool.
+
+    Args:
+        filename (str): Protoset file name, or None for `minimal_protoset`.
+    """
+    if filename is None:
+        fdset = descriptor_pb2.FileDescriptorSet.FromString(minimal_protoset())
+    else:
+        with open(filename, "rb") as infile:
+            fdset = descriptor_pb2.FileDescriptorSet.FromString(infile.read())
+    pool = descriptor_pool.DescriptorPool()
+    added = set()
+    files = {proto.name: proto for proto in fdset.file}
+
+    def add(name):
+        if name in added:
+            return
+        added.add(name)
+        proto = files[name]
+        for dep in proto.dependency:
+            if dep in files:
+                add(dep)
+        pool.Add(proto)
+
+    for name in files:
+        add(name)
+    return pool
+
+
+def set_fields(message, **values):
+    """Set the fields of message that exist in its protocol version."""
+    fields = message.DESCRIPTOR.fields_by_name
+    for name, value in values.items():
+        if name not in fields:
+            continue
+        if isinstance(value, dict):
+            set_fields(getattr(message, name), **value)
+        elif isinstance(value, (list, tuple)):
+            getattr(message, name)[:] = value
+        else:
+            setattr(message, name, value)
+
+
+class MockDish:
+    """State and request handling for the mock dish.
+
+    Subclasses can override `obstruction_snr`, `status_fields` and
+    `history_sample` to generate other data.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.map_reset_time = self.start_time
+        self.history_counter = 0
+        self.history_time = self.start_time
+        self.history = {
+            "pop_ping_drop_rate": [0.0] * HISTORY_SIZE,
+            "pop_ping_latency_ms": [0.0] * HISTORY_SIZE,
+            "downlink_throughput_bps": [0.0] * HISTORY_SIZE,
+            "uplink_throughput_bps": [0.0] * HISTORY_SIZE,
+            "power_in": [0.0] * HISTORY_SIZE,
+        }
+
+    def uptime(self):
+        return int(time.monotonic() - self.start_time)
+
+    def status_fields(self):
+        return {
+            "device_info": {
+                "id": "ut01000000-00000000-00000000",
+                "hardware_version": "mock",
+                "software_version": "mock",
+            },
+            "device_state": {"uptime_s": self.uptime()},
+            "pop_ping_latency_ms": 30.0,
+            "alignment_stats": {
+                "tilt_angle_deg": 0.0,
+                "boresight_azimuth_deg": 0.0,
+                "boresight_elevation_deg": 90.0,
+            },
+        }
+
+    def history_sample(self, counter):
+        return {
+            "pop_ping_drop_rate": 0.0,
+            "pop_ping_latency_ms": 30.0 + 5.0 * math.sin(counter / 15.0),
+            "downlink_throughput_bps": 1.0e6,
+            "uplink_throughput_bps": 1.0e5,
+            "power_in": 50.0,
+        }
+
+    def obstruction_snr(self, elapsed):
+        """Return a flat map with a pixel trail advancing once per second."""
+        snr = [-1.0] * (MAP_SIZE * MAP_SIZE)
+        row = MAP_SIZE // 2
+        for col in range(min(int(elapsed), MAP_SIZE)):
+            snr[row * MAP_SIZE + col] = 1.0
+        return snr
+
+    def _update_history(self):
+        # One sample per second, written into a ring buffer like the dish does
+        now = time.monotonic()
+        behind = int(now - self.history_time) - HISTORY_SIZE
+        if behind > 0:
+            # Samples that would be overwritten anyway
+            self.history_time += behind
+            self.history_counter += behind
+        while self.history_time + 1.0 <= now:
+            self.history_time += 1.0
+            sample = self.history_sample(self.history_counter)
+            index = self.history_counter % HISTORY_SIZE
+            for field, value in sample.items():
+                self.history[field][index] = value
+            self.history_counter += 1
+
+    def prepare(self, which):
+        """Do work for a request that does not need `lock`, before it is taken.
+
+        Called with the name of the request, before `handle` fills in the
+        response under the lock, so slow computations in subclasses do not
+        hold up requests handled in other threads.
+        """
+
+    def handle(self, request, response):
+        """Fill in response for request. Returns False if not supported."""
+        which = request.WhichOneof("request")
+        self.prepare(which)
+        with self.lock:
+            if which == "get_status":
+                set_fields(response.dish_get_status, **self.status_fields())
+            elif which == "get_history":
+                self._update_history()
+                set_fields(response.dish_get_history, current=self.history_counter, **self.history)
+            elif which == "dish_get_obstruction_map":
+                set_fields(response.dish_get_obstruction_map,
+                           num_rows=MAP_SIZE,
+                           num_cols=MAP_SIZE,
+                           snr=self.obstruction_snr(time.monotonic() - self.map_reset_time),
+                           map_reference_frame=1)
+            elif which == "dish_clear_obstruction_map":
+                self.map_reset_time = time.monotonic()
+                response.dish_clear_obstruction_map.SetInParent()
+            else:
+                return False
+        return True
+
+
+class DeviceService:
+    """gRPC method implementations for the Device service.
+
+    Args:
+        pool: Descriptor pool holding the Device service protocol.
+        dish (MockDish): Dish state object.
+        latency (float): Mean added response delay, in seconds.
+        jitter (float): Standard deviation of the added delay, in seconds.
+        failure_rate (float): Fraction of requests to fail with UNAVAILABLE.
+            On Stream calls, a failure ends the whole call, like a dropped
+            connection would.
+    """
+    def __init__(self, pool, dish, latency=0.0, jitter=0.0, failure_rate=0.0):
+        self.dish = dish
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.response_class = message_factory.GetMessageClass(
+            pool.FindMessageTypeByName("SpaceX.API.Device.Response"))
+        self.request_class = message_factory.GetMessageClass(
+            pool.FindMessageTypeByName("SpaceX.API.Device.Request"))
+        self.to_device_class = message_factory.GetMessageClass(
+            pool.FindMessageTypeByName("SpaceX.API.Device.ToDevice"))
+        self.from_device_class = message_factory.GetMessageClass(
+            pool.FindMessageTypeByName("SpaceX.API.Device.FromDevice"))
+
+    def _respond(self, request, context):
+        delay = random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+        response = self.response_class(id=request.id)
+        if not self.dish.handle(request, response):
+            return None
+        return response
+
+    def Handle(self, request, context):
+        response = self._respond(request, context)
+        if response is None:
+            context.abort(grpc.StatusCode.UNIMPLEMENTED, "Unsupported request")
+        return response
+
+    def Stream(self, request_iterator, context):
+        for message in request_iterator:
+            if not message.HasField("request"):
+                continue
+            response = self._respond(message.request, context)
+            if response is None:
+                context.abort(grpc.StatusCode.UNIMPLEMENTED, "Unsupported request")
+            yield self.from_device_class(response=response)
+
+    def handler(self):
+        return grpc.method_handlers_generic_handler(
+            SERVICE_NAME, {
+                "Handle":
+                    grpc.unary_unary_rpc_method_handler(
+                        self.Handle,
+                        request_deserializer=self.request_class.FromString,
+                        response_serializer=self.response_class.SerializeToString),
+                "Stream":
+                    grpc.stream_stream_rpc_method_handler(
+                        self.Stream,
+                        request_deserializer=self.to_device_class.FromString,
+                        response_serializer=self.from_device_class.SerializeToString),
+            })
+
+
+def start_server(protoset=None, bind=BIND_DEFAULT, dish=None, max_workers=10, **faults):
+    """Start a mock dish server in the background.
+
+    Args:
+        protoset (str): Protoset file name, as written by extract_protoset.py,
+            or None to use `minimal_protoset`.
+        bind (str): host:port to listen on. Use port 0 to pick a free port.
+        dish (MockDish): Optionally provide the dish state object to use.
+        faults: latency, jitter and failure_rate, see `DeviceService`.
+
+    Returns:
+        A tuple of the started grpc.Server, the "host:port" target to
+        connect to, and the MockDish object.
+    """
+    pool = load_protoset(protoset)
+    dish = MockDish() if dish is None else dish
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((DeviceService(pool, dish, **faults).handler(),))
+    reflection.enable_server_reflection((SERVICE_NAME, reflection.SERVICE_NAME), server, pool=pool)
+    port = server.add_insecure_port(bind)
+    server.start()
+    return server, "{0}:{1}".format(bind.rpartition(":")[0], port), dish
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a mock Starlink user terminal gRPC service")
+    parser.add_argument("protoset",
+                        metavar="PROTOSET",
+                        nargs="?",
+                        help="Protoset file recorded from a dish with extract_protoset.py, "
+                        "default: a minimal built-in protocol")
+    parser.add_argument("-b",
+                        "--bind",
+                        default=BIND_DEFAULT,
+                        help="host:port to listen on, default: " + BIND_DEFAULT)
+    add_fault_args(parser)
+    return parser.parse_args()
+
+
+def add_fault_args(parser):
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.0,
+                        help="Mean added response delay in seconds, default: 0")
+    parser.add_argument("--jitter",
+                        type=float,
+                        default=0.0,
+                        help="Standard deviation of the added delay in seconds, default: 0")
+    parser.add_argument("--failure-rate",
+                        type=float,
+                        default=0.0,
+                        help="Fraction of requests to fail with UNAVAILABLE, default: 0")
+
+
+def fault_options(opts):
+    return {"latency": opts.latency, "jitter": opts.jitter, "failure_rate": opts.failure_rate}
+
+
+def main():
+    opts = parse_args()
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    server, target, _ = start_server(opts.protoset, opts.bind, **fault_options(opts))
+    logging.info("Mock dish listening on %s", target)
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
+
+
+if __name__ == "__main__":
+    main()
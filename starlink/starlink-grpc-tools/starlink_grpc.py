@@ -396,15 +396,29 @@ unsupported hardware, the values will all report as 0.0.
     kilowatt-hours.
 """
 
-from itertools import chain
+import binascii
+import bisect
+from itertools import accumulate, chain, count
 import math
+import os
+import queue
+import re
 import statistics
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple, get_type_hints
+import struct
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple, get_type_hints
 from typing_extensions import TypedDict, get_args
 
+from google.protobuf import descriptor_pb2
 import grpc
 
+if TYPE_CHECKING:
+    import numpy as np
+
 try:
+    from grpc_reflection.v1alpha import reflection_pb2
     from yagrc import importer
     importer.add_lazy_packages(["spacex.api.device"])
     imports_pending = True
@@ -419,6 +433,57 @@ from spacex.api.device import dish_pb2
 # prevent hang if the connection goes dead without closing.
 REQUEST_TIMEOUT = 10
 
+# The dish's address and port, used when no target is given.
+DEFAULT_TARGET = "192.168.100.1:9200"
+
+# Directory holding protoset files, named the same way extract_protoset.py
+# names them, from which the protocol definitions are loaded at import time
+# instead of via reflection. Only protocols reflected from DEFAULT_TARGET are
+# written to it, since the cache is loaded before the target is known. Set to
+# an empty string to disable.
+PROTOSET_CACHE_DIR = os.environ.get(
+    "STARLINK_GRPC_PROTOSET_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                 "starlink-grpc"))
+
+# Cached protosets older than this, in seconds, are not used, so that dish
+# firmware updates that change the protocol get picked up. The age is reset
+# each time reflection returns the same data.
+PROTOSET_MAX_AGE = 24 * 60 * 60
+
+PROTOSET_PATTERN = re.compile(r"^([0-9a-f]{8})_(\d+)\.protoset$")
+
+# Status codes with which a dish rejects a request or response that does not
+# match its protocol: UNIMPLEMENTED for an unknown request, INTERNAL when the
+# response cannot be parsed.
+PROTOCOL_ERROR_CODES = frozenset((grpc.StatusCode.UNIMPLEMENTED, grpc.StatusCode.INTERNAL))
+
+# gRPC channel options for ChannelContext. Pings detect a dead connection
+# without waiting for a request to time out. If the dish considers them too
+# frequent, gRPC backs off the ping interval by itself.
+CHANNEL_OPTIONS = (
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 5000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.initial_reconnect_backoff_ms", 1000),
+    ("grpc.max_reconnect_backoff_ms", 30000),
+)
+
+# Fast-fail period after a failed call, in seconds, doubling with each
+# consecutive failure.
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+
+# Status codes of failed calls that mean the dish could not be reached, as
+# opposed to the dish answering with an error, such as PERMISSION_DENIED
+# from get_location when location access is disabled. Only these start the
+# fast-fail period. Errors without a status code are counted as these, too.
+TRANSPORT_ERROR_CODES = frozenset((grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED))
+
+# Upper bounds of the RPC latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
 HISTORY_FIELDS = ("pop_ping_drop_rate", "pop_ping_latency_ms", "downlink_throughput_bps",
                   "uplink_throughput_bps", "power_in")
 
@@ -568,10 +633,232 @@ def _field_types(hint_type):
     return list(xlate(val) for val in get_type_hints(hint_type).values())
 
 
-def resolve_imports(channel: grpc.Channel):
-    importer.resolve_lazy_imports(channel)
-    global imports_pending
-    imports_pending = False
+def protoset_filename(protoset: bytes) -> str:
+    """Return the file name for serialized FileDescriptorSet data.
+
+    This is the same name extract_protoset.py uses: the CRC32 value and byte
+    length of the data.
+    """
+    return "{0:08x}_{1}.protoset".format(binascii.crc32(protoset), len(protoset))
+
+
+def _read_cached_protoset(directory: str) -> Optional[Tuple[str, bytes]]:
+    # Newest valid file wins
+    try:
+        entries = [entry for entry in os.scandir(directory) if PROTOSET_PATTERN.match(entry.name)]
+    except OSError:
+        return None
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries:
+        if entry.stat().st_mtime < time.time() - PROTOSET_MAX_AGE:
+            break
+        try:
+            with open(entry.path, "rb") as infile:
+                protoset = infile.read()
+        except OSError:
+            continue
+        if protoset_filename(protoset) == entry.name:
+            return entry.path, protoset
+    return None
+
+
+def _write_cached_protoset(directory: str, protoset: bytes) -> None:
+    path = os.path.join(directory, protoset_filename(protoset))
+    try:
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as outfile:
+            outfile.write(protoset)
+        os.replace(tmp_path, path)
+    except OSError:
+        # The cache is only an optimization
+        pass
+
+
+def _loaded_protoset() -> bytes:
+    fdset = descriptor_pb2.FileDescriptorSet()
+    added = set()
+
+    def add(file_descr):
+        if file_descr.name in added:
+            return
+        added.add(file_descr.name)
+        for dep in file_descr.dependencies:
+            add(dep)
+        file_descr.CopyToProto(fdset.file.add())
+
+    add(device_pb2.DESCRIPTOR)
+    return fdset.SerializeToString()
+
+
+class _ProtosetChannel:
+    """Stands in for a channel to a reflection service, using protoset data.
+
+    This only supports what `yagrc.importer.resolve_lazy_imports` needs:
+    file_by_filename requests on the ServerReflectionInfo method.
+    """
+    def __init__(self, protoset: bytes) -> None:
+        fdset = descriptor_pb2.FileDescriptorSet.FromString(protoset)
+        self.files = {proto.name: proto.SerializeToString() for proto in fdset.file}
+
+    def stream_stream(self, method, request_serializer, response_deserializer, **kwargs):
+        def call(requests, timeout=None):
+            for request in requests:
+                request = reflection_pb2.ServerReflectionRequest.FromString(
+                    request_serializer(request))
+                response = reflection_pb2.ServerReflectionResponse()
+                if request.file_by_filename in self.files:
+                    response.file_descriptor_response.file_descriptor_proto.append(
+                        self.files[request.file_by_filename])
+                else:
+                    response.error_response.error_code = grpc.StatusCode.NOT_FOUND.value[0]
+                    response.error_response.error_message = "not found"
+                yield response_deserializer(response.SerializeToString())
+
+        return call
+
+
+# Path of the cached protoset file the protocol definitions were loaded from,
+# or None if they were not loaded from the cache
+_cached_protoset_path: Optional[str] = None
+# Channel the protocol definitions were reflected from, while it is not known
+# yet whether that channel connects to DEFAULT_TARGET
+_reflected_channel = None
+_imports_lock = threading.Lock()
+
+
+def load_cached_protoset(directory: Optional[str] = None) -> bool:
+    """Load the protocol definitions from a cached protoset file.
+
+    This is done at import time, if a recent enough protoset file is found in
+    `PROTOSET_CACHE_DIR`, so no reflection request is needed at all. If a
+    call then fails in a way that suggests the cached protocol does not match
+    the dish's, `call_with_channel` deletes the file and loads the protocol
+    via reflection instead.
+
+    Args:
+        directory (str): Optionally override the cache directory.
+
+    Returns:
+        True if the protocol definitions are available now, False if they
+        will need to be loaded via reflection.
+    """
+    global imports_pending, _cached_protoset_path
+    with _imports_lock:
+        if not imports_pending:
+            return True
+        directory = PROTOSET_CACHE_DIR if directory is None else directory
+        if not directory:
+            return False
+        cached = _read_cached_protoset(directory)
+        if cached is None:
+            return False
+        try:
+            importer.resolve_lazy_imports(_ProtosetChannel(cached[1]))
+        except Exception:  # pylint: disable=broad-except
+            # Stale or unusable cache, so fall back to reflection
+            return False
+        imports_pending = False
+        _cached_protoset_path = cached[0]
+        return True
+
+
+def resolve_imports(channel: grpc.Channel, target: Optional[str] = None):
+    """Load the protocol definitions via reflection, if not loaded yet.
+
+    Args:
+        channel (grpc.Channel): Channel to the dish.
+        target (str): Address and port the channel connects to. The protocol
+            definitions are written to the protoset cache only if this is
+            `DEFAULT_TARGET`, so that, for example, a test server cannot
+            leave behind a cache that does not match the dish. If not set,
+            `call_with_channel` decides once the call that needed them is
+            done.
+    """
+    global imports_pending, _reflected_channel
+    with _imports_lock:
+        if not imports_pending:
+            return
+        importer.resolve_lazy_imports(channel)
+        imports_pending = False
+        _reflected_channel = channel
+    if target is not None:
+        _save_reflected_protoset(channel, target)
+
+
+def _save_reflected_protoset(channel, target: str) -> None:
+    global _reflected_channel
+    with _imports_lock:
+        if _reflected_channel is not channel:
+            return
+        _reflected_channel = None
+        if PROTOSET_CACHE_DIR and target == DEFAULT_TARGET:
+            _write_cached_protoset(PROTOSET_CACHE_DIR, _loaded_protoset())
+
+
+def is_protocol_mismatch(e: Exception) -> bool:
+    """Return whether a failed call may be due to a stale protoset cache.
+
+    That is the case if the protocol definitions were loaded from the cache
+    and the dish rejected the request or its response could not be parsed.
+    """
+    if _cached_protoset_path is None:
+        return False
+    if isinstance(e, grpc.RpcError):
+        # grpc.aio errors have a status code, but are not grpc.Call objects
+        code = getattr(e, "code", None)
+        return code is not None and code() in PROTOCOL_ERROR_CODES
+    return isinstance(e, (AttributeError, ValueError))
+
+
+def reload_imports(channel: grpc.Channel, target: Optional[str] = None) -> None:
+    """Replace protocol definitions loaded from the cache with reflected ones.
+
+    The cached protoset file is deleted. The protocol modules that have
+    already been imported are updated in place, so references to them and
+    to `device_pb2` and friends stay valid. Does nothing if the protocol
+    definitions were not loaded from the cache.
+
+    Args:
+        channel (grpc.Channel): Channel to the dish.
+        target (str): Address and port the channel connects to, see
+            `resolve_imports`.
+    """
+    global _cached_protoset_path
+    with _imports_lock:
+        if _cached_protoset_path is None:
+            return
+        # yagrc resolves lazy imports only once, so reflect into a new
+        # descriptor pool and rebuild the modules from that.
+        reflector = importer.GrpcImporter().reflector
+        modules = {}
+        for name in list(sys.modules):
+            if not name.startswith("spacex.api."):
+                continue
+            if name.endswith("_pb2"):
+                modules[name] = (name[:-4].replace(".", "/") + ".proto", False)
+            elif name.endswith("_pb2_grpc"):
+                modules[name] = (name[:-9].replace(".", "/") + ".proto", True)
+        reflector.load_protocols(channel, filenames=set(filename for filename, _ in modules.values()))
+        # Message modules first, since the service modules refer to them
+        for name, (filename, is_grpc) in sorted(modules.items(), key=lambda item: item[1][1]):
+            if is_grpc:
+                importer._exec_pb2_grpc_module(sys.modules[name], reflector, filename)  # pylint: disable=protected-access
+            else:
+                importer._exec_pb2_module(sys.modules[name], reflector, filename)  # pylint: disable=protected-access
+        try:
+            os.remove(_cached_protoset_path)
+        except OSError:
+            pass
+        _cached_protoset_path = None
+        if PROTOSET_CACHE_DIR and target == DEFAULT_TARGET:
+            _write_cached_protoset(PROTOSET_CACHE_DIR, _loaded_protoset())
+
+
+load_cached_protoset()
 
 
 class GrpcError(Exception):
@@ -581,6 +868,8 @@ class GrpcError(Exception):
         # a Call object, and that class has some minimally useful info.
         if isinstance(e, grpc.Call):
             msg = e.details()
+        elif isinstance(e, (ChannelUnavailableError, ReplayFinished, StreamError)):
+            msg = str(e)
         elif isinstance(e, grpc.RpcError):
             msg = "Unknown communication or service error"
         elif isinstance(e, (AttributeError, IndexError, TypeError, ValueError)):
@@ -596,51 +885,630 @@ class UnwrappedHistory:
     unwrapped: bool
 
 
+class ChannelUnavailableError(grpc.RpcError):
+    """A call was not attempted because the target has been unreachable."""
+    def __init__(self, msg: str) -> None:
+        super().__init__(msg)
+        self.msg = msg
+
+    def __str__(self) -> str:
+        return self.msg
+
+
+class RpcStats:
+    """Per-RPC latency histograms and error counts for a ChannelContext.
+
+    RPCs are named after the function in this module that made them, for
+    example "get_status". Safe to read while calls are being made from other
+    threads.
+    """
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._latency: Dict[str, List[int]] = {}
+        self._latency_sum: Dict[str, float] = {}
+        self._errors: Dict[str, Dict[str, int]] = {}
+
+    def observe(self, name: str, seconds: float, error: Optional[str] = None) -> None:
+        """Record one call, and its error code name if it failed."""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts = self._latency.setdefault(name, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self._latency_sum[name] = self._latency_sum.get(name, 0.0) + seconds
+            if error is not None:
+                errors = self._errors.setdefault(name, {})
+                errors[error] = errors.get(error, 0) + 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Return the stats recorded so far.
+
+        Returns:
+            A dict mapping RPC name to a dict with the following keys:
+            "count": number of calls, including failed ones; "sum": total
+            seconds spent in them; "buckets": list of (upper bound, cumulative
+            count) pairs, ending with an infinite upper bound; "errors": dict
+            mapping status code name, or "UNREACHABLE" for calls failed fast
+            by the circuit breaker, to count.
+        """
+        with self._lock:
+            result = {}
+            for name, counts in self._latency.items():
+                cumulative = list(accumulate(counts))
+                result[name] = {
+                    "count": cumulative[-1],
+                    "sum": self._latency_sum[name],
+                    "buckets": list(zip(self.buckets + (math.inf,), cumulative)),
+                    "errors": dict(self._errors.get(name, {})),
+                }
+            return result
+
+
 class ChannelContext:
     """A wrapper for reusing an open grpc Channel across calls.
 
+    The channel is opened with keepalive enabled. The `connectivity`
+    attribute follows the result of the last call made through it: READY
+    after a call that reached the dish, TRANSIENT_FAILURE after one that did
+    not. It is not watched in the background, since grpc's connectivity
+    polling thread races with closing the channel.
+
+    Calls made through `call_with_channel` are timed into `stats`. When a
+    call fails because the dish could not be reached, further calls fail
+    fast with `ChannelUnavailableError` for a backoff period that doubles
+    with each consecutive failure, up to `BACKOFF_MAX` seconds. This keeps
+    callers polling in a loop from blocking on connection attempts while the
+    dish is unreachable, for example while it reboots. Errors returned by
+    the dish itself do not count as failures. The context may be shared
+    between threads.
+
     `close()` should be called on the object when it is no longer
     in use.
     """
     def __init__(self, target: Optional[str] = None) -> None:
         self.channel = None
-        self.target = "192.168.100.1:9200" if target is None else target
+        self.target = DEFAULT_TARGET if target is None else target
+        self.connectivity: Optional[grpc.ChannelConnectivity] = None
+        self.stats = RpcStats()
+        self.failures = 0
+        self._retry_at = 0.0
+        self._state_lock = threading.Lock()
 
     def get_channel(self) -> Tuple[grpc.Channel, bool]:
         reused = True
         if self.channel is None:
-            self.channel = grpc.insecure_channel(self.target)
+            self.channel = grpc.insecure_channel(self.target, options=CHANNEL_OPTIONS)
             reused = False
         return self.channel, reused
 
+    def check_available(self) -> None:
+        """Raise ChannelUnavailableError if calls should fail fast now."""
+        with self._state_lock:
+            remaining = self._retry_at - time.monotonic()
+        if remaining > 0:
+            raise ChannelUnavailableError(
+                "Dish unreachable, not retrying for another {0:.1f}s".format(remaining))
+
+    def record_success(self) -> None:
+        with self._state_lock:
+            self.failures = 0
+            self._retry_at = 0.0
+            self.connectivity = grpc.ChannelConnectivity.READY
+
+    def record_failure(self) -> None:
+        with self._state_lock:
+            self.failures += 1
+            backoff = min(BACKOFF_INITIAL * 2**(self.failures - 1), BACKOFF_MAX)
+            self._retry_at = time.monotonic() + backoff
+            self.connectivity = grpc.ChannelConnectivity.TRANSIENT_FAILURE
+
     def close(self) -> None:
         if self.channel is not None:
             self.channel.close()
         self.channel = None
+        self.connectivity = None
+
+
+def _rpc_name(function) -> str:
+    # The grpc_call closures are named after the function defining them
+    return getattr(function, "__qualname__", "unknown").split(".")[0]
 
 
 def call_with_channel(function, *args, context: Optional[ChannelContext] = None, **kwargs):
     """Call a function with a channel object.
 
+    If the protocol definitions were loaded from the protoset cache and the
+    call fails because they do not match the dish's, they are loaded again
+    via reflection and the call is retried. Protocol definitions reflected
+    during a successful call to `DEFAULT_TARGET` are written to the cache.
+
     Args:
         function: Function to call with channel as first arg.
         args: Additional args to pass to function
         context (ChannelContext): Optionally provide a channel for (re)use.
             If not set, a new default channel will be used and then closed.
         kwargs: Additional keyword args to pass to function.
+
+    Raises:
+        ChannelUnavailableError: The call was not attempted, because previous
+            calls through the same context failed recently.
     """
     if context is None:
-        with grpc.insecure_channel("192.168.100.1:9200") as channel:
-            return function(channel, *args, **kwargs)
-
+        with grpc.insecure_channel(DEFAULT_TARGET) as channel:
+            try:
+                result = function(channel, *args, **kwargs)
+            except (grpc.RpcError, AttributeError, ValueError) as e:
+                if not is_protocol_mismatch(e):
+                    raise
+                reload_imports(channel, DEFAULT_TARGET)
+                result = function(channel, *args, **kwargs)
+            if _reflected_channel is not None:
+                _save_reflected_protoset(channel, DEFAULT_TARGET)
+            return result
+
+    name = _rpc_name(function)
+    reloaded = False
     while True:
+        try:
+            context.check_available()
+        except ChannelUnavailableError:
+            context.stats.observe(name, 0.0, "UNREACHABLE")
+            raise
         channel, reused = context.get_channel()
+        start = time.monotonic()
         try:
-            return function(channel, *args, **kwargs)
-        except grpc.RpcError:
-            context.close()
-            if not reused:
+            result = function(channel, *args, **kwargs)
+        except grpc.RpcError as e:
+            code = e.code() if isinstance(e, grpc.Call) else None
+            context.stats.observe(name,
+                                  time.monotonic() - start,
+                                  code.name if code is not None else "UNKNOWN")
+            if code is not None and code not in TRANSPORT_ERROR_CODES:
+                # The dish answered, with an error for this request only
+                context.record_success()
+                if not reloaded and is_protocol_mismatch(e):
+                    reload_imports(channel, context.target)
+                    reloaded = True
+                    continue
+                raise
+            if reused and not context.failures:
+                # The connection may have been lost and restored since this
+                # channel was last used, so retry once on a new one.
+                context.close()
+                continue
+            context.record_failure()
+            raise
+        except (AttributeError, ValueError) as e:
+            if reloaded or not is_protocol_mismatch(e):
                 raise
+            reload_imports(channel, context.target)
+            reloaded = True
+            continue
+        context.stats.observe(name, time.monotonic() - start)
+        context.record_success()
+        if _reflected_channel is not None:
+            _save_reflected_protoset(channel, context.target)
+        return result
+
+
+HANDLE_METHOD = "/SpaceX.API.Device.Device/Handle"
+
+
+class StreamError(grpc.RpcError):
+    """A request sent over a `StreamContext` failed or got no response."""
+    def __init__(self, msg: str) -> None:
+        super().__init__(msg)
+        self.msg = msg
+
+    def __str__(self) -> str:
+        return self.msg
+
+
+class _StreamRequest:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response = None
+        self.error: Optional[Exception] = None
+
+
+class _StreamChannel:
+    """Channel proxy that sends Device/Handle calls over a Device/Stream call.
+
+    Stubs created on this object route Handle requests through the owning
+    `StreamContext`. Everything else, including reflection, goes to the
+    underlying channel.
+    """
+    def __init__(self, context: "StreamContext", channel: grpc.Channel) -> None:
+        self._context = context
+        self._channel = channel
+
+    def unary_unary(self, method, *args, **kwargs):
+        if method == HANDLE_METHOD:
+            return self._context.handle
+        return self._channel.unary_unary(method, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+class _Stream:
+    def __init__(self, call, outgoing: queue.Queue) -> None:
+        self.call = call
+        self.outgoing = outgoing
+        self.pending: Dict[int, _StreamRequest] = {}
+
+
+class StreamContext(ChannelContext):
+    """A ChannelContext that multiplexes requests over one Device/Stream call.
+
+    Instead of a unary Handle call per request, every request made through
+    this context is tagged with a request ID and written to a single
+    long-lived bidirectional stream, and responses are matched back to their
+    requests by ID. Functions in this module accept it anywhere a
+    ChannelContext is accepted, and it may be shared between threads.
+
+    The stream is opened on first use and reopened after it fails. `close()`
+    should be called on the object when it is no longer in use.
+    """
+    def __init__(self, target: Optional[str] = None) -> None:
+        super().__init__(target)
+        self._proxy = None
+        self._lock = threading.Lock()
+        self._stream: Optional[_Stream] = None
+        self._ids = count(1)
+
+    def get_channel(self) -> Tuple[grpc.Channel, bool]:
+        channel, reused = super().get_channel()
+        if self._proxy is None:
+            self._proxy = _StreamChannel(self, channel)
+        return self._proxy, reused
+
+    @staticmethod
+    def _requests(outgoing: queue.Queue):
+        while True:
+            message = outgoing.get()
+            if message is None:
+                return
+            yield message
+
+    def _read(self, stream: _Stream) -> None:
+        error: Exception = StreamError("Stream closed by device")
+        try:
+            for message in stream.call:
+                if not message.HasField("response"):
+                    continue
+                with self._lock:
+                    request = stream.pending.pop(message.response.id, None)
+                if request is not None:
+                    request.response = message.response
+                    request.done.set()
+        except grpc.RpcError as e:
+            error = e
+        with self._lock:
+            if self._stream is stream:
+                self._stream = None
+            pending = list(stream.pending.values())
+            stream.pending.clear()
+        stream.outgoing.put(None)
+        for request in pending:
+            request.error = error
+            request.done.set()
+
+    def _open_stream(self) -> _Stream:
+        # Caller must hold self._lock
+        if self._stream is None:
+            channel, _ = super().get_channel()
+            stub = device_pb2_grpc.DeviceStub(channel)
+            outgoing: queue.Queue = queue.Queue()
+            self._stream = _Stream(stub.Stream(self._requests(outgoing)), outgoing)
+            threading.Thread(target=self._read,
+                             args=(self._stream,),
+                             name="starlink-stream-reader",
+                             daemon=True).start()
+        return self._stream
+
+    def handle(self, request, timeout: Optional[float] = REQUEST_TIMEOUT, **kwargs):
+        """Send a Request over the stream and wait for its Response.
+
+        This has the same signature as the Handle method of a Device stub.
+
+        Raises:
+            grpc.RpcError: The stream failed, or no response arrived within
+                `timeout` seconds.
+        """
+        pending = _StreamRequest()
+        with self._lock:
+            stream = self._open_stream()
+            request.id = next(self._ids)
+            stream.pending[request.id] = pending
+        stream.outgoing.put(device_pb2.ToDevice(request=request))
+
+        if not pending.done.wait(timeout):
+            with self._lock:
+                stream.pending.pop(request.id, None)
+            raise StreamError("Timed out waiting for stream response")
+        if pending.error is not None:
+            raise pending.error
+        return pending.response
+
+    def close(self) -> None:
+        with self._lock:
+            stream = self._stream
+            self._stream = None
+        if stream is not None:
+            stream.outgoing.put(None)
+            stream.call.cancel()
+        self._proxy = None
+        super().close()
+
+
+# Response log format: a magic line, then records of a header with the
+# time.time_ns() times the request was sent and the response arrived, the
+# record kind and payload length, followed by the payload. The first record
+# holds the protoset needed to parse the rest.
+LOG_MAGIC = b"starlink-grpc-log 2\n"
+LOG_PROTOSET = 0
+LOG_RESPONSE = 1
+_LOG_HEADER = struct.Struct("<qqBI")
+
+
+def read_response_log(path: str) -> Iterable[Tuple[int, int, int, bytes]]:
+    """Read a response log written by a `RecordingContext`.
+
+    Yields:
+        (kind, sent_ns, received_ns, payload) tuples, where kind is
+        LOG_PROTOSET or LOG_RESPONSE, and the times are time.time_ns() values.
+        A truncated final record, as left by an interrupted writer, is
+        ignored.
+    """
+    with open(path, "rb") as infile:
+        if infile.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError("Not a response log: " + path)
+        while True:
+            header = infile.read(_LOG_HEADER.size)
+            if len(header) < _LOG_HEADER.size:
+                return
+            sent, received, kind, length = _LOG_HEADER.unpack(header)
+            payload = infile.read(length)
+            if len(payload) < length:
+                return
+            yield kind, sent, received, payload
+
+
+class _RecordingChannel:
+    """Channel proxy that logs the raw bytes of every Device/Handle response."""
+    def __init__(self, context: "RecordingContext", channel: grpc.Channel) -> None:
+        self._context = context
+        self._channel = channel
+
+    def unary_unary(self, method, request_serializer=None, response_deserializer=None, **kwargs):
+        if method != HANDLE_METHOD:
+            return self._channel.unary_unary(method,
+                                             request_serializer=request_serializer,
+                                             response_deserializer=response_deserializer,
+                                             **kwargs)
+        call = self._channel.unary_unary(method, request_serializer=request_serializer, **kwargs)
+
+        def handle(request, *args, **kwargs):
+            sent = time.time_ns()
+            raw = call(request, *args, **kwargs)
+            self._context.record(raw, sent)
+            return response_deserializer(raw) if response_deserializer else raw
+
+        return handle
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+class RecordingContext(ChannelContext):
+    """A ChannelContext that appends every response it gets to a log file.
+
+    Responses are logged as the serialized bytes received, with the
+    time.time_ns() times their request was sent and they arrived at, so they
+    can be played back later with `ReplayContext`. Several contexts, including ones in other processes,
+    can append to the same file, since each record is written with a single
+    write in append mode.
+
+    Raises:
+        ValueError: `path` is a log in another format.
+    """
+    def __init__(self, path: str, target: Optional[str] = None) -> None:
+        super().__init__(target)
+        try:
+            with open(path, "rb") as infile:
+                magic = infile.read(len(LOG_MAGIC))
+        except FileNotFoundError:
+            magic = b""
+        if len(magic) == len(LOG_MAGIC) and magic != LOG_MAGIC:
+            raise ValueError("Cannot append to a response log in another format: " + path)
+        self.path = path
+        self._proxy = None
+        self._started = False
+
+    def get_channel(self) -> Tuple[grpc.Channel, bool]:
+        channel, reused = super().get_channel()
+        if self._proxy is None or not reused:
+            self._proxy = _RecordingChannel(self, channel)
+        return self._proxy, reused
+
+    def _write(self, kind: int, payload: bytes, sent: int, prefix: bytes = b"") -> None:
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, prefix + _LOG_HEADER.pack(sent, time.time_ns(), kind, len(payload)) + payload)
+        finally:
+            os.close(fd)
+
+    def record(self, raw: bytes, sent: Optional[int] = None) -> None:
+        """Append a serialized Response to the log.
+
+        Args:
+            raw (bytes): The serialized Response.
+            sent (int): time.time_ns() time the request was sent, by default
+                now.
+        """
+        if sent is None:
+            sent = time.time_ns()
+        if not self._started:
+            # The protocol is known by now, since a response was parsed
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                pass
+            else:
+                os.close(fd)
+                self._write(LOG_PROTOSET, _loaded_protoset(), sent, prefix=LOG_MAGIC)
+            self._started = True
+        self._write(LOG_RESPONSE, raw, sent)
+
+    def close(self) -> None:
+        self._proxy = None
+        super().close()
+
+
+class ReplayFinished(grpc.RpcError):
+    """A `ReplayContext` has no more recorded responses of the type requested."""
+    def __str__(self) -> str:
+        return "End of recorded responses"
+
+
+class _ReplayChannel:
+    def __init__(self, context: "ReplayContext") -> None:
+        self._context = context
+
+    def unary_unary(self, method, request_serializer=None, response_deserializer=None, **kwargs):
+        if method != HANDLE_METHOD:
+            return self._unsupported(method)
+
+        def handle(request, *args, **kwargs):
+            raw = self._context.next_response(request.WhichOneof("request"))
+            return response_deserializer(raw) if response_deserializer else raw
+
+        return handle
+
+    def _unsupported(self, method, *args, **kwargs):
+        def call(*args, **kwargs):
+            raise ValueError("Only Device/Handle calls can be replayed, not " + method)
+
+        return call
+
+    unary_stream = stream_unary = stream_stream = _unsupported
+
+
+class ReplayClock:
+    """Time as it was when a replayed log was recorded.
+
+    Has the time(), monotonic() and sleep() functions of the time module, so
+    code that paces itself can take it in place of the module and run on the
+    recorded timeline. Each thread has its own view of the clock. It starts
+    at the send time of the first recorded request, and moves forward by
+    every sleep and through every request the thread makes: to the time the
+    request was sent, then to the time its response arrived. A sleep takes
+    1 / speed as long in real time, or no time at speed 0.
+    """
+    def __init__(self, context: "ReplayContext") -> None:
+        self._context = context
+        self._local = threading.local()
+
+    def time(self) -> float:
+        return getattr(self._local, "now", self._context.start_time)
+
+    monotonic = time
+
+    def advance(self, timestamp: float) -> None:
+        """Move this thread's clock forward to `timestamp`, if it is behind."""
+        self._local.now = max(self.time(), timestamp)
+
+    def sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        if self._context.speed > 0:
+            time.sleep(seconds / self._context.speed)
+        self._local.now = self.time() + seconds
+
+
+class ReplayContext(ChannelContext):
+    """A ChannelContext that answers requests from a recorded response log.
+
+    Each request gets the next recorded response of the matching type, so
+    every consumer of a replay sees the same sequence of responses no matter
+    how often it polls. A replay should therefore use one context for all
+    its consumers. The log timing is reproduced, scaled by `speed`: a
+    response is not returned before the time it arrived at, counted from
+    the first request. `clock` follows the recorded wall clock time. No dish
+    is needed; the protocol definitions are loaded from the log.
+
+    Args:
+        path (str): Log file written by `RecordingContext`.
+        speed (float): Replay speed, 1.0 for real time, 0 to return every
+            response immediately.
+    """
+    def __init__(self, path: str, speed: float = 1.0) -> None:
+        global imports_pending
+        super().__init__("replay:" + path)
+        self.speed = speed
+        self.finished = False
+        self._lock = threading.Lock()
+        self._responses: Dict[str, List[Tuple[int, int, bytes]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._log_start: Optional[int] = None
+        self._replay_start: Optional[float] = None
+
+        records = []
+        for kind, sent, received, payload in read_response_log(path):
+            if kind == LOG_PROTOSET:
+                if imports_pending:
+                    importer.resolve_lazy_imports(_ProtosetChannel(payload))
+                    imports_pending = False
+            elif kind == LOG_RESPONSE:
+                records.append((sent, received, payload))
+        for sent, received, payload in records:
+            name = device_pb2.Response.FromString(payload).WhichOneof("response")
+            self._responses.setdefault(name, []).append((sent, received, payload))
+        if records:
+            self._log_start = records[0][1]
+            self.start_time = records[0][0] / 1e9
+        else:
+            self.start_time = time.time()
+        self.clock = ReplayClock(self)
+        self._proxy = _ReplayChannel(self)
+
+    def get_channel(self) -> Tuple[grpc.Channel, bool]:
+        # There is no connection to retry
+        return self._proxy, False
+
+    def check_available(self) -> None:
+        # Keep raising ReplayFinished rather than failing fast
+        pass
+
+    def next_response(self, request_name: str) -> bytes:
+        """Return the next recorded response for a request, once it is due.
+
+        Moves the calling thread's `clock` through the recorded request.
+        """
+        name = request_name if request_name in self._responses else "dish_" + request_name
+        with self._lock:
+            if self._replay_start is None:
+                self._replay_start = time.monotonic()
+            cursor = self._cursors.get(name, 0)
+            responses = self._responses.get(name, [])
+            if cursor >= len(responses):
+                self.finished = True
+                raise ReplayFinished()
+            self._cursors[name] = cursor + 1
+        sent, received, payload = responses[cursor]
+        self.clock.advance(sent / 1e9)
+        if self.speed > 0:
+            due = self._replay_start + (received - self._log_start) / 1e9 / self.speed
+            remaining = due - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        self.clock.advance(received / 1e9)
+        return payload
+
+    def close(self) -> None:
+        # Shared by every consumer of the replay, so it stays usable
+        pass
 
 
 def status_field_names(context: Optional[ChannelContext] = None):
@@ -754,12 +1622,15 @@ def get_id(context: Optional[ChannelContext] = None) -> str:
 
 
 def status_data(
-        context: Optional[ChannelContext] = None) -> Tuple[StatusDict, ObstructionDict, AlertDict]:
+        context: Optional[ChannelContext] = None,
+        status=None) -> Tuple[StatusDict, ObstructionDict, AlertDict]:
     """Fetch current status data.
 
     Args:
         context (ChannelContext): Optionally provide a channel for reuse
             across repeated calls.
+        status: Optionally provide the status data to use instead of fetching
+            it, from a prior call to `get_status`.
 
     Returns:
         A tuple with 3 dicts, mapping status data field names, obstruction
@@ -769,10 +1640,11 @@ def status_data(
     Raises:
         GrpcError: Failed getting status info from the Starlink user terminal.
     """
-    try:
-        status = get_status(context)
-    except (AttributeError, ValueError, grpc.RpcError) as e:
-        raise GrpcError(e) from e
+    if status is None:
+        try:
+            status = get_status(context)
+        except (AttributeError, ValueError, grpc.RpcError) as e:
+            raise GrpcError(e) from e
 
     try:
         if status.HasField("outage"):
@@ -1536,6 +2408,83 @@ def get_obstruction_map(context: Optional[ChannelContext] = None):
     return call_with_channel(grpc_call, context=context)
 
 
+def obstruction_map_array(context: Optional[ChannelContext] = None) -> "np.ndarray":
+    """Fetch current obstruction map data as an array.
+
+    The array is filled in a single pass over the SNR data, without building
+    intermediate row sequences.
+
+    Args:
+        context (ChannelContext): Optionally provide a channel for reuse
+            across repeated calls.
+
+    Returns:
+        A float32 array of shape (num_rows, num_cols), holding SNR info per
+        direction in the range of 0.0 to 1.0 for valid data and -1.0 for
+        invalid data. See `obstruction_map_mask` and
+        `obstruction_map_valid_mask` to convert it.
+
+    Raises:
+        GrpcError: Failed getting obstruction data from the Starlink user
+            terminal.
+    """
+    try:
+        map_data = get_obstruction_map(context)
+    except (AttributeError, ValueError, grpc.RpcError) as e:
+        raise GrpcError(e) from e
+
+    # Imported on use, numpy would otherwise make up a large part of the
+    # import time of this module for scripts that do not need it
+    import numpy as np
+
+    try:
+        rows = map_data.num_rows
+        cols = map_data.num_cols
+        snr = np.fromiter(map_data.snr, dtype=np.float32, count=rows * cols)
+        return snr.reshape(rows, cols)
+    except (AttributeError, IndexError, TypeError, ValueError) as e:
+        raise GrpcError(e) from e
+
+
+def obstruction_map_mask(snr: "np.ndarray",
+                         threshold: float = 1.0,
+                         out: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """Convert obstruction map SNR data to a binary map.
+
+    Args:
+        snr: Array returned by `obstruction_map_array`.
+        threshold (float): Minimum SNR value to map to 1. Invalid data (-1.0)
+            always maps to 0. The default is the same as truncating the SNR
+            values to integers.
+        out: Optionally provide a uint8 array of the same shape, for example
+            from a prior call, to fill instead of allocating a new one.
+
+    Returns:
+        A uint8 array with 1 where SNR is at least `threshold` and 0
+        elsewhere.
+    """
+    import numpy as np
+
+    if out is None:
+        out = np.empty(snr.shape, dtype=np.uint8)
+    np.greater_equal(snr, threshold, out=out, casting="unsafe")
+    return out
+
+
+def obstruction_map_valid_mask(snr: "np.ndarray",
+                               out: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """Return a boolean map of the directions with valid SNR data.
+
+    Args:
+        snr: Array returned by `obstruction_map_array`.
+        out: Optionally provide a bool array of the same shape to fill
+            instead of allocating a new one.
+    """
+    import numpy as np
+
+    return np.greater_equal(snr, 0.0, out=out)
+
+
 def obstruction_map(context: Optional[ChannelContext] = None):
     """Fetch current obstruction map data.
 
@@ -1544,10 +2493,11 @@ def obstruction_map(context: Optional[ChannelContext] = None):
             across repeated calls.
 
     Returns:
-        A tuple of row data, each of which is a tuple of column data, which
+        A tuple of row data, each of which is a sequence of column data, which
         hold floats indicating SNR info per direction in the range of 0.0 to
         1.0 for valid data and -1.0 for invalid data. To get a flat
-        representation the SNR data instead, see `get_obstruction_map`.
+        representation the SNR data instead, see `get_obstruction_map`, or
+        see `obstruction_map_array` for an array of the same data.
 
     Raises:
         GrpcError: Failed getting obstruction data from the Starlink user
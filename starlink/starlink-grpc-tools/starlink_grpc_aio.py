@@ -0,0 +1,214 @@
+"""Asyncio versions of the starlink_grpc data functions.
+
+This module mirrors the data fetching functions of `starlink_grpc` as
+coroutines running on `grpc.aio`, so independent requests can run
+concurrently on one event loop instead of in separate threads:
+
+    async with AsyncChannelContext() as context:
+        status, history = await asyncio.gather(get_status(context),
+                                               get_history(context))
+
+Only the RPCs are asynchronous. The data returned is the same as that of the
+`starlink_grpc` function of the same name, and parsing is done by the same
+code, so see that module for details on the returned data.
+
+Note:
+    The first call needs to load the protocol definitions via gRPC
+    reflection, which is only available as a blocking API. That is done once,
+    in a worker thread, so the event loop is not blocked. The same goes for
+    reloading them when the ones from the protoset cache turn out not to
+    match the dish's.
+"""
+
+import asyncio
+from typing import Optional, Tuple
+
+import grpc
+import grpc.aio
+
+import starlink_grpc
+from starlink_grpc import DEFAULT_TARGET, GrpcError, REQUEST_TIMEOUT
+
+
+class AsyncChannelContext:
+    """A wrapper for reusing an open grpc.aio Channel across calls.
+
+    `close()` should be awaited when the object is no longer in use, or the
+    object can be used as an async context manager.
+    """
+    def __init__(self, target: Optional[str] = None) -> None:
+        self.channel = None
+        self.target = DEFAULT_TARGET if target is None else target
+
+    def get_channel(self) -> Tuple[grpc.aio.Channel, bool]:
+        reused = True
+        if self.channel is None:
+            self.channel = grpc.aio.insecure_channel(self.target)
+            reused = False
+        return self.channel, reused
+
+    async def close(self) -> None:
+        if self.channel is not None:
+            await self.channel.close()
+        self.channel = None
+
+    async def __aenter__(self) -> "AsyncChannelContext":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+async def _resolve_imports(target: str, reload: bool = False) -> None:
+    # No asyncio lock here: it would be bound to the event loop that first
+    # used it. starlink_grpc serializes both under a threading lock instead,
+    # and they return early once another call, on any loop, has done the work.
+    def resolve():
+        with grpc.insecure_channel(target) as channel:
+            if reload:
+                starlink_grpc.reload_imports(channel, target)
+            else:
+                starlink_grpc.resolve_imports(channel, target)
+
+    await asyncio.get_running_loop().run_in_executor(None, resolve)
+
+
+async def call_with_channel(function, *args, context: Optional[AsyncChannelContext] = None, **kwargs):
+    """Await a coroutine function with a channel object.
+
+    This is the async equivalent of `starlink_grpc.call_with_channel`.
+
+    Args:
+        function: Coroutine function to call with channel as first arg.
+        args: Additional args to pass to function
+        context (AsyncChannelContext): Optionally provide a channel for
+            (re)use. If not set, a new default channel will be used and then
+            closed.
+        kwargs: Additional keyword args to pass to function.
+    """
+    target = DEFAULT_TARGET if context is None else context.target
+    if starlink_grpc.imports_pending:
+        await _resolve_imports(target)
+
+    if context is None:
+        async with grpc.aio.insecure_channel(target) as channel:
+            try:
+                return await function(channel, *args, **kwargs)
+            except (grpc.RpcError, AttributeError, ValueError) as e:
+                if not starlink_grpc.is_protocol_mismatch(e):
+                    raise
+            await _resolve_imports(target, reload=True)
+            return await function(channel, *args, **kwargs)
+
+    reloaded = False
+    while True:
+        channel, reused = context.get_channel()
+        try:
+            return await function(channel, *args, **kwargs)
+        except (AttributeError, ValueError) as e:
+            if reloaded or not starlink_grpc.is_protocol_mismatch(e):
+                raise
+        except grpc.RpcError as e:
+            if reloaded or not starlink_grpc.is_protocol_mismatch(e):
+                await context.close()
+                if not reused:
+                    raise
+                continue
+        await _resolve_imports(target, reload=True)
+        reloaded = True
+
+
+async def _handle(context: Optional[AsyncChannelContext], **request):
+    async def grpc_call(channel: grpc.aio.Channel):
+        stub = starlink_grpc.device_pb2_grpc.DeviceStub(channel)
+        return await stub.Handle(starlink_grpc.device_pb2.Request(**request),
+                                 timeout=REQUEST_TIMEOUT)
+
+    return await call_with_channel(grpc_call, context=context)
+
+
+async def get_status(context: Optional[AsyncChannelContext] = None):
+    """Fetch status data and return it in grpc structure format.
+
+    See `starlink_grpc.get_status`.
+    """
+    response = await _handle(context, get_status={})
+    return response.dish_get_status
+
+
+async def get_history(context: Optional[AsyncChannelContext] = None):
+    """Fetch history data and return it in grpc structure format.
+
+    See `starlink_grpc.get_history`.
+    """
+    response = await _handle(context, get_history={})
+    return response.dish_get_history
+
+
+async def get_obstruction_map(context: Optional[AsyncChannelContext] = None):
+    """Fetch obstruction map data and return it in grpc structure format.
+
+    See `starlink_grpc.get_obstruction_map`.
+    """
+    response = await _handle(context, dish_get_obstruction_map={})
+    return response.dish_get_obstruction_map
+
+
+async def status_data(context: Optional[AsyncChannelContext] = None):
+    """Fetch current status data.
+
+    See `starlink_grpc.status_data`.
+
+    Raises:
+        GrpcError: Failed getting status info from the Starlink user terminal.
+    """
+    try:
+        status = await get_status(context)
+    except (AttributeError, ValueError, grpc.RpcError) as e:
+        raise GrpcError(e) from e
+    return starlink_grpc.status_data(status=status)
+
+
+async def _history(context: Optional[AsyncChannelContext]):
+    try:
+        return await get_history(context)
+    except (AttributeError, ValueError, grpc.RpcError) as e:
+        raise GrpcError(e) from e
+
+
+async def history_bulk_data(parse_samples: int,
+                            start: Optional[int] = None,
+                            verbose: bool = False,
+                            context: Optional[AsyncChannelContext] = None):
+    """Fetch history data for a range of samples.
+
+    See `starlink_grpc.history_bulk_data`.
+
+    Raises:
+        GrpcError: Failed getting history info from the Starlink user
+            terminal.
+    """
+    history = await _history(context)
+    return starlink_grpc.history_bulk_data(parse_samples,
+                                           start=start,
+                                           verbose=verbose,
+                                           history=history)
+
+
+async def history_stats(parse_samples: int,
+                        start: Optional[int] = None,
+                        verbose: bool = False,
+                        context: Optional[AsyncChannelContext] = None):
+    """Fetch, parse, and compute ping and usage stats.
+
+    See `starlink_grpc.history_stats`.
+
+    Raises:
+        GrpcError: Failed getting history info from the Starlink user
+            terminal.
+    """
+    history = await _history(context)
+    return starlink_grpc.history_stats(parse_samples,
+                                       start=start,
+                                       verbose=verbose,
+                                       history=history)
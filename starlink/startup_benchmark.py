@@ -0,0 +1,130 @@
+# flake8: noqa: E501
+"""Import time budgets for the collector and CLI entry points.
+
+Imports each entry point module in a fresh interpreter under
+`python -X importtime`, and compares the cumulative import time of the
+module, best of several runs, against its budget. The exit status is 1 if
+any entry point is over budget, with its slowest imports listed, so heavy
+dependencies creeping back into module level imports are caught.
+
+Budgets are in milliseconds on a typical x86-64 machine with warm bytecode
+caches. Use --scale on slower machines, e.g. --scale 3 on a Raspberry Pi.
+Entry points whose optional dependencies are not installed are skipped.
+
+Example:
+    python startup_benchmark.py
+    python startup_benchmark.py --only main dish_grpc_text --repeat 10
+"""
+
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+TOOLS = HERE.joinpath("starlink-grpc-tools")
+
+# name: (directory, module, budget in ms)
+ENTRY_POINTS = {
+    "main": (HERE, "main", 150),
+    "profiler": (HERE, "profiler", 100),
+    "backfill": (HERE, "backfill", 1000),
+    "plot": (HERE, "plot", 1000),
+    "dish_grpc_text": (TOOLS, "dish_grpc_text", 200),
+    "dish_grpc_prometheus": (TOOLS, "dish_grpc_prometheus", 250),
+    "dish_grpc_sqlite": (TOOLS, "dish_grpc_sqlite", 250),
+    "dish_grpc_influx2": (TOOLS, "dish_grpc_influx2", 400),
+    "dish_grpc_mqtt": (TOOLS, "dish_grpc_mqtt", 300),
+    "dish_control": (TOOLS, "dish_control", 200),
+}
+
+
+class MissingDependency(Exception):
+    pass
+
+
+def parse_importtime(output):
+    """Return a list of (depth, cumulative us, module) from -X importtime output."""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, int(cumulative), name.strip()))
+    return entries
+
+
+def import_time(directory, module):
+    """Import `module` once in a new interpreter and return its import entries."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=directory,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        if "ModuleNotFoundError" in result.stderr:
+            raise MissingDependency(result.stderr.strip().splitlines()[-1])
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    return parse_importtime(result.stderr)
+
+
+def measure(directory, module, repeat):
+    """Return the best cumulative import time of `module` in ms, and the entries of that run."""
+    import_time(directory, module)  # warm up the bytecode cache
+    best = None
+    for _ in range(repeat):
+        entries = import_time(directory, module)
+        total = next(us for depth, us, name in entries if depth == 0 and name == module)
+        if best is None or total < best[0]:
+            best = (total, entries)
+    return best[0] / 1000, best[1]
+
+
+def slowest_imports(entries, module, count=8):
+    """Direct dependencies of `module` from the entries, slowest first."""
+    # Children are listed before their parent, one level deeper
+    children = []
+    for depth, us, name in reversed(entries):
+        if depth == 0 and name != module and children:
+            break
+        if depth == 1:
+            children.append((us / 1000, name))
+    return sorted(children, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LEOViz | Import time budgets of the entry points")
+
+    parser.add_argument("--only", nargs="+", choices=sorted(ENTRY_POINTS), help="Entry points to measure")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per entry point, the best one is reported")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply all budgets by this factor")
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'entry point':<24} {'import ms':>10} {'budget ms':>10}")
+    for name in args.only or ENTRY_POINTS:
+        directory, module, budget = ENTRY_POINTS[name]
+        budget *= args.scale
+        try:
+            elapsed, entries = measure(directory, module, args.repeat)
+        except MissingDependency as e:
+            print(f"{name:<24} {'skipped':>10} {budget:>10.0f}  {e}")
+            continue
+        status = "" if elapsed <= budget else "  OVER BUDGET"
+        print(f"{name:<24} {elapsed:>10.1f} {budget:>10.0f}{status}")
+        if status:
+            over_budget.append(name)
+            for ms, dependency in slowest_imports(entries, module):
+                print(f"    {dependency:<36} {ms:>8.1f} ms")
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
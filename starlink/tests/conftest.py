@@ -0,0 +1,18 @@
+# flake8: noqa: E501
+import os
+import sys
+from pathlib import Path
+
+STARLINK_DIR = Path(__file__).resolve().parent.parent
+
+# Tests never read or write the user's protoset cache
+os.environ.setdefault("STARLINK_GRPC_PROTOSET_DIR", "")
+
+sys.path.insert(0, str(STARLINK_DIR.joinpath("starlink-grpc-tools")))
+sys.path.insert(0, str(STARLINK_DIR))
+
+
+def pytest_configure(config):
+    # An exception in a background thread, e.g. the stream reader, the trace
+    # writer or the scheduler, fails the test it happened in
+    config.addinivalue_line("filterwarnings", "error::pytest.PytestUnhandledThreadExceptionWarning")
@@ -0,0 +1,98 @@
+# flake8: noqa: E501
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import assets
+import metrics
+
+
+class AssetServer:
+    """Local HTTP stand-in serving one asset with an ETag."""
+
+    def __init__(self):
+        self.content = b"version 1"
+        self.etag = '"v1"'
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                if self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.send_header("ETag", server.etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", server.etag)
+                self.send_header("Content-Length", str(len(server.content)))
+                self.end_headers()
+                self.wfile.write(server.content)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/asset"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = AssetServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with httpx.Client(timeout=5) as client:
+        yield assets.AssetCache(tmp_path, client=client)
+
+
+def count(name, result):
+    return metrics.counter("asset_requests_total", "", {"asset": name, "result": result}).value
+
+
+def test_download_hit_and_revalidation(server, cache, request):
+    name = request.node.name
+    assert cache.fetch(server.url, ttl=3600, name=name) == b"version 1"
+    assert count(name, "miss") == 1
+    assert cache.fetch(server.url, ttl=3600, name=name) == b"version 1"
+    assert count(name, "hit") == 1
+    assert len(server.requests) == 1
+
+    # Expired: revalidated with the ETag, and not downloaded again
+    assert cache.fetch(server.url, ttl=0, name=name) == b"version 1"
+    assert server.requests[-1]["If-None-Match"] == '"v1"'
+    assert count(name, "revalidated") == 1
+
+    server.content, server.etag = b"version 2", '"v2"'
+    assert cache.fetch(server.url, ttl=0, name=name) == b"version 2"
+    assert count(name, "miss") == 2
+    assert cache.fetch_path(server.url, ttl=3600, name=name).read_bytes() == b"version 2"
+
+
+def test_stale_copy_served_offline(server, cache, request):
+    name = request.node.name
+    cache.fetch(server.url, ttl=3600, name=name)
+    server.stop()
+    assert cache.fetch(server.url, ttl=0, name=name) == b"version 1"
+    assert count(name, "stale") == 1
+
+
+def test_unavailable_without_cached_copy(server, cache, request):
+    name = request.node.name
+    url = server.url
+    server.stop()
+    with pytest.raises(assets.AssetUnavailable):
+        cache.fetch(url, ttl=3600, name=name)
+    assert count(name, "error") == 1
+    assert not cache.paths(url, name)[0].exists()
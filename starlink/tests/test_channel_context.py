@@ -0,0 +1,110 @@
+# flake8: noqa: E501
+import threading
+import time
+
+import grpc
+import pytest
+
+import mock_dish
+import starlink_grpc
+
+
+class FakeCallError(grpc.RpcError, grpc.Call):
+    """An RpcError carrying a status code, like those raised by real calls."""
+
+    def __init__(self, code):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._code.name
+
+    def initial_metadata(self):
+        return None
+
+    def trailing_metadata(self):
+        return None
+
+    def is_active(self):
+        return False
+
+    def time_remaining(self):
+        return None
+
+    def cancel(self):
+        return False
+
+    def add_callback(self, callback):
+        return False
+
+
+def failing(code):
+    def get_location(channel):
+        raise FakeCallError(code)
+
+    return get_location
+
+
+def get_status(channel):
+    return "status"
+
+
+@pytest.fixture
+def context():
+    context = starlink_grpc.ChannelContext(target="127.0.0.1:1")
+    yield context
+    context.close()
+
+
+def test_application_error_does_not_trip_breaker(context):
+    for _ in range(3):
+        with pytest.raises(grpc.RpcError):
+            starlink_grpc.call_with_channel(failing(grpc.StatusCode.PERMISSION_DENIED), context=context)
+    assert context.failures == 0
+    assert starlink_grpc.call_with_channel(get_status, context=context) == "status"
+    assert context.stats.snapshot()["failing"]["errors"] == {"PERMISSION_DENIED": 3}
+
+
+@pytest.mark.parametrize("code", [grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED, None])
+def test_transport_error_trips_breaker(context, code):
+    function = failing(code) if code is not None else lambda channel: (_ for _ in ()).throw(grpc.RpcError())
+    with pytest.raises(grpc.RpcError):
+        starlink_grpc.call_with_channel(function, context=context)
+    assert context.failures == 1
+    with pytest.raises(starlink_grpc.ChannelUnavailableError):
+        starlink_grpc.call_with_channel(get_status, context=context)
+
+
+def test_concurrent_failures_are_counted(context):
+    threads = [threading.Thread(target=context.record_failure) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert context.failures == 50
+    context.record_success()
+    context.check_available()
+
+
+def test_closing_leaves_no_failing_threads(monkeypatch):
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+    try:
+        for _ in range(20):
+            live = starlink_grpc.ChannelContext(target=target)
+            starlink_grpc.get_status(live)
+            live.close()
+            # A failure used to start a connectivity watch that outlived the channel
+            unreachable = starlink_grpc.ChannelContext(target="127.0.0.1:1")
+            with pytest.raises(grpc.RpcError):
+                starlink_grpc.get_status(unreachable)
+            assert unreachable.connectivity == grpc.ChannelConnectivity.TRANSIENT_FAILURE
+            unreachable.close()
+        assert live.connectivity is None
+        time.sleep(1.0)
+    finally:
+        server.stop(None)
+    assert not errors
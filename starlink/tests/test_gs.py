@@ -0,0 +1,137 @@
+# flake8: noqa: E501
+import numpy as np
+import pandas as pd
+import pytest
+from skyfield.api import load, wgs84, EarthSatellite
+
+import gs
+from geo import haversine_km
+
+TLE = (
+    "1 00001U          25103.00000000  .00000000  00000-0  00000+0 0    04",
+    "2 00001  53.0000   0.0000 0001000   0.0000   0.0000 15.05491974    07",
+)
+DISH = (49.2827, -123.1207, 70.0)
+# The satellite culminates over the dish at about 2025-04-13 22:37:39 UTC
+CULMINATION = 1744583858.0
+POP_LOCATION = (50.0, -121.0)
+
+PLACEMARKS = [
+    ("Seattle", "Washington", 47.6, -122.3, 50.0),
+    ("Kamloops", "British Columbia", 50.7, -120.3, 400.0),
+    ("Boise", "Idaho", 43.6, -116.2, 800.0),
+    # Too far from the dish to be a candidate
+    ("Miami", "Florida", 25.8, -80.2, 0.0),
+]
+
+
+@pytest.fixture(scope="module")
+def satellite():
+    return EarthSatellite(*TLE, "STARLINK-1", load.timescale())
+
+
+def topocentric(satellite, timestamps, latitude, longitude, altitude):
+    """Elevations (degrees) and ranges (km) of the satellite from a place, by skyfield."""
+    t = load.timescale().from_datetimes(pd.to_datetime(timestamps, unit="s", utc=True).to_pydatetime())
+    elevation, _, distance = (satellite - wgs84.latlon(latitude, longitude, elevation_m=altitude)).at(t).altaz()
+    return elevation.degrees, distance.km
+
+
+def test_geometry_matches_skyfield(satellite):
+    timestamps = CULMINATION + np.arange(-120, 121, 10.0)
+    geometry = gs.bent_pipe_geometry(satellite, timestamps, *DISH, gs.GroundStationIndex(PLACEMARKS), POP_LOCATION)
+
+    _, dish_range = topocentric(satellite, timestamps, *DISH)
+    assert geometry["timestamp"].tolist() == timestamps.tolist()
+    assert (geometry["satellite"] == "STARLINK-1").all()
+    np.testing.assert_allclose(geometry["dish_range_km"], dish_range, rtol=0, atol=1e-9)
+
+    gateways = PLACEMARKS[:3]
+    elevations, ranges = np.array([topocentric(satellite, timestamps, *p[2:]) for p in gateways]).transpose(1, 2, 0)  # (T, G)
+    fiber_km = haversine_km(np.array([p[2] for p in gateways]), np.array([p[3] for p in gateways]), *POP_LOCATION)
+    visible = elevations >= gs.GATEWAY_MIN_ELEVATION
+    delay = np.where(visible, (dish_range[:, None] + ranges) / gs.SPEED_OF_LIGHT_KM_S + fiber_km / gs.FIBER_SPEED_KM_S, np.inf)
+    best = np.argmin(delay, axis=1)
+    rows = np.arange(len(timestamps))
+
+    assert visible.all(axis=1).any() and not visible.all()
+    assert geometry["visible_gateways"].tolist() == visible.sum(axis=1).tolist()
+    # Both Seattle and Kamloops serve part of the pass
+    assert set(geometry["gateway"]) == {"Seattle", "Kamloops"}
+    assert geometry["gateway"].tolist() == [gateways[i][0] for i in best]
+    np.testing.assert_allclose(geometry["gateway_range_km"], ranges[rows, best], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(geometry["gateway_elevation"], elevations[rows, best], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(geometry["fiber_km"], fiber_km[best], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(geometry["rtt_floor_ms"], 2000 * delay[rows, best], rtol=0, atol=1e-9)
+
+
+def test_no_visible_gateway(satellite):
+    # Below the horizon of every gateway, then only gateways out of reach
+    timestamps = np.array([CULMINATION - 3 * 3600, CULMINATION + 1800])
+    for placemarks in (PLACEMARKS, PLACEMARKS[3:]):
+        geometry = gs.bent_pipe_geometry(satellite, timestamps, *DISH, gs.GroundStationIndex(placemarks))
+        _, dish_range = topocentric(satellite, timestamps, *DISH)
+        np.testing.assert_allclose(geometry["dish_range_km"], dish_range, rtol=0, atol=1e-9)
+        assert geometry["visible_gateways"].tolist() == [0, 0]
+        assert geometry["gateway"].tolist() == ["", ""]
+        for column in ("gateway_range_km", "gateway_elevation", "fiber_km", "rtt_floor_ms"):
+            assert geometry[column].isna().all(), column
+
+
+def test_compare_rtt():
+    geometry = pd.DataFrame({"timestamp": [100.0, 101.0, 102.0], "rtt_floor_ms": [8.0, 9.0, np.nan]})
+    rtt = pd.DataFrame({
+        "timestamp": [99.5, 100.1, 100.4, 100.7, 101.2, 101.6, 102.3],
+        "rtt": [50.0, 31.0, 25.0, 40.0, np.nan, np.nan, 28.0],
+    })
+    result = gs.compare_rtt(geometry, rtt)
+    assert list(result.columns) == ["timestamp", "rtt_floor_ms", "measured_rtt_min_ms", "measured_rtt_median_ms", "replies", "excess_ms"]
+    assert result["measured_rtt_min_ms"].tolist()[::2] == [25.0, 28.0]
+    assert result["measured_rtt_median_ms"].tolist()[::2] == [31.0, 28.0]
+    # Lost probes are not replies
+    assert result["replies"].tolist() == [3, 0, 1]
+    assert np.isnan(result["measured_rtt_min_ms"][1])
+    assert result["excess_ms"][0] == 17.0
+    assert result["excess_ms"][1:].isna().all()
+
+
+KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>Starlink</name>
+    <Placemark>
+      <name> Loose </name>
+      <Point><coordinates>10.5,20.25</coordinates></Point>
+    </Placemark>
+    <Folder>
+      <name>Gateways </name>
+      <Placemark>
+        <name>Seattle</name>
+        <Point><coordinates>-122.3,47.6,50</coordinates></Point>
+      </Placemark>
+      <Placemark>
+        <name>Backhaul</name>
+        <LineString><coordinates>-122.3,47.6 -120.3,50.7</coordinates></LineString>
+      </Placemark>
+      <Folder>
+        <Placemark>
+          <Point><coordinates>-120.3,50.7,400</coordinates></Point>
+        </Placemark>
+      </Folder>
+    </Folder>
+  </Document>
+</kml>
+"""
+
+
+def test_parse_kml():
+    placemarks = gs.parse_kml(KML)
+    assert sorted(placemarks) == [
+        # An unnamed folder keeps the name of its parent
+        ("", "Gateways", 50.7, -120.3, 400.0),
+        ("Loose", "Starlink", 20.25, 10.5, 0.0),
+        ("Seattle", "Gateways", 47.6, -122.3, 50.0),
+    ]
+    index = gs.GroundStationIndex(placemarks)
+    assert index.names.tolist() == [p[0] for p in placemarks]
+    assert index.altitudes.tolist() == [p[4] for p in placemarks]
@@ -0,0 +1,76 @@
+# flake8: noqa: E501
+import numpy as np
+import pytest
+
+import kernels
+from satellites import calculate_total_difference, calculate_trajectory_distance_frame_ut
+
+
+@pytest.fixture(params=["0", "1"], ids=["numpy", "jit"])
+def backend(request, monkeypatch):
+    """Run a test with the NumPy kernels, then with the numba ones."""
+    if request.param == "1":
+        pytest.importorskip("numba")
+    monkeypatch.setattr(kernels, "USE_JIT", request.param)
+    monkeypatch.setattr(kernels, "_backend", None)
+    yield request.param
+    kernels._backend = None
+
+
+def trajectories(seed, candidates=200, points=5):
+    rng = np.random.default_rng(seed)
+    obs_alt = rng.uniform(20, 90, points)
+    obs_az = rng.uniform(-180, 540, points)
+    sat_alt = rng.uniform(20, 90, (candidates, points))
+    sat_az = rng.uniform(-180, 540, (candidates, points))
+    # Azimuths on both sides of north, and satellites that do not move
+    sat_az[0] = obs_az + 359.5
+    sat_alt[1], sat_az[1] = sat_alt[1, 0], sat_az[1, 0]
+    sat_alt[2], sat_az[2] = obs_alt, obs_az
+    return obs_alt, obs_az, sat_alt, sat_az
+
+
+def positions(alt, az):
+    return list(zip(alt.tolist(), az.tolist()))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_frame_earth_scores_match_scalar(backend, seed):
+    obs_alt, obs_az, sat_alt, sat_az = trajectories(seed)
+    expected = [calculate_total_difference(positions(obs_alt, obs_az), positions(alt, az)) for alt, az in zip(sat_alt, sat_az)]
+    np.testing.assert_array_equal(kernels.frame_earth_scores(obs_alt, obs_az, sat_alt, sat_az), expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_frame_ut_scores_match_scalar(backend, seed):
+    obs_alt, obs_az, sat_alt, sat_az = trajectories(seed)
+    expected = [calculate_trajectory_distance_frame_ut(positions(obs_alt, obs_az), positions(alt, az)) for alt, az in zip(sat_alt, sat_az)]
+    assert kernels.jit_enabled() == (backend == "1")
+    np.testing.assert_array_equal(kernels.frame_ut_scores(obs_alt, obs_az, sat_alt, sat_az), expected)
+
+
+def test_frame_ut_scores_stationary_observation(backend):
+    obs_alt, obs_az, sat_alt, sat_az = trajectories(0)
+    obs_alt[:], obs_az[:] = obs_alt[0], obs_az[0]
+    expected = [calculate_trajectory_distance_frame_ut(positions(obs_alt, obs_az), positions(alt, az)) for alt, az in zip(sat_alt, sat_az)]
+    np.testing.assert_array_equal(kernels.frame_ut_scores(obs_alt, obs_az, sat_alt, sat_az), expected)
+
+
+def last_changed_pixel_scalar(previous, frame):
+    """The newest pixel as the per-frame loop of the original obstruction scan found it."""
+    coords = np.argwhere(np.bitwise_xor(previous.reshape(123, 123), frame.reshape(123, 123)) == 1)
+    return -1 if coords.size == 0 else int(coords[-1][0] * 123 + coords[-1][1])
+
+
+def test_last_changed_pixels_match_scalar(backend):
+    rng = np.random.default_rng(1)
+    frames = np.zeros((60, 123 * 123), dtype=np.int64)
+    for n in range(1, len(frames)):
+        frames[n] = frames[n - 1]
+        # Some frames add no pixel, some add several
+        for pixel in rng.integers(0, 123 * 123, rng.integers(0, 3)):
+            frames[n, pixel] = 1
+    frames[-1, -1] = 1
+    expected = [-1] + [last_changed_pixel_scalar(frames[n - 1], frames[n]) for n in range(1, len(frames))]
+    np.testing.assert_array_equal(kernels.last_changed_pixels(frames), expected)
+    assert kernels.last_changed_pixels(frames[:1]).tolist() == [-1]
@@ -0,0 +1,102 @@
+# flake8: noqa: E501
+import asyncio
+import socket
+
+import numpy as np
+import pytest
+
+import latency
+from slots import slot_id
+
+
+def test_icmp_is_not_replaced_by_udp_echo(monkeypatch):
+    def no_icmp(family, kind, protocol=0):
+        if protocol in (socket.IPPROTO_ICMP, socket.IPPROTO_ICMPV6):
+            raise PermissionError(1, "Operation not permitted")
+        raise AssertionError("fell back to a UDP socket")
+
+    monkeypatch.setattr(latency.socket, "socket", no_icmp)
+    with pytest.raises(PermissionError, match="ping_group_range"):
+        latency.open_socket("127.0.0.1", "icmp", interface="")
+
+
+def test_unknown_probe_mode_is_rejected():
+    with pytest.raises(ValueError, match="auto"):
+        latency.open_socket("127.0.0.1", "auto", interface="")
+
+
+class LossyEcho(asyncio.DatagramProtocol):
+    """UDP echo service that drops the reply to every fifth probe."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.received = []
+
+    def datagram_received(self, data, addr):
+        index = latency.UDP_HEADER.unpack_from(data)[0]
+        self.received.append(index)
+        if index % 5 != 4:
+            self.transport.sendto(data, addr)
+
+
+def test_concurrent_targets_record_every_probe_in_send_order(tmp_path):
+    duration = 0.5
+    intervals = {"fast": 0.01, "slow": 0.025}
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        servers = {}
+        targets = []
+        for name, interval in intervals.items():
+            transport, protocol = await loop.create_datagram_endpoint(LossyEcho, local_addr=("127.0.0.1", 0))
+            servers[name] = (transport, protocol)
+            port = transport.get_extra_info("sockname")[1]
+            targets.append(latency.ProbeTarget(name, "127.0.0.1", interval, mode="udp", port=port, timeout=0.5, interface=""))
+        try:
+            summary = await latency.probe(targets, duration, tmp_path, "test", serving_satellite=lambda: (41, "STARLINK-7"))
+        finally:
+            for target in targets:
+                target.close()
+            for transport, _ in servers.values():
+                transport.close()
+        return summary, {name: protocol.received for name, (_, protocol) in servers.items()}
+
+    summary, received = asyncio.run(main())
+
+    for name, interval in intervals.items():
+        count = int(duration / interval)
+        path, sent, lost = summary[name]
+        assert path == f"{tmp_path}/ping-{name}-{round(interval * 1000)}ms-test.bin"
+        records = np.fromfile(path, dtype=latency.RECORD_FIELDS)
+        assert sent == len(records) == count
+        assert received[name] == list(range(count))
+
+        dropped = np.arange(count) % 5 == 4
+        assert lost == dropped.sum()
+        assert records["lost"].tolist() == dropped.astype(int).tolist()
+        assert np.isnan(records["rtt"][dropped]).all()
+        assert (records["rtt"][~dropped] >= 0).all()
+
+        # Written in send order, on the target's schedule
+        send_ts = records["send_ts"]
+        assert (np.diff(send_ts) > 0).all()
+        assert send_ts[-1] - send_ts[0] == pytest.approx((count - 1) * interval, abs=0.2)
+
+        assert records["slot"].tolist() == [slot_id(ts) for ts in send_ts]
+        assert (records["satellite_slot"] == 41).all()
+        assert (records["satellite"] == b"STARLINK-7").all()
+
+
+def test_configured_targets(monkeypatch):
+    monkeypatch.setattr(latency, "STARLINK_DEFAULT_GW", "100.64.0.1")
+    monkeypatch.setattr(latency, "INTERVAL_MS", "10ms")
+    monkeypatch.setattr(latency, "LATENCY_POP_TARGET", "")
+    monkeypatch.setattr(latency, "LATENCY_DNS_TARGET", "1.1.1.1")
+    monkeypatch.setattr(latency, "LATENCY_DNS_INTERVAL", "100ms")
+    monkeypatch.setattr(latency, "LATENCY_TARGETS", " google=8.8.8.8@100ms, ,v6=2001:db8::1@1s")
+    assert latency.configured_targets() == [
+        ("gateway", "100.64.0.1", 0.01),
+        ("dns", "1.1.1.1", 0.1),
+        ("google", "8.8.8.8", 0.1),
+        ("v6", "2001:db8::1", 1.0),
+    ]
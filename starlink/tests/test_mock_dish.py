@@ -0,0 +1,129 @@
+# flake8: noqa: E501
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import grpc
+import pytest
+
+import mock_dish
+import starlink_grpc
+import starlink_grpc_aio
+
+
+@pytest.fixture(scope="module")
+def dish():
+    server, target, state = mock_dish.start_server(bind="127.0.0.1:0")
+    yield target, state
+    server.stop(None)
+
+
+@pytest.fixture
+def stream(dish):
+    context = starlink_grpc.StreamContext(target=dish[0])
+    yield context
+    context.close()
+
+
+def test_unary_requests(dish):
+    context = starlink_grpc.ChannelContext(target=dish[0])
+    try:
+        assert starlink_grpc.get_status(context).device_info.id == "ut01000000-00000000-00000000"
+        snr = starlink_grpc.obstruction_map_array(context)
+        assert snr.shape == (mock_dish.MAP_SIZE, mock_dish.MAP_SIZE)
+    finally:
+        context.close()
+
+
+def test_obstruction_map_rows(dish, monkeypatch):
+    context = starlink_grpc.ChannelContext(target=dish[0])
+    try:
+        snr = starlink_grpc.obstruction_map_array(context)
+        assert [list(row) for row in starlink_grpc.obstruction_map(context)] == snr.tolist()
+    finally:
+        context.close()
+
+    # Without NumPy, a short snr field ends in a short row as it always did
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.setattr(starlink_grpc, "get_obstruction_map",
+                        lambda context=None: SimpleNamespace(num_rows=3, num_cols=2, snr=[1.0, 0.5, -1.0, 0.0, 1.0]))
+    assert starlink_grpc.obstruction_map() == ([1.0, 0.5], [-1.0, 0.0], [1.0])
+    with pytest.raises(ImportError):
+        starlink_grpc.obstruction_map_array()
+
+
+def test_async_requests_share_a_channel(dish):
+    async def main():
+        async with starlink_grpc_aio.AsyncChannelContext(dish[0]) as context:
+            results = await asyncio.gather(
+                starlink_grpc_aio.get_status(context),
+                starlink_grpc_aio.get_history(context),
+                starlink_grpc_aio.get_obstruction_map(context),
+            )
+            return results, context.channel
+
+    # Each asyncio.run is a new event loop, as when the collector restarts one
+    for _ in range(2):
+        (status, history, obstruction_map), channel = asyncio.run(main())
+        assert channel is not None
+        assert status.device_info.id == "ut01000000-00000000-00000000"
+        assert len(history.pop_ping_latency_ms) == mock_dish.HISTORY_SIZE
+        assert (obstruction_map.num_rows, obstruction_map.num_cols) == (mock_dish.MAP_SIZE, mock_dish.MAP_SIZE)
+
+
+def test_async_reloads_on_separate_loops(dish):
+    async def main():
+        # Nothing to reload, but they still wait for each other
+        await asyncio.gather(*(starlink_grpc_aio._resolve_imports(dish[0], reload=True) for _ in range(3)))
+
+    for _ in range(2):
+        asyncio.run(main())
+
+
+def test_stream_requests(stream):
+    status = starlink_grpc.get_status(stream)
+    assert status.alignment_stats.boresight_elevation_deg == 90.0
+    assert starlink_grpc.status_data(stream)[0]["state"] == "CONNECTED"
+    history = starlink_grpc.get_history(stream)
+    assert len(history.pop_ping_latency_ms) == mock_dish.HISTORY_SIZE
+    starlink_grpc.reset_obstruction_map(stream)
+    assert starlink_grpc.get_obstruction_map(stream).map_reference_frame == 1
+    # All of these went over the one Stream call
+    assert stream._stream is not None
+    assert not stream._stream.pending
+
+
+def test_stream_concurrent_requests(stream):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda _: starlink_grpc.get_status(stream), range(64)))
+    assert all(status.device_info.hardware_version == "mock" for status in statuses)
+    assert stream.stats.snapshot()["get_status"]["count"] == 64
+
+
+def test_stream_reopens_after_failure(dish, stream):
+    starlink_grpc.get_status(stream)
+    first = stream._stream
+    # An unsupported request ends the whole stream, like a dropped connection
+    with pytest.raises(grpc.RpcError):
+        stream.handle(starlink_grpc.device_pb2.Request(get_location={}), timeout=5)
+    assert starlink_grpc.get_status(stream).device_info.id
+    assert stream._stream is not first
+
+
+def test_stream_with_latency_and_failures():
+    server, target, _ = mock_dish.start_server(bind="127.0.0.1:0", latency=0.01, failure_rate=0.2)
+    context = starlink_grpc.StreamContext(target=target)
+    try:
+        results = []
+        for _ in range(30):
+            try:
+                results.append(starlink_grpc.get_status(context).device_info.id)
+            except starlink_grpc.ChannelUnavailableError:
+                context.record_success()
+            except grpc.RpcError:
+                pass
+        assert results
+    finally:
+        context.close()
+        server.stop(None)
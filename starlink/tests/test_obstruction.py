@@ -0,0 +1,67 @@
+# flake8: noqa: E501
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+from obstruction import drop_held_frames, process_obstruction_maps, process_obstruction_timeslot, read_obstruction_map_parquet
+from satellites import sample_points
+from slots import slot_start
+
+
+def make_timeslot(slot, pixels, interval=0.5):
+    """One frame per entry of `pixels`, each adding that pixel, or repeating the previous frame if None.
+
+    As from the poller, the first frame is always marked changed.
+    """
+    frame = np.zeros(123 * 123, dtype=bool)
+    frames, changed = [], []
+    for pixel in pixels:
+        if pixel is not None:
+            frame = frame.copy()
+            frame[pixel] = True
+        frames.append(frame)
+        changed.append(not changed or pixel is not None)
+    timestamps = slot_start(slot) + 0.05 + interval * np.arange(len(pixels))
+    df = pd.DataFrame({"timestamp": timestamps, "frame_type": 1, "obstruction_map": frames})
+    return df, changed
+
+
+def test_stored_frames_rebuild_the_live_rows(tmp_path):
+    slots = [
+        make_timeslot(100, [None, 500, None, None, 640, 780, None, None]),
+        make_timeslot(101, [None, None, 1000, None, 1200, None]),
+    ]
+
+    live = io.StringIO(newline="")
+    writer = csv.writer(live)
+    for timeslot_df, _ in slots:
+        process_obstruction_timeslot(timeslot_df, writer)
+
+    path = tmp_path.joinpath("obstruction_map-run.parquet")
+    stored = pd.concat([drop_held_frames(df, changed) for df, changed in slots], ignore_index=True)
+    stored.to_parquet(path, engine="pyarrow", compression="zstd")
+    assert stored["obstruction_map"].isna().sum() == 7
+
+    process_obstruction_maps(read_obstruction_map_parquet(path), "run", directory=tmp_path)
+    assert tmp_path.joinpath("obstruction-data-run.csv").read_bytes().decode() == live.getvalue()
+
+
+def test_files_without_a_change_mask_are_read_as_they_are(tmp_path):
+    timeslot_df, _ = make_timeslot(100, [500, 640])
+    path = tmp_path.joinpath("obstruction_map-old.parquet")
+    timeslot_df.to_parquet(path)
+    df = read_obstruction_map_parquet(path)
+    assert "changed" not in df.columns
+    assert len(df) == 2
+
+
+def test_middle_sample_point_is_taken_by_time():
+    # A burst of rows in the first seconds, then one every second
+    timestamps = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9] + [float(s) for s in range(1, 14)]
+    observed = pd.DataFrame({"Timestamp": pd.to_datetime(timestamps, unit="s", utc=True), "Elevation": 0.0, "Azimuth": 0.0})
+    start, middle, end = sample_points(observed)
+    assert start["Timestamp"] == observed["Timestamp"].iloc[0]
+    assert end["Timestamp"] == observed["Timestamp"].iloc[-2]
+    assert middle["Timestamp"] == pd.Timestamp(6, unit="s", tz="UTC")
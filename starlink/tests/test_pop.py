@@ -0,0 +1,75 @@
+# flake8: noqa: E501
+import asyncio
+
+import pytest
+
+import pop
+
+
+class FakeDetector(pop.HomePopDetector):
+    def __init__(self, results, **kwargs):
+        super().__init__(retry_interval=30, refresh_interval=1800, **kwargs)
+        self.results = list(results)
+        self.lookups = 0
+
+    async def detect(self):
+        self.lookups += 1
+        self.pop = self.results.pop(0)
+        return self.pop
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pop.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def network(monkeypatch):
+    state = ["a"]
+    monkeypatch.setattr(pop, "network_state", lambda: state[0])
+    return state
+
+
+def check(detector):
+    return asyncio.run(detector.check())
+
+
+def test_failed_lookup_is_retried_with_backoff(clock, network):
+    detector = FakeDetector(["", "", "sttlwax1"])
+    assert check(detector) == "network_change"
+    assert detector.pop == ""
+    clock[0] += 29
+    assert check(detector) is None
+    clock[0] += 1
+    assert check(detector) == "retry"
+    # Second failure doubles the delay
+    clock[0] += 30
+    assert check(detector) is None
+    clock[0] += 30
+    assert check(detector) == "retry"
+    assert detector.pop == "sttlwax1"
+    clock[0] += 60
+    assert check(detector) is None
+    assert detector.lookups == 3
+
+
+def test_network_change_during_backoff_looks_up_at_once(clock, network):
+    detector = FakeDetector(["", "sttlwax1"])
+    assert check(detector) == "network_change"
+    network[0] = "b"
+    assert check(detector) == "network_change"
+    assert detector.pop == "sttlwax1"
+
+
+def test_failed_refresh_keeps_the_previous_pop(clock, network):
+    detector = FakeDetector(["sttlwax1", "", "sttlwax1"])
+    assert check(detector) == "network_change"
+    clock[0] += 1800
+    assert check(detector) == "refresh"
+    assert detector.pop == "sttlwax1"
+    clock[0] += 30
+    assert check(detector) == "retry"
+    assert detector.pop == "sttlwax1"
+    assert detector.lookups == 3
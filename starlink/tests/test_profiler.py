@@ -0,0 +1,74 @@
+# flake8: noqa: E501
+import pstats
+import threading
+
+import pytest
+
+import profiler
+
+
+def work(n):
+    return sum(i * i for i in range(n))
+
+
+@pytest.fixture
+def session(tmp_path):
+    session = profiler.start("cprofile", duration=60, directory=tmp_path)
+    yield session
+    profiler.stop()
+
+
+def test_concurrent_units_are_profiled(session):
+    barrier = threading.Barrier(3)
+    errors = []
+
+    def unit():
+        try:
+            with profiler.profiled():
+                barrier.wait(timeout=10)
+                work(10000)
+                barrier.wait(timeout=10)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=unit) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert session.profiles
+    calls = sum(count[0] for func, count in pstats.Stats(*session.profiles).stats.items() if func[2] == "work")
+    assert calls == 3
+    assert profiler._shared_profile is None
+
+
+def test_unit_runs_unprofiled_when_another_profiler_is_active(session):
+    import sys
+
+    sys.setprofile(lambda *args: None)
+    try:
+        with profiler.profiled():
+            work(10)
+    finally:
+        sys.setprofile(None)
+    assert not session.profiles
+
+
+def test_stop_ends_the_session_and_writes_it(session):
+    with profiler.profiled():
+        work(10)
+    assert profiler.stop() is session
+    assert session.done and not session.thread.is_alive()
+    assert session.path.exists()
+    # Units of work after the session ended are not profiled
+    with profiler.profiled():
+        work(10)
+    assert len(session.profiles) == 1
+    assert profiler.stop() is None
+    assert profiler.handle_command("stop") == "error: no profiling session is running"
+
+
+def test_frame_name():
+    assert profiler._frame_name(work.__code__) == "test_profiler:work"
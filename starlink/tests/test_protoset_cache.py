@@ -0,0 +1,157 @@
+# flake8: noqa: E501
+import os
+import subprocess
+import sys
+import textwrap
+
+from google.protobuf import descriptor_pb2
+
+import mock_dish
+import starlink_grpc
+from conftest import STARLINK_DIR
+
+
+def stale_protoset():
+    """The mock dish protocol from before get_obstruction_map was renumbered."""
+    fdset = descriptor_pb2.FileDescriptorSet.FromString(mock_dish.minimal_protoset())
+    for file_proto in fdset.file:
+        for message in file_proto.message_type:
+            if message.name == "Request":
+                for field in message.field:
+                    if field.name == "dish_get_obstruction_map":
+                        field.number = 999
+    return fdset.SerializeToString()
+
+
+def run(script, cache_dir):
+    # The cache is loaded at import time, so each case needs a new process
+    env = dict(os.environ,
+               STARLINK_GRPC_PROTOSET_DIR=str(cache_dir),
+               PYTHONPATH=str(STARLINK_DIR.joinpath("starlink-grpc-tools")))
+    result = subprocess.run([sys.executable, "-c", textwrap.dedent(script)],
+                            env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+def write_stale_cache(cache_dir):
+    protoset = stale_protoset()
+    path = cache_dir.joinpath(starlink_grpc.protoset_filename(protoset))
+    path.write_bytes(protoset)
+    return path
+
+
+def test_stale_cache_is_dropped_and_reflected_again(tmp_path):
+    stale = write_stale_cache(tmp_path)
+    output = run("""
+        import mock_dish
+        import starlink_grpc
+
+        print(starlink_grpc.imports_pending)
+        server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+        context = starlink_grpc.ChannelContext(target)
+        try:
+            print(starlink_grpc.get_obstruction_map(context).num_rows)
+            print(starlink_grpc.get_obstruction_map(context).num_rows)
+        finally:
+            context.close()
+            server.stop(None)
+    """, tmp_path)
+    assert output == ["False", "123", "123"]
+    assert not stale.exists()
+    # Reflected from a test server, so not cached
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stale_cache_is_dropped_by_async_calls(tmp_path):
+    stale = write_stale_cache(tmp_path)
+    output = run("""
+        import asyncio
+
+        import mock_dish
+        import starlink_grpc_aio
+
+        async def main(target):
+            async with starlink_grpc_aio.AsyncChannelContext(target) as context:
+                return await starlink_grpc_aio.get_obstruction_map(context)
+
+        server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+        try:
+            print(asyncio.run(main(target)).num_rows)
+        finally:
+            server.stop(None)
+    """, tmp_path)
+    assert output == ["123"]
+    assert not stale.exists()
+
+
+def test_concurrent_async_calls_reflect_once_on_any_loop(tmp_path):
+    output = run("""
+        import asyncio
+
+        import mock_dish
+        import starlink_grpc
+        import starlink_grpc_aio
+
+        reflections = []
+        resolve_lazy_imports = starlink_grpc.importer.resolve_lazy_imports
+
+        def counting(channel):
+            reflections.append(channel)
+            return resolve_lazy_imports(channel)
+
+        starlink_grpc.importer.resolve_lazy_imports = counting
+
+        async def main(target):
+            async with starlink_grpc_aio.AsyncChannelContext(target) as context:
+                status, history, obstruction_map = await asyncio.gather(
+                    starlink_grpc_aio.get_status(context),
+                    starlink_grpc_aio.get_history(context),
+                    starlink_grpc_aio.get_obstruction_map(context),
+                )
+                return obstruction_map.num_rows
+
+        server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+        try:
+            print(starlink_grpc.imports_pending)
+            print(asyncio.run(main(target)))
+            print(asyncio.run(main(target)))
+            print(len(reflections))
+        finally:
+            server.stop(None)
+    """, tmp_path)
+    assert output == ["True", "123", "123", "1"]
+
+
+def test_only_the_default_target_is_cached(tmp_path):
+    output = run("""
+        import mock_dish
+        import starlink_grpc
+
+        server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+        context = starlink_grpc.ChannelContext(target)
+        try:
+            starlink_grpc.get_status(context)
+            print(starlink_grpc.imports_pending)
+        finally:
+            context.close()
+            server.stop(None)
+    """, tmp_path)
+    assert output == ["False"]
+    assert list(tmp_path.iterdir()) == []
+
+    run("""
+        import grpc
+
+        import mock_dish
+        import starlink_grpc
+
+        server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+        try:
+            with grpc.insecure_channel(target) as channel:
+                # As if the dish had answered on its usual address
+                starlink_grpc.resolve_imports(channel, starlink_grpc.DEFAULT_TARGET)
+        finally:
+            server.stop(None)
+    """, tmp_path)
+    assert [path.name for path in tmp_path.iterdir()] == [starlink_grpc.protoset_filename(mock_dish.minimal_protoset())]
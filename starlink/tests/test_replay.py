@@ -0,0 +1,99 @@
+# flake8: noqa: E501
+import time
+
+import pytest
+
+import mock_dish
+import poller
+import starlink_grpc
+from poller import ObstructionPoller
+from slots import SlotClock, slot_id, slot_start
+
+
+@pytest.fixture(scope="module")
+def log(tmp_path_factory):
+    """A response log of a status request, a map reset and six maps, recorded from the mock dish.
+
+    The maps are 0.2 s apart, slower than the poller bursts, so a replayed
+    poller waits for each of them.
+    """
+    server, target, _ = mock_dish.start_server(bind="127.0.0.1:0")
+    path = tmp_path_factory.mktemp("replay").joinpath("dish.log")
+    context = starlink_grpc.RecordingContext(str(path), target=target)
+    sent = []
+    try:
+        starlink_grpc.get_status(context)
+        starlink_grpc.reset_obstruction_map(context)
+        for _ in range(6):
+            sent.append(time.time())
+            starlink_grpc.obstruction_map_array(context)
+            time.sleep(0.2)
+    finally:
+        context.close()
+        server.stop(None)
+    return path, sent
+
+
+def test_log_records_wall_clock_times(log):
+    path, sent = log
+    records = [record for record in starlink_grpc.read_response_log(str(path)) if record[0] == starlink_grpc.LOG_RESPONSE]
+    assert len(records) == 8
+    assert all(received >= send for _, send, received, _ in records)
+    # Each map request was sent after the test took its time, and before its response arrived
+    for before, (_, send, received, _) in zip(sent, records[2:]):
+        assert before <= send / 1e9 <= received / 1e9
+
+
+def test_replay_clock_follows_the_recorded_send_times(log, monkeypatch):
+    # Polls are due before each recorded map however long the recording took
+    for name in ("OBSTRUCTION_POLL_INTERVAL", "OBSTRUCTION_IDLE_INTERVAL"):
+        monkeypatch.setattr(poller, name, poller.OBSTRUCTION_BURST_INTERVAL)
+    path, _ = log
+    records = [record for record in starlink_grpc.read_response_log(str(path)) if record[0] == starlink_grpc.LOG_RESPONSE]
+    context = starlink_grpc.ReplayContext(str(path), speed=0)
+    clock = context.clock
+    assert clock.time() == records[0][1] / 1e9
+    starlink_grpc.get_status(context)
+    starlink_grpc.reset_obstruction_map(context)
+    assert clock.time() == records[1][2] / 1e9
+
+    stamps = []
+
+    def fetch():
+        frame = starlink_grpc.obstruction_map_array(context).ravel()
+        # What the poller stamps the frame with
+        stamps.append(clock.time())
+        return frame
+
+    with pytest.raises(starlink_grpc.GrpcError):
+        ObstructionPoller(fetch, clock=clock).poll_timeslot(14)
+    # Every map is stamped with the time its response was recorded at, not the time of the replay
+    assert stamps == [received / 1e9 for _, _, received, _ in records[2:]]
+    assert context.finished
+
+
+def test_replay_is_shared_in_step(log):
+    path, _ = log
+    context = starlink_grpc.ReplayContext(str(path), speed=0)
+    for _ in range(6):
+        starlink_grpc.obstruction_map_array(context)
+    context.close()
+    # Closing does not rewind, the next consumer continues where the last one stopped
+    with pytest.raises(starlink_grpc.GrpcError) as excinfo:
+        starlink_grpc.obstruction_map_array(context)
+    assert isinstance(excinfo.value.__cause__, starlink_grpc.ReplayFinished)
+
+
+def test_replay_clock_threads_and_sleeps(log):
+    path, _ = log
+    context = starlink_grpc.ReplayContext(str(path), speed=0)
+    clock = SlotClock(context.clock)
+    start = context.clock.time()
+    slot = clock.wait_for_next_slot()
+    assert slot == slot_id(start) + 1
+    assert context.clock.time() == pytest.approx(slot_start(slot))
+    # A sleep at speed 0 takes no real time
+    before = time.monotonic()
+    context.clock.sleep(3600)
+    assert time.monotonic() - before < 1
+
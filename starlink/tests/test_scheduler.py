@@ -0,0 +1,100 @@
+# flake8: noqa: E501
+import asyncio
+import time
+
+import pytest
+
+import scheduler
+from scheduler import Job, JobDone, Scheduler
+
+
+async def run_until(scheduler, condition, timeout=5):
+    """Run the scheduler until `condition()` holds, then cancel it."""
+    task = asyncio.create_task(scheduler.run())
+    try:
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+
+def test_aligned_runs_fall_on_interval_multiples():
+    job = Job("aligned", lambda: None, 3600, align=True)
+    assert job.next_run(7200.0) == 10800.0
+    assert job.next_run(7200.5) == 10800.0
+    assert job.next_run(10799.9) == 10800.0
+    # Unaligned runs are spaced from the previous one
+    assert Job("spaced", lambda: None, 3600).next_run(7200.5) == 10800.5
+
+
+def test_jitter_delays_within_bounds():
+    job = Job("jittered", lambda: None, 60, jitter=5, align=True)
+    for _ in range(100):
+        assert 120.0 <= job.next_run(100.0) <= 125.0
+
+
+def test_running_job_is_skipped_not_overlapped():
+    running = 0
+    overlaps = []
+    release = None
+
+    async def job():
+        nonlocal running
+        running += 1
+        overlaps.append(running)
+        try:
+            await release.wait()
+        finally:
+            running -= 1
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        sched = Scheduler(max_workers=1)
+        sched.add("overlap", job, 0.01)
+        skipped = sched.jobs["overlap"].skipped
+        await run_until(sched, lambda: skipped.value >= 5)
+        release.set()
+        return skipped.value
+
+    skipped = asyncio.run(main())
+    assert skipped >= 5
+    # Only the first run started, every other one was due while it was going
+    assert overlaps == [1]
+
+
+def test_failed_back_to_back_job_is_retried_after_the_delay(monkeypatch):
+    monkeypatch.setattr(scheduler, "RETRY_DELAY", 0.2)
+    starts = []
+
+    def job():
+        starts.append(time.monotonic())
+        if len(starts) == 1:
+            raise RuntimeError("first run fails")
+        raise JobDone("finished")
+
+    sched = Scheduler(max_workers=1)
+    sched.add("retried", job, 0)
+    asyncio.run(asyncio.wait_for(sched.run(), timeout=5))
+    assert len(starts) == 2
+    assert starts[1] - starts[0] >= 0.2
+    assert sched.jobs["retried"].failed.value == 1
+    assert sched.jobs["retried"].done
+
+
+def test_done_job_is_not_run_again():
+    runs = []
+
+    def job():
+        runs.append(1)
+        if len(runs) == 2:
+            raise JobDone("finished")
+
+    sched = Scheduler(max_workers=1)
+    sched.add("job", job, 0)
+    asyncio.run(asyncio.wait_for(sched.run(), timeout=5))
+    assert len(runs) == 2
+    assert sched.jobs["job"].done
@@ -0,0 +1,86 @@
+# flake8: noqa: E501
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+from skyfield.api import load
+
+import mock_dish
+import starlink_grpc
+from benchmark import OBSERVER, synthetic_tle
+from obstruction import white_pixel_coords
+from simulator import SimulatedDish, sky_to_pixel
+from slots import slot_id
+
+
+@pytest.fixture(scope="module")
+def satellites(tmp_path_factory):
+    path = tmp_path_factory.mktemp("tle").joinpath("tle.txt")
+    path.write_text(synthetic_tle())
+    return load.tle_file(str(path))
+
+
+@pytest.fixture(scope="module")
+def simulator(satellites):
+    state = SimulatedDish(satellites, *OBSERVER, tilt=5.0, azimuth=30.0)
+    server, target, _ = mock_dish.start_server(bind="127.0.0.1:0", dish=state)
+    yield target, state
+    server.stop(None)
+
+
+def test_satellites_are_propagated_outside_the_dish_lock(satellites):
+    state = SimulatedDish(satellites, *OBSERVER)
+    locked = []
+    serving_satellite = state.serving_satellite
+
+    def check(slot):
+        if slot not in state.slots:
+            locked.append(state.lock.locked())
+        return serving_satellite(slot)
+
+    state.serving_satellite = check
+    pool = mock_dish.load_protoset()
+    request_class = mock_dish.message_factory.GetMessageClass(pool.FindMessageTypeByName("SpaceX.API.Device.Request"))
+    response_class = mock_dish.message_factory.GetMessageClass(pool.FindMessageTypeByName("SpaceX.API.Device.Response"))
+    assert state.handle(request_class(get_status={}), response_class())
+    assert locked and not any(locked)
+
+
+def test_collector_against_simulator(simulator, monkeypatch):
+    import dish
+
+    target, state = simulator
+    monkeypatch.setattr(dish, "STARLINK_GRPC_ADDR_PORT", target)
+
+    assert dish.get_current_dish_orientation() == {"tilt": 5.0, "azimuth": 30.0}
+    assert dish.get_obstruction_map_frame_type() == (1, "FRAME_EARTH")
+
+    context = dish.dish_context()
+    try:
+        starlink_grpc.reset_obstruction_map(context)
+        start = time.time()
+        timestamps, frames = [], []
+        while time.time() < start + 3.0:
+            timestamps.append(time.time())
+            frames.append(dish.fetch_obstruction_frame(context))
+            time.sleep(0.25)
+        connected = dish.is_dish_connected(context)
+    finally:
+        context.close()
+
+    now = int(datetime.now(timezone.utc).timestamp())
+    if state.serving_satellite(slot_id(now)) is None:
+        assert not connected
+        pytest.skip("No satellite above the elevation mask right now")
+    assert connected
+
+    # The newest pixel of the map is where the serving satellite was in one of the polled seconds
+    coords = white_pixel_coords(pd.DataFrame({"timestamp": timestamps, "obstruction_map": frames}))
+    assert coords
+    expected = set()
+    for second in range(int(start) - 1, now + 1):
+        position = state._position(second)
+        if position is not None:
+            expected.add(tuple(int(v) for v in sky_to_pixel(position[0], position[1])))
+    assert coords[-1][1] in expected
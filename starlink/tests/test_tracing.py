@@ -0,0 +1,85 @@
+# flake8: noqa: E501
+import json
+import threading
+import time
+
+import pytest
+
+import metrics
+import tracing
+from slots import SLOT_SECONDS, slot_start
+from tracing import SlotTrace, TraceLog
+
+
+def test_concurrent_writes_with_rollover(tmp_path):
+    path = tmp_path.joinpath("slot-trace.jsonl")
+    trace_log = TraceLog(path, max_bytes=2000, backups=1000)
+
+    def write(worker):
+        for i in range(100):
+            trace = SlotTrace(worker * 1000 + i, "test")
+            trace.set(outcome="no_location")
+            trace_log.write(trace)
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    trace_log.close()
+
+    lines = [line for file in tmp_path.iterdir() for line in file.read_text().splitlines()]
+    slots = sorted(json.loads(line)["slot"] for line in lines)
+    assert slots == sorted(worker * 1000 + i for worker in range(4) for i in range(100))
+    assert trace_log.summary()["slots"] == 400
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_deadline_follows_the_given_clock():
+    slot = 1000
+    clock = FakeClock(slot_start(slot) + SLOT_SECONDS + 5)
+    trace = SlotTrace(slot, "test", clock=clock)
+    assert not trace.record()["deadline_miss"]
+    clock.now += SLOT_SECONDS
+    record = trace.record()
+    assert record["deadline_miss"]
+    assert record["finished_after_slot_end"] == pytest.approx(SLOT_SECONDS + 5)
+
+
+def test_processing_time_counts_from_the_hand_over():
+    slot = 1000
+    clock = FakeClock(slot_start(slot) + SLOT_SECONDS + 1)
+    trace = SlotTrace(slot, "test", clock=clock)
+    trace.enqueue()
+    # The processing thread's view of a replay clock does not move
+    clock.now = 0
+    time.sleep(0.05)
+    finished_after = trace.record()["finished_after_slot_end"]
+    assert 1.05 <= finished_after < 2
+
+
+def test_older_slot_does_not_replace_the_serving_satellite(monkeypatch):
+    monkeypatch.setattr(tracing, "_serving", None)
+    def matched(slot, satellite, slant_range_km, match_score):
+        trace = SlotTrace(slot, "test")
+        trace.set(outcome="matched", satellite=satellite, slant_range_km=slant_range_km, match_score=match_score)
+        return trace.record()
+
+    tracing.update_metrics(matched(2001, "STARLINK-2", 600.0, 1.5))
+    # Finished later, but polled earlier
+    tracing.update_metrics(matched(2000, "STARLINK-1", 900.0, 9.0))
+
+    assert tracing.serving_satellite() == (2001, "STARLINK-2")
+    rendered = metrics.render()
+    assert 'serving_satellite_info{satellite="STARLINK-2"} 1' in rendered
+    assert "STARLINK-1" not in rendered
+    assert tracing.slant_range.get() == 600.0
+    assert tracing.match_score.get() == 1.5
+    assert tracing.last_match.get() == slot_start(2001)
@@ -0,0 +1,105 @@
+# flake8: noqa: E501
+import os
+
+import numpy as np
+import pytest
+
+import util
+
+
+def ping_output(replies):
+    """ping -D output for (timestamp, icmp_seq, rtt) replies."""
+    lines = ["PING 100.64.0.1 (100.64.0.1) 56(84) bytes of data."]
+    for timestamp, sequence, rtt in replies:
+        lines.append(f"[{timestamp:.6f}] 64 bytes from 100.64.0.1: icmp_seq={sequence} ttl=56 time={rtt} ms")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def test_sequence_numbers_wrap_around():
+    # 65540 probes 10 ms apart, with one lost after icmp_seq wrapped to 0
+    replies = [(1000 + index * 0.01, index % 65536, 30.0) for index in range(1, 65541) if index != 65538]
+    df = util.parse_ping(ping_output(replies))
+    assert df["icmp_seq"].tolist() == list(range(1, 65541))
+    assert df.index[df["lost"]].tolist() == [65537]
+    assert df["timestamp"][65537] == pytest.approx(1000 + 65538 * 0.01)
+
+
+def test_duplicate_replies_are_dropped():
+    replies = [(1000.0, 1, 30.0), (1001.0, 2, 31.0), (1001.5, 2, 90.0), (1002.0, 3, 32.0)]
+    df = util.parse_ping(ping_output(replies))
+    assert df["icmp_seq"].tolist() == [1, 2, 3]
+    # The first reply is the one to the probe, later ones are duplicates
+    assert df["rtt"].tolist() == [30.0, 31.0, 32.0]
+    assert not df["lost"].any()
+
+
+def test_leading_and_middle_losses_are_filled_in():
+    replies = [(1002.0, 3, 30.0), (1003.0, 4, 31.0), (1006.0, 7, 32.0)]
+    df = util.parse_ping(ping_output(replies))
+    assert df["icmp_seq"].tolist() == [1, 2, 3, 4, 5, 6, 7]
+    assert df["lost"].tolist() == [True, True, False, False, True, True, False]
+    assert np.isnan(df["rtt"][df["lost"]]).all()
+    # Extrapolated back at the probe interval, and interpolated between replies
+    assert df["timestamp"].tolist() == pytest.approx([1000.0, 1001.0, 1002.0, 1003.0, 1004.0, 1005.0, 1006.0])
+
+
+def test_trailing_losses_end_the_run():
+    # Probes after the last reply cannot be told apart from the end of the run
+    replies = [(1000.0, 1, 30.0), (1001.0, 2, 31.0)]
+    df = util.parse_ping(ping_output(replies) + b"\n--- 100.64.0.1 ping statistics ---\n5 packets transmitted, 2 received, 60% packet loss\n")
+    assert df["icmp_seq"].tolist() == [1, 2]
+    assert not df["lost"].any()
+
+
+def test_no_replies():
+    df = util.parse_ping(ping_output([]))
+    assert df.empty
+    assert list(df.columns) == ["timestamp", "icmp_seq", "rtt", "lost"]
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Count calls of parse_ping."""
+    calls = []
+    parse_ping = util.parse_ping
+
+    def counting(buffer):
+        calls.append(len(buffer))
+        return parse_ping(buffer)
+
+    monkeypatch.setattr(util, "parse_ping", counting)
+    return calls
+
+
+def test_sidecar_is_used_until_the_source_changes(tmp_path, parses):
+    path = tmp_path.joinpath("ping-10ms-run.txt")
+    path.write_bytes(ping_output([(1000.0, 1, 30.0), (1001.0, 3, 31.0)]))
+
+    first = util.load_ping(path)
+    assert tmp_path.joinpath("ping-10ms-run.parquet").exists()
+    assert util.load_ping(path).equals(first)
+    assert len(parses) == 1
+
+    # A longer file invalidates the sidecar
+    with open(path, "ab") as outfile:
+        outfile.write(b"[1002.000000] 64 bytes from 100.64.0.1: icmp_seq=4 ttl=56 time=32.0 ms\n")
+    assert util.load_ping(path)["icmp_seq"].tolist() == [1, 2, 3, 4]
+    assert len(parses) == 2
+
+    # So does one of the same size with another modification time
+    path.write_bytes(path.read_bytes().replace(b"time=32.0", b"time=33.0"))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert util.load_ping(path)["rtt"].tolist()[-1] == 33.0
+    assert len(parses) == 3
+    assert util.load_ping(path)["rtt"].tolist()[-1] == 33.0
+    assert len(parses) == 3
+
+
+def test_unreadable_sidecar_is_replaced(tmp_path, parses):
+    path = tmp_path.joinpath("ping-10ms-run.txt")
+    path.write_bytes(ping_output([(1000.0, 1, 30.0)]))
+    tmp_path.joinpath("ping-10ms-run.parquet").write_bytes(b"not parquet")
+    assert util.load_ping(path)["rtt"].tolist() == [30.0]
+    assert util.load_ping(path)["rtt"].tolist() == [30.0]
+    assert len(parses) == 1
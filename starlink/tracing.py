@@ -0,0 +1,224 @@
+# flake8: noqa: E501
+"""Per-timeslot trace records for the collector.
+
+Each timeslot gets a SlotTrace that times the stages it goes through, from
+the obstruction map reset to the serving satellite being saved. Finished
+traces are written as one JSON line each to a size-rotated file, and
+summarized as percentiles per stage at the end of each collection cycle, so
+a slot without a serving satellite can be traced back to a slow poll, a slow
+read or an estimation that overran.
+
+A slot misses its deadline when its results are saved more than one slot
+length after the slot ended, i.e. after the next slot's results are due.
+
+Finished traces also update the slot and serving satellite metrics.
+"""
+
+import json
+import time
+import logging
+import threading
+import contextlib
+import logging.handlers
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+
+import metrics
+from config import TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUPS
+from slots import SLOT_SECONDS, slot_start
+
+logger = logging.getLogger(__name__)
+
+SPANS = ("reset", "poll", "diff", "sky_transform", "tle_load", "read", "matching", "distance", "persistence")
+PERCENTILES = (50, 90, 99)
+COMPLETION_BUCKETS = (14, 15, 16, 18, 20, 25, 30, 45, 60, 120)
+
+deadline_misses = metrics.counter("slot_deadline_misses_total", "Slots whose results were saved after the next slot ended")
+completion = metrics.histogram(
+    "slot_completion_seconds", "Time from the start of a slot until its results were saved", buckets=COMPLETION_BUCKETS
+)
+queue_wait = metrics.histogram("slot_queue_wait_seconds", "Time a polled slot waited before processing started")
+slant_range = metrics.gauge("serving_satellite_slant_range_km", "Distance to the serving satellite at the end of the last matched slot")
+match_score = metrics.gauge("serving_satellite_match_score", "Trajectory difference score of the serving satellite, lower is better")
+runner_up_margin = metrics.gauge(
+    "serving_satellite_runner_up_margin", "Score difference between the second best candidate and the serving satellite"
+)
+last_match = metrics.gauge("serving_satellite_last_match_timestamp_seconds", "Start of the last slot with a serving satellite")
+_serving_labels = None
+_serving_lock = threading.Lock()
+# (slot, satellite) of the last matched slot
+_serving = None
+
+
+class SlotTrace:
+    """Timings and outcome of one timeslot.
+
+    Args:
+        clock: Provides time(), by default the time module. When replaying,
+            the replay clock, so that deadlines follow the recorded timeline.
+    """
+
+    def __init__(self, slot, run_id, clock=time):
+        self.slot = slot
+        self.run_id = run_id
+        self.clock = clock
+        self.spans = {}
+        self.attributes = {}
+        self.enqueued = None
+        self.enqueued_at = None
+        self.queue_wait = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time a stage. Repeated stages add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def add_spans(self, spans):
+        """Add stage timings measured elsewhere, e.g. in a worker process."""
+        with self._lock:
+            for name, seconds in spans.items():
+                self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def enqueue(self):
+        """Mark the slot as handed over for processing."""
+        self.enqueued = time.monotonic()
+        self.enqueued_at = self.clock.time()
+
+    def dequeue(self):
+        """Mark the start of processing, recording how long the slot waited."""
+        if self.enqueued is not None:
+            self.queue_wait = time.monotonic() - self.enqueued
+
+    def finished_at(self):
+        """Current time on the clock, as seen by the thread that polled the slot."""
+        if self.enqueued is None:
+            return self.clock.time()
+        # A replay clock has not moved in the processing thread, so add the
+        # time spent since the hand-over to the polling thread's time instead
+        return self.enqueued_at + (time.monotonic() - self.enqueued)
+
+    def record(self):
+        finished_after = self.finished_at() - (slot_start(self.slot) + SLOT_SECONDS)
+        return {
+            "slot": self.slot,
+            "slot_start": slot_start(self.slot),
+            "run": self.run_id,
+            "spans": {name: round(seconds, 6) for name, seconds in self.spans.items()},
+            "queue_wait": None if self.queue_wait is None else round(self.queue_wait, 6),
+            "finished_after_slot_end": round(finished_after, 3),
+            "deadline_miss": finished_after > SLOT_SECONDS,
+            **self.attributes,
+        }
+
+
+def serving_satellite():
+    """(slot, satellite name) of the last matched slot, or None."""
+    return _serving
+
+
+def update_metrics(record):
+    """Update the slot and serving satellite metrics from a trace record."""
+    global _serving_labels, _serving
+    metrics.counter("slots_processed_total", "Slots processed, by outcome", {"outcome": record.get("outcome", "unknown")}).inc()
+    if record["deadline_miss"]:
+        deadline_misses.inc()
+    completion.observe(record["finished_after_slot_end"] + SLOT_SECONDS)
+    if record["queue_wait"] is not None:
+        queue_wait.observe(record["queue_wait"])
+    for name, seconds in record["spans"].items():
+        metrics.histogram("slot_stage_seconds", "Time spent in each stage of slot processing", {"stage": name}).observe(seconds)
+
+    if record.get("outcome") != "matched" or not record.get("satellite"):
+        return
+    with _serving_lock:
+        if _serving is not None and record["slot"] < _serving[0]:
+            # Slots are processed concurrently, so an older slot can finish
+            # after a newer one. The serving satellite metrics keep the newer.
+            return
+        _serving = (record["slot"], record["satellite"])
+        labels = {"satellite": record["satellite"]}
+        if labels != _serving_labels:
+            if _serving_labels is not None:
+                metrics.remove("serving_satellite_info", _serving_labels)
+            metrics.gauge("serving_satellite_info", "Satellite serving the dish in the last matched slot", labels).set(1)
+            _serving_labels = labels
+        last_match.set(record["slot_start"])
+        for gauge, key in ((slant_range, "slant_range_km"), (match_score, "match_score"), (runner_up_margin, "runner_up_margin")):
+            value = record.get(key)
+            gauge.set(float("nan") if value is None else value)
+
+
+def span(trace, name):
+    """Time a stage of `trace`, or do nothing if there is no trace."""
+    return trace.span(name) if trace is not None else contextlib.nullcontext()
+
+
+class TraceLog:
+    """Writes finished traces and summarizes them per collection cycle."""
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._lock = threading.Lock()
+        self._records = []
+
+    def write(self, trace):
+        record = trace.record()
+        # handle() takes the handler lock, as workers write concurrently and rollover must not interleave with writes
+        self._handler.handle(logging.makeLogRecord({"msg": json.dumps(record, default=str)}))
+        with self._lock:
+            self._records.append(record)
+        if record["deadline_miss"]:
+            logger.warning(
+                f"[{trace.run_id}] Slot {trace.slot} finished {record['finished_after_slot_end']:.1f}s after it ended, deadline missed"
+            )
+        update_metrics(record)
+        return record
+
+    def summary(self):
+        """Return and reset the summary of the traces written since the last call."""
+        with self._lock:
+            records, self._records = self._records, []
+        result = {
+            "slots": len(records),
+            "deadline_misses": sum(1 for r in records if r["deadline_miss"]),
+            "outcomes": dict(Counter(r.get("outcome", "unknown") for r in records)),
+            "spans": {},
+        }
+        series = {name: [r["spans"][name] for r in records if name in r["spans"]] for name in SPANS}
+        series["queue_wait"] = [r["queue_wait"] for r in records if r["queue_wait"] is not None]
+        series["total"] = [sum(r["spans"].values()) for r in records]
+        for name, values in series.items():
+            if values:
+                result["spans"][name] = dict(
+                    zip((f"p{p}" for p in PERCENTILES), np.percentile(values, PERCENTILES).round(4).tolist()),
+                    max=round(max(values), 4),
+                )
+        return result
+
+    def log_summary(self):
+        summary = self.summary()
+        if not summary["slots"]:
+            return summary
+        logger.info(
+            f"Slot traces: {summary['slots']} slots, {summary['deadline_misses']} deadline misses, outcomes {summary['outcomes']}"
+        )
+        for name, stats in summary["spans"].items():
+            logger.info(f"  {name:<14} " + " ".join(f"{key}={value * 1000:.1f}ms" for key, value in stats.items()))
+        return summary
+
+    def close(self):
+        self._handler.close()
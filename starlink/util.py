@@ -1,58 +1,130 @@
 # flake8: noqa: E501
 
+import re
 import time
 import logging
-import threading
-import multiprocessing
 from datetime import datetime, timezone
 from pathlib import Path
 from shutil import which
-from skyfield.api import load
-
 
-from config import DATA_DIR, TLE_DATA_DIR, TLE_URL
+from config import DATA_DIR, TLE_DATA_DIR, TLE_URL, TLE_CACHE_TTL
 
 logging.basicConfig(
     level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s"
 )
-
-# flake8: noqa: E501
-import re
-from datetime import datetime
-
-import pytz
-import pandas as pd
-from skyfield.api import load
+logger = logging.getLogger(__name__)
+
+# pandas and skyfield are imported by the functions that need them, since
+# every entry point imports this module and most only use the helpers below.
+
+
+# Reply lines of ping -D, e.g.
+# [1700000000.123456] 64 bytes from 100.64.0.1: icmp_seq=1 ttl=56 time=31.2 ms
+PING_REPLY_PATTERN = re.compile(rb"^\[([\d.]+)\][^\n]* icmp_seq=(\d+)[^\n]* time=([\d.]+)", re.MULTILINE)
+# Schema metadata key of ping sidecars, holding the size and mtime of the source
+PING_SIDECAR_SOURCE = b"leoviz_source"
+
+
+def parse_ping(buffer):
+    """Parse ping -D output into a DataFrame of timestamp, icmp_seq, rtt and lost.
+
+    Sequence numbers missing between replies are lost probes, with rtt NaN
+    and a timestamp interpolated from their neighbours. Losses after the
+    last reply cannot be told apart from the end of the run.
+    """
+    import numpy as np
+    import pandas as pd
+
+    matches = PING_REPLY_PATTERN.findall(buffer)
+    if not matches:
+        return pd.DataFrame({"timestamp": [], "icmp_seq": [], "rtt": [], "lost": []}).astype(
+            {"timestamp": np.float64, "icmp_seq": np.int64, "rtt": np.float64, "lost": bool}
+        )
+    timestamps, sequence, rtts = zip(*matches)
+    timestamps = np.fromiter(map(float, timestamps), np.float64, len(matches))
+    sequence = np.fromiter(map(int, sequence), np.int64, len(matches))
+    rtts = np.fromiter(map(float, rtts), np.float64, len(matches))
+
+    # Undo the 16 bit wrap of icmp_seq, then drop duplicate replies
+    sequence += 65536 * np.cumsum(np.diff(sequence, prepend=sequence[0]) < -32768)
+    sequence, first = np.unique(sequence, return_index=True)
+    timestamps, rtts = timestamps[first], rtts[first]
+
+    # ping numbers probes from 1
+    expected = np.arange(min(sequence[0], 1), sequence[-1] + 1)
+    lost = ~np.isin(expected, sequence, assume_unique=True)
+    all_timestamps = np.interp(expected, sequence, timestamps)
+    if len(sequence) > 1:
+        interval = np.median(np.diff(timestamps) / np.diff(sequence))
+        before = expected < sequence[0]
+        all_timestamps[before] = timestamps[0] - (sequence[0] - expected[before]) * interval
+    all_rtts = np.full(len(expected), np.nan)
+    all_rtts[~lost] = rtts
+    return pd.DataFrame({"timestamp": all_timestamps, "icmp_seq": expected, "rtt": all_rtts, "lost": lost})
 
 
 def load_ping(filename):
-    with open(filename, "r") as f:
-        rtt_list = []
-        timestamp_list = []
-        for line in f.readlines():
-            match = re.search(
-                r"\[(\d+\.\d+)\].*icmp_seq=(\d+).*time=(\d+(\.\d+)?)", line
-            )
-            if match:
-                # timestamp = datetime.fromtimestamp(float(match.group(1)), tz=pytz.utc)
-                timestamp = float(match.group(1))
-                rtt = float(match.group(3))
-                timestamp_list.append(timestamp)
-                rtt_list.append(rtt)
-
-    return pd.DataFrame(
-        {
-            "timestamp": timestamp_list,
-            "rtt": rtt_list,
-        }
-    )
+    """Load a latency run: the binary records of latency.py, or ping -D output.
+
+    Both have lost probes, with rtt NaN and lost True. Binary runs also have
+    the slot and serving satellite tags of every probe.
+
+    Parsed ping output is cached in a Parquet sidecar next to the file, which
+    later loads memory-map instead, until the file changes.
+    """
+    import pandas as pd
+
+    filename = Path(filename)
+    if filename.suffix == ".bin":
+        import numpy as np
+        from latency import RECORD_FIELDS
+
+        records = np.fromfile(filename, dtype=RECORD_FIELDS)
+        return pd.DataFrame(
+            {
+                "timestamp": records["send_ts"],
+                "rtt": records["rtt"].astype(np.float64),
+                "lost": records["lost"].astype(bool),
+                "slot": records["slot"],
+                "satellite_slot": records["satellite_slot"],
+                "satellite": records["satellite"].astype(str),
+            }
+        )
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sidecar = filename.with_suffix(".parquet")
+    stat = filename.stat()
+    source = f"{stat.st_size}:{stat.st_mtime_ns}".encode()
+    try:
+        table = pq.read_table(sidecar, memory_map=True)
+        if (table.schema.metadata or {}).get(PING_SIDECAR_SOURCE) == source:
+            return table.to_pandas()
+    except (OSError, pa.ArrowException):
+        pass
+
+    df = parse_ping(filename.read_bytes())
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), PING_SIDECAR_SOURCE: source})
+    temp = sidecar.with_name(f".{sidecar.name}.tmp")
+    try:
+        pq.write_table(table, temp)
+        temp.replace(sidecar)
+    except OSError as e:
+        logger.warning(f"Could not write ping sidecar {sidecar}: {e}")
+    return df
 
 
 def load_tle_from_file(filename):
+    from skyfield.api import load
+
     return load.tle_file(str(filename))
 
 
 def load_connected_satellites(filename):
+    import pandas as pd
+
     df = pd.read_csv(filename)
     return df
 
@@ -80,15 +152,22 @@ def failed(e: str) -> None:
         f.write("{}: {}\n".format(time.time(), e))
 
 
-def run(func):
-    job = multiprocessing.Process(target=func)
-    job.start()
-
-
 def load_tle():
+    """Refresh the Starlink TLE set through the asset cache.
+
+    A timestamped copy is kept in today's TLE directory, for matching and
+    backfill, but only written when the set changed or there is none yet today.
+    """
     global satellites
+    import assets
+
+    content = assets.fetch(TLE_URL, TLE_CACHE_TTL, "starlink-tle.txt")
     directory = Path(TLE_DATA_DIR).joinpath(ensure_data_directory(TLE_DATA_DIR))
-    satellites = load.tle_file(
-        TLE_URL, True, "{}/starlink-tle-{}.txt".format(directory, date_time_string())
-    )
+    existing = sorted(directory.glob("starlink-tle-*.txt"))
+    if existing and existing[-1].read_bytes() == content:
+        filename = existing[-1]
+    else:
+        filename = directory.joinpath("starlink-tle-{}.txt".format(date_time_string()))
+        filename.write_bytes(content)
+    satellites = load_tle_from_file(filename)
     print("Loaded {} Starlink TLE satellites".format(len(satellites)))